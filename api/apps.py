@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Register model signal handlers (rating aggregates, rule projection, search index, response cache)
+        # and the database hooks (SQLite pragmas, journal mode after migrate, query metrics)
+        from api import signals  # noqa: F401
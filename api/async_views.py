@@ -0,0 +1,191 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework import exceptions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.views import exception_handler
+
+from api.cache import movie_list_cache
+from api.metrics import timed_serializer_class
+from api.models import Movie
+from api.rules import asearch_rules
+from api.search import get_search_backend
+from api.serializers import ValuesSerializer
+from api.views import MovieListViewSet, MovieViewSet, RuleViewSet
+
+
+class AsyncAPIView(View):
+    """
+    Read-only async counterpart of APIView.
+
+    DRF views are synchronous, so under ASGI each request holds a thread (and its
+    database connection) until it finishes. These views await authentication through
+    aauthenticate(), the ORM and the cache instead. Responses go through JSONRenderer,
+    so bodies are the same as those of the matching DRF views.
+    """
+    http_method_names = ['get', 'head']
+    authentication_classes = ()
+    permission_classes = ()
+    renderer_class = JSONRenderer
+
+    async def dispatch(self, request, *args, **kwargs):
+        request = Request(request)
+        self.request = request
+        try:
+            await self.perform_authentication(request)
+            self.check_permissions(request)
+            if request.method.lower() not in self.http_method_names:
+                raise exceptions.MethodNotAllowed(request.method)
+            response = await getattr(self, request.method.lower())(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        return self.finalize_response(request, response)
+
+    async def perform_authentication(self, request):
+        self.authenticators = [auth() for auth in self.authentication_classes]
+        for authenticator in self.authenticators:
+            user_auth = await authenticator.aauthenticate(request)
+            if user_auth is not None:
+                request.user, request.auth = user_auth
+                return
+        request.user, request.auth = AnonymousUser(), None
+
+    def check_permissions(self, request):
+        for permission in self.get_permissions():
+            if not permission.has_permission(request, self):
+                self.permission_denied(request, permission)
+
+    def check_object_permissions(self, request, obj):
+        for permission in self.get_permissions():
+            if not permission.has_object_permission(request, self, obj):
+                self.permission_denied(request, permission)
+
+    def get_permissions(self):
+        return [permission() for permission in self.permission_classes]
+
+    def permission_denied(self, request, permission):
+        if self.authenticators and not request.user.is_authenticated:
+            raise exceptions.NotAuthenticated()
+        raise exceptions.PermissionDenied(getattr(permission, 'message', None), getattr(permission, 'code', None))
+
+    def handle_exception(self, exc):
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            # WWW-Authenticate header for 401 responses, else coerce to 403
+            auth_header = self.authenticators[0].authenticate_header(self.request) if self.authenticators else None
+            if auth_header:
+                exc.auth_header = auth_header
+            else:
+                exc.status_code = status.HTTP_403_FORBIDDEN
+
+        context = {'view': self, 'args': self.args, 'kwargs': self.kwargs, 'request': self.request}
+        response = exception_handler(exc, context)
+        if response is None:
+            raise exc
+        return response
+
+    def finalize_response(self, request, response):
+        if not isinstance(response, Response):
+            return response
+        # Rendered here: Django renders a returned Response in a worker thread
+        renderer = self.renderer_class()
+        content = renderer.render(response.data, renderer.media_type,
+                                  {'view': self, 'request': request, 'response': response})
+        rendered = HttpResponse(content, status=response.status_code, content_type=renderer.media_type)
+        for header, value in response.items():
+            if header.lower() != 'content-type':
+                rendered[header] = value
+        return rendered
+
+
+def astream_ndjson(queryset, serializer_class, chunk_size=1000):
+    """
+    stream_ndjson() for async views, reading the rows with .aiterator().
+    """
+    encoder = JSONEncoder(ensure_ascii=False)
+    if issubclass(serializer_class, ValuesSerializer):
+        queryset, represent = serializer_class.values(queryset), serializer_class.representer()
+    else:
+        def represent(obj):
+            return serializer_class(obj).data
+
+    async def lines():
+        async for obj in queryset.aiterator(chunk_size=chunk_size):
+            yield encoder.encode(represent(obj)) + '\n'
+
+    return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+
+class AsyncMovieListView(AsyncAPIView):
+    """
+    MovieListViewSet.list: the same shared response cache, search and pagination.
+    """
+    authentication_classes = MovieListViewSet.authentication_classes
+    permission_classes = MovieListViewSet.permission_classes
+
+    async def get(self, request):
+        cached = await movie_list_cache.aget_or_build(request, lambda: self.list_data(request))
+        not_modified = movie_list_cache.not_modified(request, cached)
+        if not_modified is not None:
+            return not_modified
+        return Response(cached.data, status=status.HTTP_200_OK, headers=cached.headers)
+
+    async def list_data(self, request):
+        queryset = MovieListViewSet.queryset.all()
+        if 'search' in request.query_params:
+            queryset = get_search_backend().search(queryset, request.query_params['search'])
+
+        values_serializer = timed_serializer_class(MovieListViewSet.values_serializer_class)
+        paginator = MovieListViewSet.pagination_class()
+        page = await paginator.apaginate_queryset(values_serializer.values(queryset), request, view=self)
+        serializer = values_serializer(page)
+        return paginator.get_paginated_response(serializer.data).data
+
+
+class AsyncMovieDetailView(AsyncAPIView):
+    """
+    MovieViewSet.retrieve, with the viewset's queryset (author, comment count and newest comments).
+    """
+    authentication_classes = MovieViewSet.authentication_classes
+    permission_classes = MovieViewSet.permission_classes
+
+    async def get(self, request, pk):
+        try:
+            movie = await MovieViewSet().get_queryset().aget(pk=pk)
+        except (TypeError, ValueError, ValidationError, Movie.DoesNotExist):
+            raise Http404
+        self.check_object_permissions(request, movie)
+
+        serializer = timed_serializer_class(MovieViewSet.serializer_class)(movie, context={'request': request, 'view': self})
+        return Response(serializer.data)
+
+
+class AsyncRuleListView(AsyncAPIView):
+    """
+    RuleViewSet.list: src/dst/port search, pagination and ?stream=1 NDJSON export.
+    """
+    authentication_classes = RuleViewSet.authentication_classes
+    permission_classes = RuleViewSet.permission_classes
+
+    async def get(self, request):
+        queryset = RuleViewSet.queryset.all()
+        params = request.query_params
+        if 'src' in params or 'dst' in params or 'port' in params:
+            try:
+                queryset = await asearch_rules(queryset, params.get('src', ''), params.get('dst', ''),
+                                               params.get('port', ''))
+            except ValueError:
+                return Response({'result': {'error': 'Check the searching ip or port format.'}},
+                                status.HTTP_400_BAD_REQUEST)
+
+        if params.get('stream') in ('1', 'true'):
+            return astream_ndjson(queryset, RuleViewSet.values_serializer_class, RuleViewSet.stream_chunk_size)
+
+        values_serializer = timed_serializer_class(RuleViewSet.values_serializer_class)
+        paginator = RuleViewSet.pagination_class()
+        page = await paginator.apaginate_queryset(values_serializer.values(queryset), request, view=self)
+        serializer = values_serializer(page)
+        return paginator.get_paginated_response(serializer.data)
@@ -0,0 +1,215 @@
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import router
+from django.db.models import DEFERRED
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import UntypedToken
+
+# User fields kept in the snapshot; everything else loads lazily if a view touches it
+SNAPSHOT_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name',
+                   'is_active', 'is_staff', 'is_superuser')
+
+
+class JWTUserCache:
+    """
+    Verified access token -> user snapshot, kept for the token's remaining lifetime
+    but at most JWT_USER_CACHE_MAX_TTL seconds.
+
+    Entries live in the Django cache named by JWT_USER_CACHE_ALIAS (an LRU-bounded
+    LocMemCache by default). Each user has a generation that is bumped whenever the
+    user is saved or deleted; snapshots taken under an older generation are ignored.
+    A per-process cache only sees the bumps made by its own worker, so the TTL cap
+    bounds how long other workers keep serving a deactivated user.
+    """
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'JWT_USER_CACHE_ALIAS', 'default')]
+
+    @staticmethod
+    def token_key(raw_token):
+        if isinstance(raw_token, str):
+            raw_token = raw_token.encode('utf-8')
+        return f'api:jwt:{hashlib.sha256(raw_token).hexdigest()}'
+
+    @staticmethod
+    def generation_key(user_id):
+        return f'api:jwt-user:{user_id}:generation'
+
+    def get(self, raw_token, user_id):
+        """
+        Return (user, generation) with one cache round trip. user is None on a miss;
+        pass the generation to set() so a change made meanwhile is not cached over.
+        """
+        token_key, generation_key = self.token_key(raw_token), self.generation_key(user_id)
+        found = self.cache.get_many([token_key, generation_key])
+        generation = found.get(generation_key)
+        if generation is None:
+            self.cache.add(generation_key, uuid.uuid4().hex, timeout=None)
+            return None, self.cache.get(generation_key)
+
+        return self.snapshot_user(found.get(token_key), generation), generation
+
+    async def aget(self, raw_token, user_id):
+        token_key, generation_key = self.token_key(raw_token), self.generation_key(user_id)
+        found = await self.cache.aget_many([token_key, generation_key])
+        generation = found.get(generation_key)
+        if generation is None:
+            await self.cache.aadd(generation_key, uuid.uuid4().hex, timeout=None)
+            return None, await self.cache.aget(generation_key)
+        return self.snapshot_user(found.get(token_key), generation), generation
+
+    @staticmethod
+    def snapshot_user(entry, generation):
+        if entry is None or entry['generation'] != generation:
+            return None
+        field_names = [f.attname for f in User._meta.concrete_fields]
+        values = [entry['user'].get(name, DEFERRED) for name in field_names]
+        return User.from_db(router.db_for_read(User), field_names, values)
+
+    @staticmethod
+    def entry(user, expires_at, generation):
+        """
+        Return (entry, timeout) for set(), or None when the token should not be cached.
+        """
+        timeout = min(int(expires_at - time.time()), getattr(settings, 'JWT_USER_CACHE_MAX_TTL', 60))
+        if generation is None or timeout <= 0:
+            return None
+        return {'generation': generation, 'user': {name: getattr(user, name) for name in SNAPSHOT_FIELDS}}, timeout
+
+    def set(self, raw_token, user, expires_at, generation):
+        entry = self.entry(user, expires_at, generation)
+        if entry is not None:
+            self.cache.set(self.token_key(raw_token), entry[0], timeout=entry[1])
+
+    async def aset(self, raw_token, user, expires_at, generation):
+        entry = self.entry(user, expires_at, generation)
+        if entry is not None:
+            await self.cache.aset(self.token_key(raw_token), entry[0], timeout=entry[1])
+
+    def invalidate(self, user_id):
+        self.cache.set(self.generation_key(user_id), uuid.uuid4().hex, timeout=None)
+
+
+jwt_user_cache = JWTUserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that skips signature verification and the User query for
+    tokens it has already verified, serving a cached user snapshot instead.
+    """
+
+    def authenticate(self, request):
+        raw_token = self.get_request_token(request)
+        if raw_token is None:
+            return None
+
+        unverified, user_id = self.peek(raw_token)
+        generation = None
+        if user_id is not None:
+            user, generation = jwt_user_cache.get(raw_token, user_id)
+            if user is not None:
+                return user, unverified
+
+        validated_token = self.get_validated_token(raw_token)
+        user = self.get_user(validated_token)
+        if user.pk == user_id:
+            jwt_user_cache.set(raw_token, user, validated_token['exp'], generation)
+        return user, validated_token
+
+    async def aauthenticate(self, request):
+        """
+        authenticate() for async views, with the cache and the User lookup awaited.
+        """
+        raw_token = self.get_request_token(request)
+        if raw_token is None:
+            return None
+
+        unverified, user_id = self.peek(raw_token)
+        generation = None
+        if user_id is not None:
+            user, generation = await jwt_user_cache.aget(raw_token, user_id)
+            if user is not None:
+                return user, unverified
+
+        validated_token = self.get_validated_token(raw_token)
+        user = await self.aget_user(validated_token)
+        if user.pk == user_id:
+            await jwt_user_cache.aset(raw_token, user, validated_token['exp'], generation)
+        return user, validated_token
+
+    def get_request_token(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        return self.get_raw_token(header)
+
+    @staticmethod
+    def peek(raw_token):
+        # Unverified read of the claims, only used to locate the cache entry
+        try:
+            unverified = UntypedToken(raw_token, verify=False)
+            return unverified, unverified[api_settings.USER_ID_CLAIM]
+        except Exception:
+            return None, None
+
+    async def aget_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        try:
+            user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    Signature check only; request.user is a TokenUser built from the claims, with no
+    database or cache access. Meant for read-only endpoints that only need to know
+    the caller is authenticated.
+    """
+
+
+class AsyncTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication with an aauthenticate() for async views.
+    """
+
+    async def aauthenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            # Let the synchronous parser produce the same error messages
+            return self.authenticate(request)
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            return self.authenticate(request)
+
+        model = self.get_model()
+        try:
+            token = await model.objects.select_related('user').aget(key=key)
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return token.user, token
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import time
+import uuid
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class CachedResponse:
+    def __init__(self, data, etag, last_modified):
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def headers(self):
+        return {'ETag': self.etag, 'Last-Modified': http_date(self.last_modified)}
+
+
+class ResponseCache:
+    """
+    Cache of serialized list responses keyed on the normalized query string.
+
+    Every key embeds the current generation, so bump() invalidates all entries at
+    once without having to find them; stale entries simply age out of the backend.
+    The generation also records when the data last changed, for Last-Modified.
+    """
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+
+    def generation(self):
+        key = f'{self.namespace}:generation'
+        generation = self.cache.get(key)
+        if generation is None:
+            generation = (uuid.uuid4().hex, int(time.time()))
+            # add() so concurrent first requests agree on one generation
+            if not self.cache.add(key, generation, timeout=None):
+                generation = self.cache.get(key, generation)
+        return generation
+
+    async def ageneration(self):
+        key = f'{self.namespace}:generation'
+        generation = await self.cache.aget(key)
+        if generation is None:
+            generation = (uuid.uuid4().hex, int(time.time()))
+            if not await self.cache.aadd(key, generation, timeout=None):
+                generation = await self.cache.aget(key, generation)
+        return generation
+
+    def bump(self):
+        self.cache.set(f'{self.namespace}:generation', (uuid.uuid4().hex, int(time.time())), timeout=None)
+
+    def key(self, request, generation):
+        # Pagination links are absolute, so the host is part of the response
+        query = urlencode(sorted(request.query_params.lists()), doseq=True)
+        digest = hashlib.sha1(f'{request.get_host()}{request.path}?{query}'.encode('utf-8')).hexdigest()
+        return f'{self.namespace}:{generation[0]}:{digest}'
+
+    def get_or_build(self, request, build):
+        """
+        Return the CachedResponse for this request, calling build() for the data on a miss.
+        """
+        generation = self.generation()
+        key = self.key(request, generation)
+        cached = self.cache.get(key)
+        if cached is None:
+            cached = self.entry(build(), generation)
+            self.cache.set(key, cached, timeout=self.timeout)
+        return cached
+
+    async def aget_or_build(self, request, abuild):
+        """
+        get_or_build() for async views; abuild() is awaited for the data on a miss.
+        """
+        generation = await self.ageneration()
+        key = self.key(request, generation)
+        cached = await self.cache.aget(key)
+        if cached is None:
+            cached = self.entry(await abuild(), generation)
+            await self.cache.aset(key, cached, timeout=self.timeout)
+        return cached
+
+    @staticmethod
+    def entry(data, generation):
+        content = json.dumps(data, cls=JSONEncoder, sort_keys=True).encode('utf-8')
+        return CachedResponse(data, quote_etag(hashlib.sha1(content).hexdigest()), generation[1])
+
+    @staticmethod
+    def not_modified(request, cached):
+        """
+        Return a 304 response if the client's If-None-Match/If-Modified-Since still hold, else None.
+        """
+        response = get_conditional_response(request, etag=cached.etag, last_modified=cached.last_modified)
+        if response is not None:
+            for header, value in cached.headers.items():
+                response.headers[header] = value
+        return response
+
+
+movie_list_cache = ResponseCache('api:movielist')
+
+
+class RatingMapCache(ResponseCache):
+    """
+    ResponseCache of one user's {movie_id: stars} rating map.
+
+    Besides the generation it keeps the time a rating last left the map. Deltas only
+    carry ratings that were added or changed, so a client whose copy is older than a
+    removal has to download the whole map again.
+    """
+
+    def __init__(self, user_id):
+        super().__init__(f'api:ratingmap:{user_id}')
+
+    def removed_at(self):
+        key = f'{self.namespace}:removed'
+        removed = self.cache.get(key)
+        if removed is None:
+            # Earlier removals are unknown, so no copy from before now can be patched
+            removed = time.time()
+            if not self.cache.add(key, removed, timeout=None):
+                removed = self.cache.get(key, removed)
+        return removed
+
+    def bump(self, removed=False):
+        if removed:
+            self.cache.set(f'{self.namespace}:removed', time.time(), timeout=None)
+        super().bump()
+
+
+def invalidate_rating_maps(user_ids, removed=False):
+    """
+    Bump the rating maps of these users, now and again after commit in case a reader
+    cached the pre-commit rows in between. Pass removed=True when ratings left a map.
+    """
+    def bump():
+        for user_id in user_ids:
+            RatingMapCache(user_id).bump(removed)
+
+    user_ids = list(user_ids)
+    bump()
+    transaction.on_commit(bump)
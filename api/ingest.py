@@ -0,0 +1,144 @@
+import codecs
+import json
+from itertools import islice
+
+READ_SIZE = 64 * 1024
+# Longest record kept in memory while looking for its end
+MAX_RECORD_SIZE = 1024 * 1024
+
+
+class RecordError(ValueError):
+    """
+    A record that could not be decoded; `record` is its 1-based position in the stream.
+    """
+
+    def __init__(self, record, message):
+        super().__init__(f'record {record}: {message}')
+        self.record = record
+        self.message = message
+
+
+class _Reader:
+    decoder = json.JSONDecoder()
+
+    def __init__(self, stream, read_size, max_record_size):
+        self.stream = stream
+        self.read_size = read_size
+        self.max_record_size = max_record_size
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+
+    def fill(self):
+        chunk = self.stream.read(self.read_size)
+        if isinstance(chunk, bytes):
+            chunk = self.utf8.decode(chunk, final=not chunk)
+        self.buffer += chunk
+        return bool(chunk)
+
+    def skip_whitespace(self):
+        self.buffer = self.buffer.lstrip()
+        while not self.buffer and self.fill():
+            self.buffer = self.buffer.lstrip()
+
+    def decode(self, position):
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer)
+            except json.JSONDecodeError as e:
+                # Malformed JSON would otherwise be read (and re-parsed) up to the end of the stream
+                if len(self.buffer) > self.max_record_size:
+                    raise RecordError(position, f'record longer than {self.max_record_size} characters')
+                if self.fill():
+                    continue
+                raise RecordError(position, e.msg)
+            # A number cut at the end of the buffer may continue in the next chunk
+            if self._may_continue(value, end) and self.fill():
+                continue
+            self.buffer = self.buffer[end:]
+            return value
+
+    def _may_continue(self, value, end):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+        return end == len(self.buffer) or self.buffer[end] in '.eE+-0123456789'
+
+
+def iter_records(stream, read_size=READ_SIZE, max_record_size=MAX_RECORD_SIZE):
+    """
+    Yield (position, value) for every record of a JSON array or NDJSON stream.
+
+    The stream is read in read_size chunks, so memory use depends on the largest
+    record rather than on the size of the dump; a record longer than max_record_size
+    characters is an error. An undecodable NDJSON line is yielded as a RecordError value
+    and reading continues; inside a JSON array there is no way to resynchronise, so the
+    RecordError is raised instead.
+    """
+    reader = _Reader(stream, read_size, max_record_size)
+    reader.skip_whitespace()
+    if reader.buffer.startswith('['):
+        reader.buffer = reader.buffer[1:]
+        yield from _iter_array(reader)
+    else:
+        yield from _iter_ndjson(reader)
+
+
+def _iter_array(reader):
+    position = 0
+    while True:
+        reader.skip_whitespace()
+        if reader.buffer.startswith(']'):
+            return
+        if not reader.buffer:
+            raise RecordError(position + 1, 'unterminated JSON array')
+        if position:
+            if not reader.buffer.startswith(','):
+                raise RecordError(position + 1, 'expected "," or "]" between records')
+            reader.buffer = reader.buffer[1:]
+            reader.skip_whitespace()
+        if not reader.buffer:
+            raise RecordError(position + 1, 'unterminated JSON array')
+        position += 1
+        yield position, reader.decode(position)
+
+
+def _iter_ndjson(reader):
+    position = 0
+    while True:
+        scanned = 0
+        too_long = False
+        newline = reader.buffer.find('\n')
+        while newline == -1:
+            if len(reader.buffer) > reader.max_record_size:
+                # Drop the line read so far and skip to its end
+                reader.buffer, too_long = '', True
+            scanned = len(reader.buffer)
+            if not reader.fill():
+                break
+            newline = reader.buffer.find('\n', scanned)
+
+        if newline == -1:
+            line, reader.buffer = reader.buffer, ''
+        else:
+            line, reader.buffer = reader.buffer[:newline], reader.buffer[newline + 1:]
+
+        if too_long:
+            position += 1
+            yield position, RecordError(position, f'record longer than {reader.max_record_size} characters')
+        elif line.strip():
+            position += 1
+            try:
+                yield position, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield position, RecordError(position, e.msg)
+
+        if newline == -1:
+            return
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
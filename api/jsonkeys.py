@@ -0,0 +1,284 @@
+import json
+import re
+
+from django.db import connections
+from django.db.migrations.operations.base import Operation
+from django.db.models import BooleanField, Q
+from django.db.models.expressions import RawSQL
+
+# Keys of a path are written into SQL as literals (so that queries match the
+# expression indexes), hence the restricted alphabet
+KEY_RE = re.compile(r'^[\w-]+$')
+
+LOOKUPS = ('exact', 'in', 'gt', 'gte', 'lt', 'lte', 'contains', 'isnull')
+RANGES = {'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+
+
+class JSONKeyFilterError(ValueError):
+    def __init__(self, param, message):
+        super().__init__(message)
+        self.param = param
+
+
+def parse_path(path):
+    """
+    Split 'a.b' into ('a', 'b'). Raises ValueError for an empty path or a key outside [A-Za-z0-9_-].
+    """
+    keys = tuple(path.split('.'))
+    if not all(KEY_RE.match(key) for key in keys):
+        raise ValueError(f'Invalid JSON key path {path!r}.')
+    return keys
+
+
+def parse_value(raw):
+    # A JSON literal (5, true, null, "5") or else the plain string
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return raw
+
+
+def value_type(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, (int, float)):
+        return 'number'
+    if isinstance(value, str):
+        return 'string'
+    raise ValueError('Expected a number, string, boolean or null.')
+
+
+class JSONKeyBackend:
+    """
+    Conditions on the value under a key path of a JSON column, and the indexes serving them.
+
+    condition() returns (sql, params) for a lookup; add_index() (called from a migration)
+    indexes the same key expression, so the database can use the index for those conditions.
+    Values compare by JSON type: 5 matches the number 5, not the string "5".
+    """
+
+    def key(self, column, path):
+        raise NotImplementedError
+
+    def condition(self, column, path, lookup, value):
+        raise NotImplementedError
+
+    def add_index(self, schema_editor, table, column, path, name, using='btree'):
+        pass
+
+    def remove_index(self, schema_editor, name):
+        schema_editor.execute(f'DROP INDEX IF EXISTS {schema_editor.quote_name(name)}')
+
+
+class SQLiteJSONKeyBackend(JSONKeyBackend):
+    """
+    JSON_EXTRACT() of a literal path, which an expression index on the same call serves.
+
+    JSON_EXTRACT() returns numbers as numbers, booleans as 1/0, strings as text and null as
+    NULL, so each condition also checks JSON_TYPE(). Ranges get a bound on both sides that
+    keeps them within their type (numbers sort before text, text before blobs), which lets
+    SQLite scan just that part of the index. Array containment (json_each) is not indexed.
+    """
+    # JSON_TYPE() values and the range of the matching JSON_EXTRACT() values
+    types = {
+        'null': (("'null'",), None),
+        'boolean': (("'true'", "'false'"), None),
+        'number': (("'integer'", "'real'"), (float('-inf'), '')),
+        'string': (("'text'",), ('', b'')),
+    }
+
+    def key(self, column, path):
+        return f"JSON_EXTRACT({column}, '{self._path(path)}')"
+
+    def condition(self, column, path, lookup, value):
+        key = self.key(column, path)
+        type_check = f"JSON_TYPE({column}, '{self._path(path)}')"
+        if lookup == 'isnull':
+            return f'{key} IS {"" if value else "NOT "}NULL', []
+        if lookup == 'contains':
+            kind = value_type(value)
+            return (f"{type_check} = 'array' AND EXISTS (SELECT 1 FROM JSON_EACH({column}, '{self._path(path)}') "
+                    f"WHERE value {'IS' if value is None else '='} %s "
+                    f"AND type IN ({', '.join(self.types[kind][0])}))", [value])
+        kind = value_type(value)
+        names, bounds = self.types[kind]
+        type_check = f'{type_check} IN ({", ".join(names)})'
+        if lookup == 'exact':
+            if value is None:
+                return f'{key} IS NULL AND {type_check}', []
+            return f'{key} = %s AND {type_check}', [value]
+        if kind not in ('number', 'string'):
+            raise ValueError('Ranges compare numbers or strings.')
+        operator = RANGES[lookup]
+        lower, upper = bounds
+        if operator.startswith('>'):
+            return f'{key} {operator} %s AND {key} < %s AND {type_check}', [value, upper]
+        return f'{key} >= %s AND {key} {operator} %s AND {type_check}', [lower, value]
+
+    def add_index(self, schema_editor, table, column, path, name, using='btree'):
+        # json_each() containment cannot use an index
+        if using != 'btree':
+            return
+        quote = schema_editor.quote_name
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {quote(name)} ON {quote(table)} '
+                              f'({self.key(quote(column), path)})')
+
+    def _path(self, path):
+        return '$' + ''.join(f'."{key}"' for key in path)
+
+
+class PostgresJSONKeyBackend(JSONKeyBackend):
+    """
+    The jsonb value under the path (data -> 'a' -> 'b'), compared to jsonb parameters.
+    A btree expression index serves equality and ranges, a GIN (jsonb_path_ops) one containment.
+    """
+
+    def key(self, column, path):
+        return '(' + ' -> '.join([column] + [f"'{key}'" for key in path]) + ')'
+
+    def condition(self, column, path, lookup, value):
+        key = self.key(column, path)
+        if lookup == 'isnull':
+            if value:
+                return f"({key} IS NULL OR {key} = 'null'::jsonb)", []
+            return f"{key} <> 'null'::jsonb", []
+        if lookup == 'contains':
+            value_type(value)
+            return f"{key} @> %s::jsonb", [json.dumps([value])]
+        kind = value_type(value)
+        if lookup == 'exact':
+            return f'{key} = %s::jsonb', [json.dumps(value)]
+        if kind not in ('number', 'string'):
+            raise ValueError('Ranges compare numbers or strings.')
+        return f"{key} {RANGES[lookup]} %s::jsonb AND jsonb_typeof({key}) = %s", [json.dumps(value), kind]
+
+    def add_index(self, schema_editor, table, column, path, name, using='btree'):
+        quote = schema_editor.quote_name
+        key = self.key(quote(column), path)
+        method = 'USING GIN ' if using == 'gin' else ''
+        opclass = ' jsonb_path_ops' if using == 'gin' else ''
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {quote(name)} ON {quote(table)} {method}({key}{opclass})')
+
+
+DEFAULT_BACKENDS = {
+    'sqlite': SQLiteJSONKeyBackend,
+    'postgresql': PostgresJSONKeyBackend,
+}
+
+
+def get_json_key_backend(vendor):
+    """
+    Return the JSON key backend for the database vendor, or None when it has none.
+    """
+    backend = DEFAULT_BACKENDS.get(vendor)
+    return backend() if backend else None
+
+
+def json_key_filter(queryset, field, path, lookup, value):
+    """
+    Q object for `lookup` on the value under `path` (a tuple of keys) of the JSON `field`.
+    Databases without a backend get Django's own (unindexed) key transforms.
+    """
+    connection = connections[queryset.db]
+    backend = get_json_key_backend(connection.vendor)
+    # `in` is one equality per value, so each can use the index (SQLite's multi-index OR)
+    values, lookup = (value, 'exact') if lookup == 'in' else ([value], lookup)
+    if backend is None:
+        prefix = f'{field}__{"__".join(path)}__{lookup}'
+        return Q(*[Q(**{prefix: [item] if lookup == 'contains' else item}) for item in values], _connector=Q.OR)
+
+    quote = connection.ops.quote_name
+    column = f'{quote(queryset.model._meta.db_table)}.{quote(queryset.model._meta.get_field(field).column)}'
+    conditions = []
+    for item in values:
+        sql, params = backend.condition(column, path, lookup, item)
+        conditions.append(RawSQL(sql, params, output_field=BooleanField()))
+    return Q(*conditions, _connector=Q.OR)
+
+
+def filter_json_keys(queryset, query_params, fields):
+    """
+    Narrow a queryset by the '<field>.<key path>[__<lookup>]=<value>' query parameters of the
+    JSON fields in `fields`, e.g. ?data.age__gte=3&data.owner.name=kim&data.tags__contains=puppy.
+
+    Values are JSON literals where they parse as one, else strings; `in` takes a comma
+    separated list and `isnull` true/false. Raises JSONKeyFilterError for a malformed parameter.
+    """
+    for param, raw in query_params.items():
+        field, dot, rest = param.partition('.')
+        if not dot or field not in fields:
+            continue
+        path, _, lookup = rest.partition('__')
+        lookup = lookup or 'exact'
+        try:
+            if lookup not in LOOKUPS:
+                raise ValueError(f'Unknown lookup {lookup!r}; expected one of {", ".join(LOOKUPS)}.')
+            if lookup == 'isnull':
+                if raw.lower() not in ('true', 'false', '1', '0'):
+                    raise ValueError('Expected true or false.')
+                value = raw.lower() in ('true', '1')
+            elif lookup == 'in':
+                value = [parse_value(item) for item in raw.split(',')]
+                for item in value:
+                    value_type(item)
+            else:
+                value = parse_value(raw)
+                value_type(value)
+            queryset = queryset.filter(json_key_filter(queryset, field, parse_path(path), lookup, value))
+        except ValueError as e:
+            raise JSONKeyFilterError(param, str(e)) from e
+    return queryset
+
+
+class AddJSONKeyIndex(Operation):
+    """
+    Migration operation indexing the value under a key path of a JSON field, for the
+    filters of filter_json_keys(). A btree index serves equality and ranges, `using='gin'`
+    array containment (Postgres only). Databases without a backend are left unindexed.
+
+        AddJSONKeyIndex('dog', 'data', 'age', name='api_dog_data_age_idx')
+    """
+    reduces_to_sql = True
+    reversible = True
+
+    def __init__(self, model_name, field_name, path, name, using='btree'):
+        self.model_name = model_name
+        self.field_name = field_name
+        self.path = path
+        self.name = name
+        self.using = using
+
+    def deconstruct(self):
+        kwargs = {'model_name': self.model_name, 'field_name': self.field_name, 'path': self.path,
+                  'name': self.name}
+        if self.using != 'btree':
+            kwargs['using'] = self.using
+        return self.__class__.__name__, [], kwargs
+
+    def state_forwards(self, app_label, state):
+        # Only the database knows about the index
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        backend = get_json_key_backend(schema_editor.connection.vendor)
+        if backend is None or not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        backend.add_index(schema_editor, model._meta.db_table, model._meta.get_field(self.field_name).column,
+                          parse_path(self.path), self.name, self.using)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        backend = get_json_key_backend(schema_editor.connection.vendor)
+        if backend is None or not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        backend.remove_index(schema_editor, self.name)
+
+    def describe(self):
+        return f'Create index {self.name} on {self.model_name}.{self.field_name}.{self.path}'
+
+    @property
+    def migration_name_fragment(self):
+        return self.name.lower()
@@ -0,0 +1,104 @@
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Case, ExpressionWrapper, FloatField, Value, When
+from django.db.models.functions import Exp, Greatest, Least, Ln
+from django.db.models.lookups import GreaterThan, LessThan
+
+# Trending scores are stored relative to this fixed time, see trending_term()
+TRENDING_EPOCH = datetime(2023, 1, 1, tzinfo=dt_timezone.utc)
+# Below this, exp() is too small to change a sum and Postgres fails it as an underflow
+EXP_CUTOFF = -700.0
+
+
+def prior():
+    """
+    (weight, mean) of the Bayesian average: every movie counts as if it also had
+    `weight` ratings of `mean` stars, so a few 5-star ratings do not top the board.
+    """
+    return (getattr(settings, 'LEADERBOARD_PRIOR_WEIGHT', 10),
+            getattr(settings, 'LEADERBOARD_PRIOR_MEAN', 3.0))
+
+
+def decay_rate():
+    # Per second, from the half-life in seconds
+    return math.log(2) / getattr(settings, 'LEADERBOARD_TRENDING_HALF_LIFE', 24 * 60 * 60)
+
+
+def bayesian_score(count, total):
+    """
+    Expression for the Bayesian average of `count` ratings summing to `total`.
+    Unrated movies score 0, so they sort below every rated one.
+    """
+    weight, mean = prior()
+    average = ExpressionWrapper((Value(weight * mean) + total) / (Value(float(weight)) + count),
+                                output_field=FloatField())
+    return Case(When(GreaterThan(count, 0), then=average), default=Value(0.0), output_field=FloatField())
+
+
+def bayesian_value(count, total):
+    """
+    bayesian_score() for numbers.
+    """
+    weight, mean = prior()
+    return (weight * mean + total) / (weight + count) if count > 0 else 0.0
+
+
+def trending_term(events, when):
+    """
+    Score of `events` ratings at `when`.
+
+    A trending score is log(sum(exp(rate * (t - TRENDING_EPOCH)))) over the times t of
+    the movie's ratings. Relative to the epoch, the scores rank movies exactly as their
+    exponentially decayed rating counts would at any later time, so no stored score has
+    to be decayed as time passes. 0 stands for no ratings: one rating at the epoch,
+    which has long decayed to nothing.
+    """
+    return math.log(events) + decay_rate() * (when - TRENDING_EPOCH).total_seconds()
+
+
+def trending_add(score, term):
+    """
+    Expression adding the ratings of `term` to a trending score, as log(exp(score) + exp(term)).
+    """
+    high, low = Greatest(score, term), Least(score, term)
+    gap = ExpressionWrapper(low - high, output_field=FloatField())
+    return Case(
+        When(LessThan(gap, Value(EXP_CUTOFF)), then=high),
+        default=ExpressionWrapper(high + Ln(Value(1.0) + Exp(gap)), output_field=FloatField()),
+        output_field=FloatField(),
+    )
+
+
+def trending_add_value(score, term):
+    """
+    trending_add() for numbers.
+    """
+    high, low = max(score, term), min(score, term)
+    if low - high < EXP_CUTOFF:
+        return high
+    return high + math.log1p(math.exp(low - high))
+
+
+def trending_scores(rows):
+    """
+    Return {movie_id: trending score} for (movie_id, rated_at) rows.
+    """
+    rate = decay_rate()
+    # Running log-sum-exp per movie: (largest exponent, sum of exp(exponent - largest))
+    sums = {}
+    for movie_id, rated_at in rows:
+        exponent = rate * (rated_at - TRENDING_EPOCH).total_seconds()
+        largest, total = sums.get(movie_id, (exponent, 0.0))
+        if exponent > largest:
+            total, largest = total * math.exp(largest - exponent), exponent
+        sums[movie_id] = (largest, total + math.exp(exponent - largest))
+    return {movie_id: largest + math.log(total) for movie_id, (largest, total) in sums.items()}
+
+
+def trending_now(score, now):
+    """
+    The exponentially decayed rating count a trending score stands for at `now`.
+    """
+    return math.exp(score - decay_rate() * (now - TRENDING_EPOCH).total_seconds())
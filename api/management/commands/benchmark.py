@@ -0,0 +1,250 @@
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.cache import movie_list_cache
+from api.models import BoardComment, Dog, Movie, Rating, Rule
+from api.rules import sync_rule_projection
+from api.search import get_search_backend
+
+# Request templates of the default mixes. Placeholders in path and data are filled per
+# request: {movie}, {stars}, {word}, {ip}, {port}. auth sends a JWT of a random seeded user.
+# /api/users/ and the login views are left out: they hash passwords and are throttled.
+MIXES = {
+    'read': [
+        {'method': 'GET', 'path': '/api/movielist/', 'weight': 20},
+        {'method': 'GET', 'path': '/api/movielist/?search={word}', 'weight': 10},
+        {'method': 'GET', 'path': '/api/movielist/?pagination=cursor', 'weight': 5},
+        {'method': 'GET', 'path': '/api/movielist/top_rated/', 'weight': 3},
+        {'method': 'GET', 'path': '/api/movielist/trending/', 'weight': 3},
+        {'method': 'GET', 'path': '/api/movies/', 'weight': 10, 'auth': True},
+        {'method': 'GET', 'path': '/api/movies/{movie}/', 'weight': 15, 'auth': True},
+        {'method': 'GET', 'path': '/api/movies/{movie}/comments/', 'weight': 5, 'auth': True},
+        {'method': 'GET', 'path': '/api/movies/{movie}/similar/', 'weight': 3, 'auth': True},
+        {'method': 'GET', 'path': '/api/ratings/', 'weight': 5, 'auth': True},
+        {'method': 'GET', 'path': '/api/ratings/map/', 'weight': 5, 'auth': True},
+        {'method': 'GET', 'path': '/api/comments/', 'weight': 3, 'auth': True},
+        {'method': 'GET', 'path': '/api/dog/', 'weight': 2},
+        {'method': 'GET', 'path': '/api/dog/?data.age__gte=10', 'weight': 1},
+        {'method': 'GET', 'path': '/api/rule/?src={ip}', 'weight': 5, 'auth': True},
+        {'method': 'GET', 'path': '/api/rule/?port={port}', 'weight': 3, 'auth': True},
+    ],
+}
+MIXES['mixed'] = MIXES['read'] + [
+    {'method': 'POST', 'path': '/api/movies/{movie}/rate_movie/', 'data': {'stars': '{stars}'},
+     'weight': 15, 'auth': True},
+]
+
+WORDS = ('alien', 'night', 'river', 'ghost', 'summer', 'empire', 'signal', 'harbor')
+
+
+class Command(BaseCommand):
+    help = ('Seed a synthetic dataset and replay a request mix against the API with the test client. '
+            'Reports p50/p95/p99 latency, throughput and queries per request for each endpoint, and '
+            'compares them with a stored baseline. Everything runs in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mix', default='read', choices=sorted(MIXES))
+        parser.add_argument('--mix-file', help='JSON Lines file of request templates, replacing --mix.')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--movies', type=int, default=1000)
+        parser.add_argument('--ratings', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=5000)
+        parser.add_argument('--rules', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline', help='Compare against this results file; fail on a regression.')
+        parser.add_argument('--save-baseline', help='Write the results to this file.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed relative p95 latency increase over the baseline.')
+
+    def handle(self, *args, **options):
+        templates = self.load_mix(options)
+        rng = random.Random(options['seed'])
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            dataset = self.seed(rng, options)
+            self.stdout.write(f'seeded {options["movies"]} movies, {len(dataset["ratings"])} ratings, '
+                              f'{options["comments"]} comments, {options["rules"]} rules '
+                              f'in {time.perf_counter() - started:.1f}s')
+            results = self.replay(rng, templates, dataset, options['requests'])
+            transaction.set_rollback(True)
+        # The seeded rows are gone, so drop the listings cached from them
+        movie_list_cache.bump()
+
+        self.report(results)
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write(f'baseline written to {options["save_baseline"]}')
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                regressions = self.compare(json.load(f), results, options['tolerance'])
+            if regressions:
+                for regression in regressions:
+                    self.stdout.write(self.style.ERROR(regression))
+                raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS('no regressions against the baseline'))
+
+    def load_mix(self, options):
+        if not options['mix_file']:
+            return MIXES[options['mix']]
+        templates = []
+        with open(options['mix_file']) as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    template = json.loads(line)
+                    template['method'], template['path']
+                except (ValueError, TypeError, KeyError):
+                    raise CommandError(f'{options["mix_file"]}:{number}: expected an object with method and path')
+                templates.append(template)
+        if not templates:
+            raise CommandError(f'{options["mix_file"]} has no requests')
+        return templates
+
+    def seed(self, rng, options):
+        now = timezone.now()
+        users = User.objects.bulk_create([User(username=f'benchmark-{i}', password='!')
+                                          for i in range(options['users'])])
+        movies = Movie.objects.bulk_create([
+            Movie(title=f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}',
+                  description=' '.join(rng.choice(WORDS) for _ in range(12)),
+                  pub_date=now - timedelta(minutes=i), user=rng.choice(users))
+            for i in range(options['movies'])
+        ])
+        # bulk_create skips the signals that maintain the search index and rule projection
+        get_search_backend().rebuild()
+
+        pairs = {(rng.choice(users).id, rng.choice(movies).id)
+                 for _ in range(min(options['ratings'], len(users) * len(movies)))}
+        ratings = [(user_id, movie_id, rng.randint(1, 5)) for user_id, movie_id in pairs]
+        Rating.objects.bulk_rate(ratings)
+
+        BoardComment.objects.bulk_create([
+            BoardComment(movie=rng.choice(movies), user=rng.choice(users), comment=rng.choice(WORDS),
+                         pub_date=now - timedelta(seconds=i))
+            for i in range(options['comments'])
+        ])
+        Dog.objects.bulk_create([Dog(name=f'dog {i}', data={'age': i % 15}) for i in range(100)])
+
+        rules = Rule.objects.bulk_create([
+            Rule(data={'source': [{'ip': f'10.{rng.randrange(256)}.{rng.randrange(256)}.0/24'}],
+                       'destination': [{'ip': f'192.168.{rng.randrange(256)}.0/24'}],
+                       'service': [{'tcp': {'port': str(rng.randrange(1, 1024))}}]})
+            for _ in range(options['rules'])
+        ])
+        sync_rule_projection(rules)
+
+        return {
+            'tokens': [str(AccessToken.for_user(user)) for user in users],
+            'movies': [movie.id for movie in movies],
+            'ratings': ratings,
+        }
+
+    def replay(self, rng, templates, dataset, requests):
+        client = APIClient()
+        weights = [template.get('weight', 1) for template in templates]
+        samples = {self.label(template): [] for template in templates}
+        errors = {}
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(count):
+            for template in rng.choices(templates, weights, k=requests):
+                values = {
+                    'movie': rng.choice(dataset['movies']), 'stars': rng.randint(1, 5),
+                    'word': rng.choice(WORDS), 'port': rng.randrange(1, 1024),
+                    'ip': f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}',
+                }
+                headers = {}
+                if template.get('auth'):
+                    headers['HTTP_AUTHORIZATION'] = f'Bearer {rng.choice(dataset["tokens"])}'
+                data = {key: value.format(**values) if isinstance(value, str) else value
+                        for key, value in (template.get('data') or {}).items()}
+
+                before = queries
+                request_started = time.perf_counter()
+                response = client.generic(template['method'], template['path'].format(**values),
+                                          json.dumps(data) if data else '', 'application/json', **headers)
+                elapsed = time.perf_counter() - request_started
+                label = self.label(template)
+                samples[label].append((elapsed, queries - before))
+                if response.status_code >= 400:
+                    errors[label] = errors.get(label, 0) + 1
+        total = time.perf_counter() - started
+
+        endpoints = {}
+        for label, values in samples.items():
+            if not values:
+                continue
+            latencies = sorted(elapsed for elapsed, _ in values)
+            endpoints[label] = {
+                'requests': len(values),
+                'errors': errors.get(label, 0),
+                'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+                'queries': round(statistics.mean(q for _, q in values), 2),
+            }
+        return {'requests': requests, 'seconds': round(total, 2),
+                'throughput': round(requests / total, 1), 'endpoints': endpoints}
+
+    @staticmethod
+    def label(template):
+        return f'{template["method"]} {template["path"]}'
+
+    def report(self, results):
+        width = max(len(label) for label in results['endpoints'])
+        self.stdout.write(f'{"endpoint":<{width}} {"n":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+                          f'{"queries":>8} {"errors":>7}')
+        for label, stats in sorted(results['endpoints'].items()):
+            self.stdout.write(f'{label:<{width}} {stats["requests"]:>6} {stats["p50_ms"]:>8.2f} '
+                              f'{stats["p95_ms"]:>8.2f} {stats["p99_ms"]:>8.2f} {stats["queries"]:>8.2f} '
+                              f'{stats["errors"]:>7}')
+        self.stdout.write(f'{results["requests"]} requests in {results["seconds"]}s, '
+                          f'{results["throughput"]} req/s')
+
+    @staticmethod
+    def compare(baseline, results, tolerance):
+        """
+        Return a message for every endpoint that got slower at p95 by more than tolerance,
+        or issues more queries per request than in the baseline.
+        """
+        regressions = []
+        for label, stats in sorted(results['endpoints'].items()):
+            before = baseline.get('endpoints', {}).get(label)
+            if before is None:
+                continue
+            if stats['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                regressions.append(f'{label}: p95 {before["p95_ms"]} -> {stats["p95_ms"]} ms')
+            # Query counts are deterministic for a given seed, so any increase is real
+            if stats['queries'] > before['queries']:
+                regressions.append(f'{label}: queries per request {before["queries"]} -> {stats["queries"]}')
+        if results['throughput'] < baseline.get('throughput', 0) * (1 - tolerance):
+            regressions.append(f'throughput {baseline["throughput"]} -> {results["throughput"]} req/s')
+        return regressions
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
@@ -0,0 +1,111 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.models import Movie, Rule
+from api.rules import sync_rule_projection
+
+# (name, sync path, async path); {movie} is filled in with a seeded movie id
+ENDPOINTS = (
+    ('movie list', '/api/movielist/?search=benchmark', '/api/async/movielist/?search=benchmark'),
+    ('movie detail', '/api/movies/{movie}/', '/api/async/movies/{movie}/'),
+    ('rule search', '/api/rule/?src=10.1.2.3&port=443', '/api/async/rule/?src=10.1.2.3&port=443'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Compare the sync DRF views with their async counterparts under concurrent load. '
+            'Requests go straight to the ASGI application in this process, as an ASGI server '
+            'would send them; sync views then share the handler\'s thread, async ones the event loop. '
+            'Seeds throwaway movies and rules in the configured database and deletes them afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and mode.')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once.')
+        parser.add_argument('--movies', type=int, default=200)
+        parser.add_argument('--rules', type=int, default=500)
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(f'benchmark-{int(time.time())}')
+        movies = [Movie.objects.create(title=f'benchmark {i}', description='benchmark', user=user)
+                  for i in range(options['movies'])]
+        rules = Rule.objects.bulk_create([
+            Rule(data={'source': [{'ip': f'10.{i % 256}.0.0/16'}], 'destination': [{'ip': '0.0.0.0/0'}],
+                       'service': [{'tcp': {'port': str(400 + i % 100)}}]})
+            for i in range(options['rules'])
+        ])
+        # bulk_create skips the signals that project addresses and services
+        sync_rule_projection(rules)
+
+        headers = [(b'authorization', f'Bearer {AccessToken.for_user(user)}'.encode('ascii'))]
+        try:
+            self.stdout.write(f'{options["requests"]} requests per run, concurrency {options["concurrency"]}')
+            for name, sync_path, async_path in ENDPOINTS:
+                for mode, path in (('sync', sync_path), ('async', async_path)):
+                    path = path.format(movie=movies[0].id)
+                    stats = asyncio.run(self.run(path, headers, options['requests'], options['concurrency']))
+                    self.report(f'{name} ({mode})', stats)
+        finally:
+            Rule.objects.filter(id__in=[r.id for r in rules]).delete()
+            Movie.objects.filter(id__in=[m.id for m in movies]).delete()
+            user.delete()
+
+    async def run(self, path, headers, requests, concurrency):
+        application = get_asgi_application()
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with limit:
+                started = time.perf_counter()
+                status = await self.get(application, path, headers)
+                return status, time.perf_counter() - started
+
+        # One warm-up request so connection setup is not measured
+        await self.get(application, path, headers)
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+        return {
+            'elapsed': elapsed,
+            'errors': sum(1 for status, _ in results if status != 200),
+            'latencies': sorted(latency for _, latency in results),
+        }
+
+    @staticmethod
+    async def get(application, path, headers):
+        url = urlsplit(path)
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': url.path, 'raw_path': url.path.encode('ascii'),
+            'query_string': url.query.encode('ascii'), 'root_path': '',
+            'headers': [(b'host', b'localhost')] + headers,
+            'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        }
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        status = None
+
+        async def receive():
+            return messages.pop() if messages else {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+
+        await application(scope, receive, send)
+        return status
+
+    def report(self, label, stats):
+        latencies = stats['latencies']
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        self.stdout.write(
+            f'{label:<22} {len(latencies) / stats["elapsed"]:8.1f} req/s  '
+            f'p50 {statistics.median(latencies) * 1000:7.1f} ms  p95 {p95 * 1000:7.1f} ms  '
+            f'errors {stats["errors"]}'
+        )
@@ -0,0 +1,73 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.models import Rule
+from api.rules import match_flows, parse_flows, search_rules, sync_rule_projection
+
+
+class Command(BaseCommand):
+    help = ('Time match_flows() on a batch of random flows against seeded rules, and compare it with '
+            'search_rules() run once per flow on a sample, checking that both find the same rules. '
+            'The seeded rules are rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rules', type=int, default=10000)
+        parser.add_argument('--flows', type=int, default=10000)
+        parser.add_argument('--sample', type=int, default=500,
+                            help='Flows also searched one at a time; their time is extrapolated.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            self.seed(rng, options['rules'])
+            flows = [self.flow(rng) for _ in range(options['flows'])]
+            parsed, errors = parse_flows(flows)
+            if errors:
+                raise CommandError(f'invalid flows: {errors[:3]}')
+
+            started = time.perf_counter()
+            results = match_flows(parsed)
+            batch_time = time.perf_counter() - started
+
+            sample = min(options['sample'], len(flows))
+            queryset = Rule.objects.order_by('id')
+            started = time.perf_counter()
+            for flow, rule_ids in zip(flows[:sample], results):
+                found = list(search_rules(queryset, flow['src'], flow['dst'], flow['port']).values_list('id', flat=True))
+                if found != rule_ids:
+                    raise CommandError(f'{flow}: match_flows() found {rule_ids}, search_rules() {found}')
+            single_time = (time.perf_counter() - started) / max(sample, 1) * len(flows)
+
+            matches = sum(len(rule_ids) for rule_ids in results)
+            self.stdout.write(f'{options["rules"]} rules x {len(flows)} flows, {matches} matches')
+            self.stdout.write(f'batch   {batch_time * 1000:>10.1f} ms')
+            self.stdout.write(f'single  {single_time * 1000:>10.1f} ms (from {sample} flows)')
+            self.stdout.write(f'speedup {single_time / batch_time:>10.1f}x')
+            transaction.set_rollback(True)
+
+    def network(self, rng):
+        prefixlen = rng.choices((16, 24, 32), weights=(1, 4, 10))[0]
+        address = self.host(rng)
+        return address if prefixlen == 32 else f'{address}/{prefixlen}'
+
+    def seed(self, rng, count):
+        rules = Rule.objects.bulk_create([
+            Rule(data={'source': [{'ip': self.network(rng)} for _ in range(rng.randint(1, 3))],
+                       'destination': [{'ip': self.network(rng)}],
+                       'service': [{'tcp': {'port': str(rng.choice((22, 80, 443, 8080)))}}]})
+            for _ in range(count)
+        ])
+        for i in range(0, len(rules), 1000):
+            sync_rule_projection(rules[i:i + 1000])
+
+    @staticmethod
+    def host(rng):
+        return f'10.{rng.randrange(4)}.{rng.randrange(64)}.{rng.randrange(256)}'
+
+    def flow(self, rng):
+        return {'src': self.host(rng), 'dst': rng.choice(('', self.host(rng))),
+                'port': rng.choice(('', '22', '80', '443'))}
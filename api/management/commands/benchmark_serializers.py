@@ -0,0 +1,79 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from api.models import BoardComment, Movie, Rating, Rule
+from api.rules import sync_rule_projection
+from api.serializers import BoardCommentSerializer, BoardCommentValuesSerializer, MovieListSerializer, \
+    MovieListValuesSerializer, RatingSerializer, RatingValuesSerializer, RuleSerializer, RuleValuesSerializer
+
+PAIRS = (
+    ('movie list', Movie, MovieListSerializer, MovieListValuesSerializer),
+    ('comments', BoardComment, BoardCommentSerializer, BoardCommentValuesSerializer),
+    ('ratings', Rating, RatingSerializer, RatingValuesSerializer),
+    ('rules', Rule, RuleSerializer, RuleValuesSerializer),
+)
+
+
+class Command(BaseCommand):
+    help = ('Time the ModelSerializer and ValuesSerializer read paths (query, serialize and render) '
+            'on seeded rows, and check that both render the same bytes. The seeded rows are rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='Rows per model.')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per path; the best one is reported.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.seed(options['rows'])
+            self.stdout.write(f'{"":<12} {"model ms":>9} {"values ms":>10} {"speedup":>8}')
+            for name, model, serializer_class, values_serializer_class in PAIRS:
+                queryset = model.objects.order_by('id')
+                if name in ('movie list', 'comments'):
+                    queryset = queryset.select_related('user')
+                model_time, model_body = self.best(options['repeat'], lambda: JSONRenderer().render(
+                    serializer_class(list(queryset.all()), many=True).data))
+                values_time, values_body = self.best(options['repeat'], lambda: JSONRenderer().render(
+                    values_serializer_class(values_serializer_class.values(queryset)).data))
+                if model_body != values_body:
+                    raise CommandError(f'{name}: {values_serializer_class.__name__} output differs')
+                self.stdout.write(f'{name:<12} {model_time * 1000:>9.1f} {values_time * 1000:>10.1f} '
+                                  f'{model_time / values_time:>7.1f}x')
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def best(repeat, run):
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            body = run()
+            times.append(time.perf_counter() - started)
+        return min(times), body
+
+    @staticmethod
+    def seed(rows):
+        now = timezone.now()
+        users = User.objects.bulk_create([User(username=f'serializer-benchmark-{i}', password='!')
+                                          for i in range(rows // 100 + 1)])
+        movies = Movie.objects.bulk_create([
+            Movie(title=f'movie {i}', description='benchmark', user=users[i % len(users)],
+                  pub_date=now - timedelta(minutes=i))
+            for i in range(rows)
+        ])
+        BoardComment.objects.bulk_create([
+            BoardComment(movie=movies[i], user=users[i % len(users)], comment=f'comment {i}',
+                         pub_date=now - timedelta(seconds=i))
+            for i in range(rows)
+        ])
+        Rating.objects.bulk_rate([(users[i % len(users)].id, movies[i].id, i % 5 + 1) for i in range(rows)])
+        rules = Rule.objects.bulk_create([
+            Rule(data={'source': [{'ip': f'10.{i % 256}.0.0/16'}], 'destination': [{'ip': '0.0.0.0/0'}],
+                       'service': [{'tcp': {'port': str(i % 1024)}}]})
+            for i in range(rows)
+        ])
+        sync_rule_projection(rules)
@@ -0,0 +1,19 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from api.rules import export_rules
+
+
+class Command(BaseCommand):
+    help = 'Export every firewall rule as NDJSON ({"id", "data"} per line), streaming the table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='Output file, or - for stdout (default).')
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            sys.stdout.writelines(export_rules())
+        else:
+            with open(options['path'], 'w', encoding='utf-8') as dump:
+                dump.writelines(export_rules())
@@ -0,0 +1,33 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.ingest import iter_records
+from api.rules import import_rules
+
+
+class Command(BaseCommand):
+    help = 'Import firewall rules from a JSON array or NDJSON dump, streaming it in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Dump file, or - for stdin.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rules inserted per transaction.')
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            stats = import_rules(iter_records(sys.stdin.buffer), options['batch_size'])
+        else:
+            try:
+                with open(options['path'], 'rb') as dump:
+                    stats = import_rules(iter_records(dump), options['batch_size'])
+            except OSError as e:
+                raise CommandError(e)
+
+        for error in stats['errors']:
+            self.stderr.write(f"record {error['record']}: {error['errors']}")
+        self.stdout.write(f"received {stats['received']}, created {stats['created']}, "
+                          f"failed {stats['failed']} in {stats['seconds']}s "
+                          f"({stats['rules_per_second']} rules/s)")
+        if stats['aborted']:
+            raise CommandError('Import stopped at a malformed record.')
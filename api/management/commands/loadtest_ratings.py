@@ -0,0 +1,83 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Count, Sum
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.models import Movie, Rating
+from api.views import MovieViewSet
+
+
+class Command(BaseCommand):
+    help = ('Load test rate_movie with concurrent writers against the configured database. '
+            'Creates throwaway users and movies, reports throughput and checks the stored '
+            'rating aggregates, then deletes everything it created.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=2000, help='Total rating requests.')
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--movies', type=int, default=5,
+                            help='Fewer movies means more writers contending for the same rows.')
+
+    def handle(self, *args, **options):
+        users = [User(username=f'loadtest-{i}-{int(time.time())}') for i in range(options['users'])]
+        for user in users:
+            user.set_unusable_password()
+        users = User.objects.bulk_create(users)
+        movies = [Movie.objects.create(title=f'loadtest {i}', description='loadtest')
+                  for i in range(options['movies'])]
+
+        factory = APIRequestFactory()
+        view = MovieViewSet.as_view({'post': 'rate_movie'})
+        rng = random.Random(0)
+        plan = [(rng.choice(users), rng.choice(movies).id, rng.randint(1, 5))
+                for _ in range(options['requests'])]
+
+        def rate(job):
+            user, movie_id, stars = job
+            request = factory.post(f'/api/movies/{movie_id}/rate_movie/', {'stars': stars}, format='json')
+            force_authenticate(request, user=user)
+            try:
+                return view(request, pk=movie_id).status_code
+            except Exception as e:
+                return type(e).__name__
+            finally:
+                connections.close_all()
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+                results = list(pool.map(rate, plan))
+            elapsed = time.perf_counter() - started
+
+            # 201 for a new rating, 200 for a changed one
+            ok = results.count(201) + results.count(200)
+            self.stdout.write(f'{len(plan)} requests, {options["threads"]} threads, {elapsed:.2f}s')
+            self.stdout.write(f'throughput: {ok / elapsed:.1f} ratings/s, errors: {len(plan) - ok}')
+            for error in sorted(set(r for r in results if r not in (200, 201)), key=str):
+                self.stdout.write(f'  {error}: {results.count(error)}')
+
+            self.check_aggregates(movies)
+        finally:
+            Movie.objects.filter(id__in=[m.id for m in movies]).delete()
+            User.objects.filter(id__in=[u.id for u in users]).delete()
+
+    def check_aggregates(self, movies):
+        actual = {
+            row['movie']: (row['count'], row['total'])
+            for row in Rating.objects.filter(movie__in=movies)
+            .values('movie').annotate(count=Count('id'), total=Sum('stars'))
+        }
+        drift = [
+            movie.id for movie in Movie.objects.filter(id__in=[m.id for m in movies])
+            if (movie.rating_count, movie.rating_sum) != actual.get(movie.id, (0, 0))
+        ]
+        if drift:
+            self.stdout.write(self.style.ERROR(f'aggregates drifted for movies {drift}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('aggregates match the Rating table'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Movie
+
+
+class Command(BaseCommand):
+    help = ('Recompute the top-rated and trending leaderboard scores on Movie. Rating writes keep them '
+            'up to date; run this periodically to drop rating events superseded since, and after '
+            'changing the LEADERBOARD_* settings.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('movie_ids', nargs='*', type=int,
+                            help='Only rebuild these movies (default: all movies).')
+
+    def handle(self, *args, **options):
+        queryset = Movie.objects.all()
+        if options['movie_ids']:
+            queryset = queryset.filter(id__in=options['movie_ids'])
+
+        with transaction.atomic():
+            rebuilt = Movie.rebuild_leaderboard_scores(queryset)
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt leaderboard scores for {rebuilt} movie(s).'))
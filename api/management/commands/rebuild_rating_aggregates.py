@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Movie
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized rating_count/rating_sum columns on Movie from the Rating table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('movie_ids', nargs='*', type=int,
+                            help='Only rebuild these movies (default: all movies).')
+
+    def handle(self, *args, **options):
+        queryset = Movie.objects.all()
+        if options['movie_ids']:
+            queryset = queryset.filter(id__in=options['movie_ids'])
+
+        with transaction.atomic():
+            rebuilt = Movie.rebuild_rating_aggregates(queryset)
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating aggregates for {rebuilt} movie(s).'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the movie full-text search index from the Movie table.'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        # Migrations only create the default index of the database vendor, so recreate the
+        # structures too: a backend set with MOVIE_SEARCH_BACKEND may not have them yet
+        with connection.schema_editor() as schema_editor:
+            backend.uninstall(schema_editor)
+            backend.install(schema_editor)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt search index with {type(backend).__name__}.'))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.recommendations import MAX_USER_RATINGS, METHODS, MIN_SUPPORT, NEIGHBOURS, rebuild_similar_movies
+
+
+class Command(BaseCommand):
+    help = ('Recompute the "similar movies" neighbour lists from the Rating table, for movies rated '
+            'since their last rebuild. Run it periodically, and now and then with --full so lists '
+            'that only changed through other movies catch up too.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild every movie, not only the stale ones.')
+        parser.add_argument('--neighbours', type=int, default=NEIGHBOURS)
+        parser.add_argument('--min-support', type=int, default=MIN_SUPPORT,
+                            help='Users two movies need in common before their similarity counts.')
+        parser.add_argument('--method', choices=METHODS, default=METHODS[0])
+        parser.add_argument('--max-user-ratings', type=int, default=MAX_USER_RATINGS,
+                            help="Only use this many of each user's most recent ratings.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rebuilt = rebuild_similar_movies(
+            full=options['full'], k=options['neighbours'], min_support=options['min_support'],
+            method=options['method'], max_user_ratings=options['max_user_ratings'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt similar movies for {rebuilt} movie(s) in {time.perf_counter() - started:.1f}s.'))
@@ -0,0 +1,210 @@
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+logger = logging.getLogger('api.metrics')
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Metrics of the request being handled; a ContextVar so that async views and the
+# sync_to_async threads running their queries attribute work to the right request
+current_metrics = ContextVar('api_request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('started', 'queries', 'db_time', 'serialize_time')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+
+    def server_timing(self, total):
+        return (f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries", '
+                f'serialize;dur={self.serialize_time * 1000:.1f}, '
+                f'total;dur={total * 1000:.1f}')
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper adding each query's count and duration to current_metrics.
+    """
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - started
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """
+    connection_created receiver adding record_query to every connection, once.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Histogram:
+    """
+    Per-view latency histogram with query and DB time totals, kept in process memory.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def observe(self, view, total, metrics):
+        total_ms = total * 1000
+        with self.lock:
+            stats = self.views.get(view)
+            if stats is None:
+                stats = self.views[view] = {'count': 0, 'total_ms': 0.0, 'db_ms': 0.0, 'serialize_ms': 0.0,
+                                            'queries': 0, 'buckets': [0] * (len(self.buckets) + 1)}
+            stats['count'] += 1
+            stats['total_ms'] += total_ms
+            stats['db_ms'] += metrics.db_time * 1000
+            stats['serialize_ms'] += metrics.serialize_time * 1000
+            stats['queries'] += metrics.queries
+            stats['buckets'][bisect_left(self.buckets, total_ms)] += 1
+
+    def snapshot(self):
+        """
+        Return {view: stats}, with cumulative bucket counts keyed by upper bound ('+Inf' last).
+        """
+        with self.lock:
+            views = {view: dict(stats, buckets=list(stats['buckets'])) for view, stats in self.views.items()}
+        labels = [str(bound) for bound in self.buckets] + ['+Inf']
+        for stats in views.values():
+            for name in ('total_ms', 'db_ms', 'serialize_ms'):
+                stats[name] = round(stats[name], 2)
+            cumulative, buckets = 0, {}
+            for label, count in zip(labels, stats['buckets']):
+                cumulative += count
+                buckets[label] = cumulative
+            stats['buckets'] = buckets
+        return views
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+
+
+request_histogram = Histogram()
+
+
+def view_label(request):
+    """
+    'ViewSet.action' for DRF viewsets, else the view class or function name.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    func = match.func
+    cls = getattr(func, 'cls', None) or getattr(func, 'view_class', None)
+    if cls is None:
+        return getattr(func, '__name__', match.view_name)
+    actions = getattr(func, 'actions', None) or {}
+    return f'{cls.__name__}.{actions.get(request.method.lower(), request.method.lower())}'
+
+
+class RequestMetricsMiddleware:
+    """
+    Times every request and counts its queries. The totals go out as a Server-Timing
+    header and an 'api.metrics' log line, and into request_histogram for the metrics
+    endpoint. Works for both sync and async views.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        total = time.perf_counter() - metrics.started
+        view = view_label(request)
+        request_histogram.observe(view, total, metrics)
+        response['Server-Timing'] = metrics.server_timing(total)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                'view': view, 'method': request.method, 'path': request.path, 'status': response.status_code,
+                'total_ms': round(total * 1000, 2), 'db_ms': round(metrics.db_time * 1000, 2),
+                'serialize_ms': round(metrics.serialize_time * 1000, 2), 'queries': metrics.queries,
+            }))
+        return response
+
+
+class SerializerTimingMixin:
+    """
+    View mixin adding the time spent in get_serializer() serializers' to_representation()
+    to the request's metrics (the serialize entry of Server-Timing). Views with a
+    values_serializer_class get it, timed the same way, from get_values_serializer_class().
+    """
+
+    def get_serializer_class(self):
+        return timed_serializer_class(super().get_serializer_class())
+
+    def get_values_serializer_class(self, values_serializer_class=None):
+        return timed_serializer_class(values_serializer_class or self.values_serializer_class)
+
+
+_timed_serializer_classes = {}
+
+
+def timed_serializer_class(serializer_class):
+    """
+    Return a subclass of serializer_class whose to_representation() time is added to current_metrics.
+    """
+    timed = _timed_serializer_classes.get(serializer_class)
+    if timed is None:
+        to_representation = serializer_class.to_representation
+
+        def timed_to_representation(self, instance):
+            metrics = current_metrics.get()
+            if metrics is None:
+                return to_representation(self, instance)
+            started = time.perf_counter()
+            try:
+                return to_representation(self, instance)
+            finally:
+                metrics.serialize_time += time.perf_counter() - started
+
+        timed = type(serializer_class.__name__, (serializer_class,), {
+            '__module__': serializer_class.__module__, 'to_representation': timed_to_representation,
+        })
+        _timed_serializer_classes[serializer_class] = timed
+    return timed
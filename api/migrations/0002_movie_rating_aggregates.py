@@ -0,0 +1,33 @@
+# Generated by Django 4.2.1 on 2026-10-18 18:20
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Movie = apps.get_model('api', 'Movie')
+    Rating = apps.get_model('api', 'Rating')
+    totals = Rating.objects.values('movie').annotate(count=Count('id'), total=Sum('stars'))
+    for row in totals:
+        Movie.objects.filter(pk=row['movie']).update(rating_count=row['count'], rating_sum=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
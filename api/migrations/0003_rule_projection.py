@@ -0,0 +1,104 @@
+# Generated by Django 4.2.1 on 2026-10-18 18:23
+
+import ipaddress
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# The projection as it was when this migration was written; api.rules may change later
+def parse_network(value):
+    network = ipaddress.ip_network(value.strip(), strict=False)
+    return (network.version, int(network.network_address),
+            int(network.broadcast_address), network.prefixlen)
+
+
+def rule_projection(data):
+    addresses, services = [], []
+    if not isinstance(data, dict):
+        return addresses, services
+
+    seen = set()
+    for side in ('source', 'destination'):
+        for entry in data.get(side) or []:
+            if not isinstance(entry, dict) or not isinstance(entry.get('ip'), str):
+                continue
+            try:
+                network = parse_network(entry['ip'])
+            except ValueError:
+                continue
+            if (side, network) in seen:
+                continue
+            seen.add((side, network))
+            version, start, end, prefixlen = network
+            addresses.append({'side': side, 'version': version, 'network_start': f'{start:032x}',
+                              'network_end': f'{end:032x}', 'prefixlen': prefixlen})
+
+    seen = set()
+    for svc in data.get('service') or []:
+        if not isinstance(svc, dict):
+            continue
+        for protocol, fields in svc.items():
+            if not isinstance(fields, dict):
+                continue
+            for k, v in fields.items():
+                if k != 'description' and isinstance(v, str) and len(v) <= 255 and (protocol, v) not in seen:
+                    seen.add((protocol, v))
+                    services.append({'protocol': protocol[:32], 'port': v})
+    return addresses, services
+
+
+def backfill_rule_projection(apps, schema_editor):
+    Rule = apps.get_model('api', 'Rule')
+    RuleAddress = apps.get_model('api', 'RuleAddress')
+    RuleService = apps.get_model('api', 'RuleService')
+
+    addresses, services = [], []
+    for rule in Rule.objects.only('id', 'data').iterator(chunk_size=500):
+        address_rows, service_rows = rule_projection(rule.data)
+        addresses.extend(RuleAddress(rule_id=rule.id, **row) for row in address_rows)
+        services.extend(RuleService(rule_id=rule.id, **row) for row in service_rows)
+        if len(addresses) + len(services) >= 5000:
+            RuleAddress.objects.bulk_create(addresses, batch_size=1000)
+            RuleService.objects.bulk_create(services, batch_size=1000)
+            addresses, services = [], []
+    RuleAddress.objects.bulk_create(addresses, batch_size=1000)
+    RuleService.objects.bulk_create(services, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_movie_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RuleService',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('protocol', models.CharField(max_length=32)),
+                ('port', models.CharField(max_length=255)),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='services', to='api.rule')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['port', 'rule'], name='api_ruleservice_port_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RuleAddress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('side', models.CharField(choices=[('source', 'Source'), ('destination', 'Destination')], max_length=11)),
+                ('version', models.PositiveSmallIntegerField()),
+                ('network_start', models.CharField(max_length=32)),
+                ('network_end', models.CharField(max_length=32)),
+                ('prefixlen', models.PositiveSmallIntegerField()),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='addresses', to='api.rule')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['side', 'version', 'prefixlen', 'network_start'], name='api_ruleaddr_lookup_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_rule_projection, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.1 on 2026-10-18 18:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_rule_projection'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='boardcomment',
+            index=models.Index(fields=['movie', 'pub_date'], name='api_comment_movie_date_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+from django.db import migrations
+
+
+# The index structures as they were when this migration was written, chosen by database
+# vendor only; api.search and MOVIE_SEARCH_BACKEND may change later
+SEARCH_INDEX_SQL = {
+    'sqlite': [
+        ("CREATE VIRTUAL TABLE IF NOT EXISTS api_movie_fts "
+         "USING fts5(title, description, tokenize='unicode61 remove_diacritics 2')", None),
+        ("INSERT INTO api_movie_fts (rowid, title, description) "
+         "SELECT id, title, description FROM api_movie", None),
+    ],
+    'postgresql': [
+        ("CREATE TABLE IF NOT EXISTS api_movie_search ("
+         "movie_id bigint PRIMARY KEY REFERENCES api_movie(id) ON DELETE CASCADE, "
+         "document tsvector NOT NULL)", None),
+        ("CREATE INDEX IF NOT EXISTS api_movie_search_document_gin "
+         "ON api_movie_search USING GIN (document)", None),
+        ("INSERT INTO api_movie_search (movie_id, document) "
+         "SELECT id, setweight(to_tsvector(%s, coalesce(title, '')), 'A') || "
+         "setweight(to_tsvector(%s, coalesce(description, '')), 'B') "
+         "FROM api_movie "
+         "ON CONFLICT (movie_id) DO UPDATE SET document = EXCLUDED.document", ['english', 'english']),
+    ],
+}
+
+SEARCH_INDEX_TABLES = {
+    'sqlite': 'api_movie_fts',
+    'postgresql': 'api_movie_search',
+}
+
+
+def install_search_index(apps, schema_editor):
+    for sql, params in SEARCH_INDEX_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql, params)
+
+
+def uninstall_search_index(apps, schema_editor):
+    table = SEARCH_INDEX_TABLES.get(schema_editor.connection.vendor)
+    if table:
+        schema_editor.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_boardcomment_movie_date_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.1 on 2026-10-18 18:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_movie_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['-pub_date', '-id'], name='api_movie_pubdate_id_idx'),
+        ),
+    ]
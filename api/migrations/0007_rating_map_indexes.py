@@ -0,0 +1,30 @@
+# Generated by Django 4.2.1 on 2026-10-18 19:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_movie_pubdate_id_index'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='rating',
+            index_together=set(),
+        ),
+        migrations.AddField(
+            model_name='rating',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['user', 'movie', 'stars'], name='api_rating_user_map_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['user', 'updated'], name='api_rating_user_updated_idx'),
+        ),
+    ]
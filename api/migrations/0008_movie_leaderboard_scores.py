@@ -0,0 +1,72 @@
+# Generated by Django 4.2.1 on 2026-10-18 19:05
+
+import math
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, ExpressionWrapper, F, FloatField, Value, When
+from django.db.models.lookups import GreaterThan
+
+# Frozen copies of the api.leaderboards scoring of this migration's time, so that the
+# backfill keeps its meaning when the live helpers change
+TRENDING_EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+
+def bayesian_score(count, total):
+    weight = getattr(settings, 'LEADERBOARD_PRIOR_WEIGHT', 10)
+    mean = getattr(settings, 'LEADERBOARD_PRIOR_MEAN', 3.0)
+    average = ExpressionWrapper((Value(weight * mean) + total) / (Value(float(weight)) + count),
+                                output_field=FloatField())
+    return Case(When(GreaterThan(count, 0), then=average), default=Value(0.0), output_field=FloatField())
+
+
+def trending_scores(rows):
+    rate = math.log(2) / getattr(settings, 'LEADERBOARD_TRENDING_HALF_LIFE', 24 * 60 * 60)
+    # Running log-sum-exp per movie: (largest exponent, sum of exp(exponent - largest))
+    sums = {}
+    for movie_id, rated_at in rows:
+        exponent = rate * (rated_at - TRENDING_EPOCH).total_seconds()
+        largest, total = sums.get(movie_id, (exponent, 0.0))
+        if exponent > largest:
+            total, largest = total * math.exp(largest - exponent), exponent
+        sums[movie_id] = (largest, total + math.exp(exponent - largest))
+    return {movie_id: largest + math.log(total) for movie_id, (largest, total) in sums.items()}
+
+
+def backfill_leaderboard_scores(apps, schema_editor):
+    Movie = apps.get_model('api', 'Movie')
+    Rating = apps.get_model('api', 'Rating')
+    Movie.objects.update(bayesian_score=bayesian_score(F('rating_count'), F('rating_sum')))
+    scores = trending_scores(Rating.objects.values_list('movie', 'updated').iterator())
+    for movie_id, score in scores.items():
+        Movie.objects.filter(pk=movie_id).update(trending_score=score)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_rating_map_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='bayesian_score',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='trending_score',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['-bayesian_score', '-id'], name='api_movie_bayesian_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['-trending_score', '-id'], name='api_movie_trending_idx'),
+        ),
+        migrations.RunPython(backfill_leaderboard_scores, migrations.RunPython.noop),
+    ]
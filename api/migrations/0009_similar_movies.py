@@ -0,0 +1,44 @@
+# Generated by Django 4.2.1 on 2026-10-18 19:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_movie_leaderboard_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarMovie',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='similar_stale',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(condition=models.Q(('similar_stale', True)), fields=['similar_stale'], name='api_movie_similar_stale_idx'),
+        ),
+        migrations.AddField(
+            model_name='similarmovie',
+            name='movie',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_movies', to='api.movie'),
+        ),
+        migrations.AddField(
+            model_name='similarmovie',
+            name='similar',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_to', to='api.movie'),
+        ),
+        migrations.AddIndex(
+            model_name='similarmovie',
+            index=models.Index(fields=['movie', '-score'], name='api_similar_movie_score_idx'),
+        ),
+    ]
@@ -0,0 +1,14 @@
+from django.db import migrations
+
+from api.jsonkeys import AddJSONKeyIndex
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_similar_movies'),
+    ]
+
+    operations = [
+        AddJSONKeyIndex('dog', 'data', 'age', name='api_dog_data_age_idx'),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+def backfill_comment_dates(apps, schema_editor):
+    # Comments posted through the API were saved without a date; date them now
+    BoardComment = apps.get_model('api', 'BoardComment')
+    BoardComment.objects.filter(pub_date__isnull=True).update(pub_date=timezone.now())
+
+
+# Kept apart from the NOT NULL change, which Postgres refuses in the transaction that
+# updated the rows (pending trigger events)
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_dog_data_age_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_comment_dates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+from django.utils import timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_backfill_comment_dates'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='boardcomment',
+            name='pub_date',
+            field=models.DateTimeField(default=timezone.now),
+        ),
+    ]
@@ -1,6 +1,13 @@
 from django.contrib.auth.models import User
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.utils import timezone
+
+from api.cache import invalidate_rating_maps
+from api.ingest import chunked
+from api.leaderboards import bayesian_score, bayesian_value, trending_add, trending_add_value, trending_scores, \
+    trending_term
 
 
 class Movie(models.Model):
@@ -9,28 +16,217 @@ class Movie(models.Model):
     pub_date = models.DateTimeField(null=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
 
+    # Denormalized rating aggregates, kept in sync by apply_rating_delta()
+    # and rebuilt by the rebuild_rating_aggregates management command
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+
+    # Leaderboard scores (api/leaderboards.py), shifted by the same UPDATEs as the
+    # aggregates and rebuilt by the rebuild_leaderboards management command
+    bayesian_score = models.FloatField(default=0.0)
+    trending_score = models.FloatField(default=0.0)
+
+    # Set by every rating change, cleared when rebuild_similar_movies recomputes
+    # the movie's SimilarMovie rows (api/recommendations.py)
+    similar_stale = models.BooleanField(default=True)
+
+    class Meta:
+        indexes = [
+            # Backs the newest-first movie listings and their keyset pagination
+            models.Index(fields=['-pub_date', '-id'], name='api_movie_pubdate_id_idx'),
+            # Top-N leaderboard reads walk these and stop after N rows
+            models.Index(fields=['-bayesian_score', '-id'], name='api_movie_bayesian_idx'),
+            models.Index(fields=['-trending_score', '-id'], name='api_movie_trending_idx'),
+            models.Index(fields=['similar_stale'], condition=Q(similar_stale=True), name='api_movie_similar_stale_idx'),
+        ]
+
     # Custom data which can be used in serializer's fields
     def no_of_ratings(self):
-        ratings = Rating.objects.filter(movie=self)
-        return len(ratings)
+        return self.rating_count
 
     def avg_ratings(self):
-        sum = 0
-        ratings = Rating.objects.filter(movie=self)
-        for rating in ratings:
-            sum += rating.stars
-        if len(ratings) > 0:
-            return sum / len(ratings)
+        if self.rating_count > 0:
+            return self.rating_sum / self.rating_count
         else:
             return 0
 
+    @staticmethod
+    def apply_rating_delta(movie_id, count_delta, sum_delta, events=0):
+        """
+        Shift the stored aggregates and leaderboard scores of one movie in a single UPDATE;
+        `events` is the number of ratings given or changed just now, for the trending score.
+        Call it inside the transaction that writes the Rating row.
+        """
+        Movie.objects.filter(pk=movie_id).update(**Movie.rating_delta_updates(count_delta, sum_delta, events))
+
+    @staticmethod
+    def apply_rating_deltas(deltas):
+        """
+        Shift the aggregates and leaderboard scores of many movies.
+        `deltas` maps movie id to a (count_delta, sum_delta, events) triple.
+
+        Movies with the same triple share one UPDATE. Within a batch most triples are
+        alike (one new rating of 1-5 stars), and a per-movie CASE costs far more to
+        compile than the few extra statements.
+        """
+        groups = {}
+        for movie_id, delta in deltas.items():
+            groups.setdefault(delta, []).append(movie_id)
+        for (count_delta, sum_delta, events), movie_ids in groups.items():
+            for batch in chunked(sorted(movie_ids), 1000):
+                Movie.objects.filter(pk__in=batch).update(**Movie.rating_delta_updates(count_delta, sum_delta, events))
+
+    @staticmethod
+    def rating_delta_updates(count_delta, sum_delta, events):
+        count, total = F('rating_count') + count_delta, F('rating_sum') + sum_delta
+        updates = {'rating_count': count, 'rating_sum': total, 'bayesian_score': bayesian_score(count, total),
+                   'similar_stale': True}
+        if events:
+            updates['trending_score'] = trending_add(F('trending_score'), Value(trending_term(events, timezone.now())))
+        return updates
+
+    @staticmethod
+    def rebuild_rating_aggregates(queryset=None):
+        """
+        Recompute rating_count/rating_sum from the Rating table.
+        Returns the number of movies that were rewritten.
+        """
+        if queryset is None:
+            queryset = Movie.objects.all()
+        totals = {
+            row['movie']: (row['count'], row['total'])
+            for row in Rating.objects.filter(movie__in=queryset.values('pk'))
+            .values('movie').annotate(count=Count('id'), total=Sum('stars'))
+        }
+        movies = list(queryset.only('id', 'rating_count', 'rating_sum', 'bayesian_score'))
+        for movie in movies:
+            movie.rating_count, movie.rating_sum = totals.get(movie.id, (0, 0))
+            movie.bayesian_score = bayesian_value(movie.rating_count, movie.rating_sum)
+        Movie.objects.bulk_update(movies, ['rating_count', 'rating_sum', 'bayesian_score'], batch_size=500)
+        return len(movies)
+
+    @staticmethod
+    def rebuild_leaderboard_scores(queryset=None):
+        """
+        Recompute bayesian_score from the stored aggregates and trending_score from the
+        Rating table, where each rating counts once, at its last change.
+        Returns the number of movies that were rewritten.
+        """
+        if queryset is None:
+            queryset = Movie.objects.all()
+        # Lock the movies first, so concurrent raters wait instead of being overwritten
+        movie_ids = list(queryset.select_for_update().order_by('pk').values_list('pk', flat=True))
+        Movie.objects.filter(pk__in=movie_ids).update(
+            bayesian_score=bayesian_score(F('rating_count'), F('rating_sum')))
+
+        scores = trending_scores(Rating.objects.filter(movie__in=movie_ids)
+                                 .values_list('movie', 'updated').iterator(chunk_size=2000))
+        movies = [Movie(id=movie_id, trending_score=scores.get(movie_id, 0.0)) for movie_id in movie_ids]
+        Movie.objects.bulk_update(movies, ['trending_score'], batch_size=500)
+        return len(movies)
+
 
 class BoardComment(models.Model):
     movie = models.ForeignKey(Movie, related_name='comments', on_delete=models.CASCADE, null=True)
     comment = models.TextField(max_length=360)
-    pub_date = models.DateTimeField(null=True)
+    # Never NULL, as the cursor paging of a thread cannot order past NULLs
+    pub_date = models.DateTimeField(default=timezone.now)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
 
+    class Meta:
+        # Backs the newest-first comment threads of a movie
+        indexes = [
+            models.Index(fields=['movie', 'pub_date'], name='api_comment_movie_date_idx'),
+        ]
+
+
+class RatingManager(models.Manager):
+
+    def rate(self, user, movie_id, stars):
+        """
+        Insert or update the user's rating of a movie and shift the movie's aggregates.
+
+        Runs three statements in one transaction: lock the movie row while reading the
+        user's previous rating and the movie's aggregates, upsert the rating (INSERT ...
+        ON CONFLICT DO UPDATE), and write the new aggregates and leaderboard scores. The
+        movie lock serializes concurrent raters of the same movie, so the new values are
+        computed here rather than by apply_rating_delta()'s costlier UPDATE expressions.
+        Returns (rating, created); raises Movie.DoesNotExist.
+        """
+        previous = self.filter(movie=OuterRef('pk'), user=user)
+        updated = self.model._meta.get_field('updated').get_db_prep_value(timezone.now(), connection)
+        with transaction.atomic():
+            row = Movie.objects.select_for_update().filter(pk=movie_id).annotate(
+                previous_stars=Subquery(previous.values('stars')[:1]),
+            ).values('previous_stars', 'rating_count', 'rating_sum', 'trending_score').first()
+            if row is None:
+                raise Movie.DoesNotExist
+
+            table = self.model._meta.db_table
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {table} (user_id, movie_id, stars, updated) VALUES (%s, %s, %s, %s) '
+                    f'ON CONFLICT (user_id, movie_id) DO UPDATE SET stars = excluded.stars, '
+                    f'updated = CASE WHEN {table}.stars = excluded.stars THEN {table}.updated ELSE excluded.updated END '
+                    f'RETURNING id',
+                    [user.id, movie_id, stars, updated],
+                )
+                rating_id = cursor.fetchone()[0]
+
+            created = row['previous_stars'] is None
+            if created or row['previous_stars'] != stars:
+                count = row['rating_count'] + created
+                total = row['rating_sum'] + stars - (row['previous_stars'] or 0)
+                Movie.objects.filter(pk=movie_id).update(
+                    rating_count=count, rating_sum=total, bayesian_score=bayesian_value(count, total),
+                    trending_score=trending_add_value(row['trending_score'], trending_term(1, timezone.now())),
+                    similar_stale=True,
+                )
+            invalidate_rating_maps([user.id])
+
+        return self.model(id=rating_id, user=user, movie_id=movie_id, stars=stars), created
+
+    def bulk_rate(self, ratings):
+        """
+        Upsert a batch of already validated (user_id, movie_id, stars) tuples and
+        apply the aggregate changes of the whole batch in one UPDATE.
+        Later tuples for the same (user, movie) win. Returns (created, updated).
+        """
+        latest = {(user_id, movie_id): stars for user_id, movie_id, stars in ratings}
+        movie_ids = sorted({movie_id for _, movie_id in latest})
+        user_ids = {user_id for user_id, _ in latest}
+
+        with transaction.atomic():
+            # Same lock as rate(), taken in id order so concurrent batches cannot deadlock
+            list(Movie.objects.select_for_update().filter(pk__in=movie_ids)
+                 .order_by('pk').values_list('pk', flat=True))
+            previous = {
+                (user_id, movie_id): stars
+                for user_id, movie_id, stars in self.filter(movie_id__in=movie_ids, user_id__in=user_ids)
+                .values_list('user_id', 'movie_id', 'stars')
+                if (user_id, movie_id) in latest
+            }
+
+            # Ratings that would not change are left alone, keeping their updated time
+            self.bulk_create(
+                [self.model(user_id=user_id, movie_id=movie_id, stars=stars)
+                 for (user_id, movie_id), stars in latest.items() if previous.get((user_id, movie_id)) != stars],
+                update_conflicts=True, unique_fields=['user', 'movie'], update_fields=['stars', 'updated'],
+                batch_size=500,
+            )
+
+            deltas = {}
+            for key, stars in latest.items():
+                count, total, events = deltas.get(key[1], (0, 0, 0))
+                if key not in previous:
+                    deltas[key[1]] = (count + 1, total + stars, events + 1)
+                elif previous[key] != stars:
+                    deltas[key[1]] = (count, total + stars - previous[key], events + 1)
+            Movie.apply_rating_deltas(deltas)
+            invalidate_rating_maps(user_ids)
+
+        return len(latest) - len(previous), len(previous)
+
 
 class Rating(models.Model):
     # If movie is deleted, Rating object will be deleted
@@ -43,18 +239,81 @@ class Rating(models.Model):
     stars = models.IntegerField(validators=[MinValueValidator(1),
                                             MaxValueValidator(5)])
 
+    # Last time the rating was created or changed, for the rating map's ?since= deltas
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = RatingManager()
+
     # Setup unique, index together (should study this more)
     # unique together, two or more model fields to be unique, we can use this
-    # index together, the fields will be indexed together
     class Meta:
         unique_together = (('user', 'movie'), )
-        index_together = (('user', 'movie'), )
+        indexes = [
+            # Covers the rating map, which reads movie and stars of one user from the index alone;
+            # it also replaces the old index_together on (user, movie)
+            models.Index(fields=['user', 'movie', 'stars'], name='api_rating_user_map_idx'),
+            # Backs the rating map's deltas
+            models.Index(fields=['user', 'updated'], name='api_rating_user_updated_idx'),
+        ]
+
+    # Remember the stored values so the aggregate signals can compute deltas
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+
+class SimilarMovie(models.Model):
+    """
+    One of a movie's nearest neighbours by rating similarity, written by
+    api.recommendations.rebuild_similar_movies().
+    """
+    movie = models.ForeignKey(Movie, related_name='similar_movies', on_delete=models.CASCADE)
+    similar = models.ForeignKey(Movie, related_name='similar_to', on_delete=models.CASCADE)
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['movie', '-score'], name='api_similar_movie_score_idx'),
+        ]
 
 
 class Rule(models.Model):
     data = models.JSONField(null=True)
 
 
+# Relational projection of Rule.data, rebuilt by api.rules.sync_rule_projection
+# whenever a Rule is saved, so src/dst/port searches run as indexed SQL lookups
+class RuleAddress(models.Model):
+    SIDE_CHOICES = (('source', 'Source'), ('destination', 'Destination'))
+
+    rule = models.ForeignKey(Rule, related_name='addresses', on_delete=models.CASCADE)
+    side = models.CharField(max_length=11, choices=SIDE_CHOICES)
+    version = models.PositiveSmallIntegerField()
+    # Network bounds as fixed-width hex integers, so IPv6 fits and string order is numeric order
+    network_start = models.CharField(max_length=32)
+    network_end = models.CharField(max_length=32)
+    prefixlen = models.PositiveSmallIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['side', 'version', 'prefixlen', 'network_start'],
+                         name='api_ruleaddr_lookup_idx'),
+        ]
+
+
+class RuleService(models.Model):
+    rule = models.ForeignKey(Rule, related_name='services', on_delete=models.CASCADE)
+    protocol = models.CharField(max_length=32)
+    port = models.CharField(max_length=255)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['port', 'rule'], name='api_ruleservice_port_idx'),
+        ]
+
+
 class Dog(models.Model):
     name = models.CharField(max_length=200)
     data = models.JSONField(null = True)
@@ -16,6 +16,15 @@ class IsOwnerOrReadOnly(BasePermission):
         return obj.user == request.user
 
 
+class IsOwner(BasePermission):
+    """
+    Only the owner of an object may read or change it.
+    """
+
+    def has_object_permission(self, request, view, obj):
+        return obj.user_id == request.user.id
+
+
 class IsAdminOrIsOwnerOrReadOnly(BasePermission):
     """
     Custom permission to allow admin users to have full privileges (GET, POST, PUT, DELETE),
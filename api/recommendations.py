@@ -0,0 +1,227 @@
+from itertools import chain
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Sum
+from scipy import sparse
+
+from api.ingest import chunked
+from api.models import Movie, Rating, SimilarMovie
+
+# Neighbours kept per movie
+NEIGHBOURS = 20
+# Users two movies need in common before their similarity counts
+MIN_SUPPORT = 2
+# Only this many of each user's most recent ratings take part; heavy raters'
+# older ratings multiply the work and carry little signal
+MAX_USER_RATINGS = 1000
+# Cells of the dense similarity rows computed at once (8 bytes each, a few arrays at a time)
+DENSE_CELLS = 4 * 1024 * 1024
+METHODS = ('adjusted-cosine', 'cosine')
+
+
+class RatingMatrix:
+    """
+    Sparse user x movie rating matrix (SciPy CSR), with its movie x user transpose for a
+    movie's raters. Similarities of a batch of movies to every other movie are two sparse
+    products: rating dot products, and the number of raters in common.
+
+    With adjusted-cosine each rating has its user's mean subtracted, so users who rate
+    everything high (or low) are compared on what they prefer rather than on their scale.
+    """
+
+    def __init__(self, user_idx=(), movie_ids=(), movie_idx=(), values=()):
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        shape = (int(np.max(user_idx, initial=-1)) + 1, len(self.movie_ids))
+        # The user x movie ratings, and which user rated which movie (a zero rating still counts)
+        self.ratings = sparse.csr_matrix((values, (user_idx, movie_idx)), shape=shape, dtype=np.float64)
+        self.rated = sparse.csr_matrix((np.ones(len(values)), (user_idx, movie_idx)), shape=shape)
+        # Each movie's raters; those with a zero rating add nothing to its dot products
+        self.raters = self.ratings.T.tocsr()
+        self.raters.eliminate_zeros()
+        self.raters_rated = self.raters.copy()
+        self.raters_rated.data[:] = 1.0
+        self.norms = movie_norms(self.raters)
+
+    @classmethod
+    def load(cls, method=METHODS[0], max_user_ratings=MAX_USER_RATINGS, movie_ids=None, batch_size=500):
+        """
+        Read the Rating table in one pass, newest ratings of each user first.
+
+        With movie_ids, only what the neighbours of those movies depend on is read: the
+        ratings of the users who rated them, and the ratings of the other movies those
+        users rated, for their norms. Such a matrix only answers for the given movies.
+        """
+        if method not in METHODS:
+            raise ValueError(f'unknown similarity method {method!r}')
+        if movie_ids is None:
+            _, user_idx, movies, values = user_windows(*read_ratings(Rating.objects.all()), method, max_user_ratings)
+            movie_ids, movie_idx = np.unique(movies, return_inverse=True)
+            return cls(user_idx, movie_ids, movie_idx, values)
+
+        raters = set()
+        for batch in chunked(movie_ids, batch_size):
+            raters.update(Rating.objects.filter(movie__in=batch).order_by().values_list('user', flat=True).distinct())
+        users, user_idx, movies, values = user_windows(*read_user_ratings(raters, batch_size),
+                                                       method, max_user_ratings)
+        candidates, movie_idx = np.unique(movies, return_inverse=True)
+        matrix = cls(user_idx, candidates, movie_idx, values)
+
+        # The other movies' norms also count their raters outside the matrix
+        matrix.norms = column_norms(candidates, users, (users[user_idx], movies, values),
+                                    method, max_user_ratings, batch_size)
+        return matrix
+
+    def neighbours(self, movie_id, k=NEIGHBOURS, min_support=MIN_SUPPORT):
+        """
+        Return the k most similar movies as [(movie_id, cosine similarity)], best first.
+        Only positive similarities count.
+        """
+        return self.neighbours_of([movie_id], k, min_support)[movie_id]
+
+    def neighbours_of(self, movie_ids, k=NEIGHBOURS, min_support=MIN_SUPPORT):
+        """
+        neighbours() of several movies at once, as {movie_id: [(movie_id, similarity)]}.
+        """
+        found = {movie_id: [] for movie_id in movie_ids}
+        positions = np.searchsorted(self.movie_ids, list(found))
+        known = [(movie_id, int(i)) for movie_id, i in zip(found, positions)
+                 if i < len(self.movie_ids) and self.movie_ids[i] == movie_id and self.norms[i]]
+        if not known:
+            return found
+
+        # Dense similarity rows of a sub-batch stay within DENSE_CELLS cells
+        step = max(1, DENSE_CELLS // max(len(self.movie_ids), 1))
+        for batch in chunked(known, step):
+            rows = np.array([i for _, i in batch])
+            dots = (self.raters[rows] @ self.ratings).toarray()
+            common = (self.raters_rated[rows] @ self.rated).toarray()
+            valid = (dots > 0) & (common >= min_support)
+            valid[np.arange(len(rows)), rows] = False
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scores = np.where(valid, dots / np.outer(self.norms[rows], self.norms), -np.inf)
+            # Columns are in movie id order, so a stable sort gives ties to the lower movie id
+            best = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+            for (movie_id, _), row_scores, row_valid, row_best in zip(batch, scores, valid, best):
+                row_best = row_best[row_valid[row_best]]
+                found[movie_id] = [(int(other), float(score))
+                                   for other, score in zip(self.movie_ids[row_best], row_scores[row_best])]
+        return found
+
+
+def read_ratings(ratings, ordered=True):
+    """
+    Return (users, movies, stars) arrays of a Rating queryset, by user and newest ratings
+    first unless ordered=False.
+    """
+    rows = ratings.order_by(*(('user', '-updated') if ordered else ())).values_list('user', 'movie', 'stars')
+    return np.fromiter(chain.from_iterable(rows.iterator(chunk_size=5000)), dtype=np.int64).reshape(-1, 3).T
+
+
+def read_user_ratings(user_ids, batch_size=500):
+    """
+    read_ratings() of every rating of the given users.
+    """
+    parts = [read_ratings(Rating.objects.filter(user__in=batch)) for batch in chunked(sorted(user_ids), batch_size)]
+    return np.concatenate(parts or [np.zeros((3, 0), dtype=np.int64)], axis=1)
+
+
+def user_windows(users, movies, stars, method, max_user_ratings):
+    """
+    Keep the max_user_ratings newest of each user's read_ratings(). Returns (user ids,
+    user index, movie and value of each kept rating), values less their user's mean with
+    adjusted-cosine.
+    """
+    first = np.ones(len(users), dtype=bool)
+    first[1:] = users[1:] != users[:-1]
+    # Position of each rating among its user's, newest first
+    position = np.arange(len(users)) - np.maximum.accumulate(np.where(first, np.arange(len(users)), 0))
+    keep = position < max_user_ratings
+    user_idx = (np.cumsum(first) - 1)[keep]
+    values = stars[keep].astype(np.float64)
+    if method == 'adjusted-cosine' and len(values):
+        values -= (np.bincount(user_idx, weights=values) / np.bincount(user_idx))[user_idx]
+    return users[first], user_idx, movies[keep], values
+
+
+def column_norms(movie_ids, users, ratings, method, max_user_ratings, batch_size=500):
+    """
+    movie_norms() of the given movies' full rating columns. ratings are the (user, movie,
+    value) of the windows already read for `users`; the movies' other raters are read
+    here, with a rating count and sum per user for their windows and means, and the
+    windows of the users over the limit in full.
+    """
+    others = np.concatenate([read_ratings(Rating.objects.filter(movie__in=batch), ordered=False)
+                             for batch in chunked(movie_ids.tolist(), batch_size)]
+                            or [np.zeros((3, 0), dtype=np.int64)], axis=1)
+    others = others[:, ~np.isin(others[0], users)]
+    totals = {}
+    for batch in chunked(np.unique(others[0]).tolist(), batch_size):
+        totals.update((user, (count, total)) for user, count, total in
+                      Rating.objects.filter(user__in=batch).order_by().values('user')
+                      .annotate(count=Count('id'), total=Sum('stars')).values_list('user', 'count', 'total'))
+
+    columns = [ratings]
+    heavy = [user for user, (count, _) in totals.items() if count > max_user_ratings]
+    if heavy:
+        heavy_users, user_idx, movies, values = user_windows(*read_user_ratings(heavy, batch_size),
+                                                             method, max_user_ratings)
+        within = np.isin(movies, movie_ids)
+        columns.append((heavy_users[user_idx][within], movies[within], values[within]))
+        others = others[:, ~np.isin(others[0], heavy)]
+    values = others[2].astype(np.float64)
+    if method == 'adjusted-cosine' and len(values):
+        values -= [totals[user][1] / totals[user][0] for user in others[0].tolist()]
+    columns.append((others[0], others[1], values))
+
+    # Built like RatingMatrix.raters, so the norms come out the same as from a full load
+    column_users, column_movies, column_values = (np.concatenate(part) for part in zip(*columns))
+    user_ids, user_idx = np.unique(column_users, return_inverse=True)
+    raters = sparse.csr_matrix((column_values, (np.searchsorted(movie_ids, column_movies), user_idx)),
+                               shape=(len(movie_ids), len(user_ids)), dtype=np.float64)
+    raters.eliminate_zeros()
+    return movie_norms(raters)
+
+
+def movie_norms(raters):
+    """
+    Euclidean norm of each row of a movie x user ratings matrix.
+    """
+    return np.sqrt(np.asarray(raters.multiply(raters).sum(axis=1)).ravel())
+
+
+def rebuild_similar_movies(full=False, k=NEIGHBOURS, min_support=MIN_SUPPORT, method=METHODS[0],
+                           max_user_ratings=MAX_USER_RATINGS, batch_size=500):
+    """
+    Recompute the SimilarMovie rows of every movie whose ratings changed since its last
+    rebuild (similar_stale), or of all movies with full=True. Returns the number of movies.
+
+    A stale movie's neighbours are recomputed in full, but the lists of other movies it
+    appears in are left as they are until they go stale themselves or a full rebuild.
+    """
+    targets = Movie.objects.order_by('pk')
+    if not full:
+        targets = targets.filter(similar_stale=True)
+    targets = list(targets.values_list('pk', flat=True))
+    # Cleared before the ratings are read, so a rating arriving meanwhile marks its movie again
+    for batch in chunked(targets, batch_size):
+        Movie.objects.filter(pk__in=batch).update(similar_stale=False)
+
+    if not targets:
+        return 0
+    # An incremental run only reads the ratings its targets' neighbours depend on
+    matrix = RatingMatrix.load(method, max_user_ratings, movie_ids=None if full else targets)
+    for batch in chunked(targets, batch_size):
+        neighbours = matrix.neighbours_of(batch, k, min_support)
+        with transaction.atomic():
+            # Skip movies deleted since the ratings were read
+            existing = set(Movie.objects.filter(
+                pk__in={other for found in neighbours.values() for other, _ in found} | set(batch),
+            ).values_list('pk', flat=True))
+            SimilarMovie.objects.filter(movie__in=batch).delete()
+            SimilarMovie.objects.bulk_create([
+                SimilarMovie(movie_id=movie_id, similar_id=other, score=score)
+                for movie_id, found in neighbours.items() if movie_id in existing
+                for other, score in found if other in existing
+            ], batch_size=1000)
+    return len(targets)
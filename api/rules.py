@@ -0,0 +1,435 @@
+import ipaddress
+import json
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from django.db import transaction
+from django.db.models import Q
+
+from api.ingest import RecordError, chunked
+from api.models import Rule, RuleAddress, RuleService
+
+RULE_SIDES = ('source', 'destination')
+
+# Upper bound on distinct address strings kept by parse_network()
+NETWORK_CACHE_SIZE = 8192
+
+
+@lru_cache(maxsize=NETWORK_CACHE_SIZE)
+def parse_network(value):
+    """
+    Parse an address or CIDR string into an integer range.
+    Returns (version, start, end, prefixlen); raises ValueError on bad input.
+
+    A bare address is a single host for both IPv4 (/32) and IPv6 (/128).
+    Results are kept in a bounded LRU cache, see network_cache_stats().
+    """
+    network = ipaddress.ip_network(value.strip(), strict=False)
+    return (network.version, int(network.network_address),
+            int(network.broadcast_address), network.prefixlen)
+
+
+def network_cache_stats():
+    info = parse_network.cache_info()
+    return {'hits': info.hits, 'misses': info.misses,
+            'size': info.currsize, 'maxsize': info.maxsize}
+
+
+def rule_addresses(data):
+    """
+    Yield (side, ip) for every source/destination entry of a Rule.data document.
+    """
+    if not isinstance(data, dict):
+        return
+    for side in RULE_SIDES:
+        for entry in data.get(side) or []:
+            if isinstance(entry, dict) and isinstance(entry.get('ip'), str):
+                yield side, entry['ip']
+
+
+def rule_services(data):
+    """
+    Yield (protocol, value) for every non-description value in Rule.data['service'],
+    e.g. {"tcp": {"port": "443"}} gives ('tcp', '443') and {"icmp": {"type": "8"}} gives ('icmp', '8').
+    """
+    if not isinstance(data, dict):
+        return
+    for svc in data.get('service') or []:
+        if not isinstance(svc, dict):
+            continue
+        for protocol, fields in svc.items():
+            if not isinstance(fields, dict):
+                continue
+            for k, v in fields.items():
+                if k != 'description':
+                    yield protocol, v
+
+
+def encode_address(value):
+    """
+    Encode an integer address as the fixed-width hex stored in RuleAddress.
+    """
+    return f'{value:032x}'
+
+
+def rule_projection(data):
+    """
+    Build the RuleAddress and RuleService field values for one Rule.data document.
+    Returns two lists of dicts, ready to be passed as model kwargs.
+    """
+    addresses = []
+    seen = set()
+    for side, ip in rule_addresses(data):
+        try:
+            network = parse_network(ip)
+        except ValueError:
+            # Unparseable rule addresses can never match a search
+            continue
+        if (side, network) in seen:
+            continue
+        seen.add((side, network))
+        version, start, end, prefixlen = network
+        addresses.append({'side': side, 'version': version,
+                          'network_start': encode_address(start),
+                          'network_end': encode_address(end),
+                          'prefixlen': prefixlen})
+
+    services = []
+    seen = set()
+    for protocol, value in rule_services(data):
+        # Searches compare the raw query string, so only string values can ever match
+        if isinstance(value, str) and len(value) <= 255 and (protocol, value) not in seen:
+            seen.add((protocol, value))
+            services.append({'protocol': protocol[:32], 'port': value})
+
+    return addresses, services
+
+
+def sync_rule_projection(rules, address_model=RuleAddress, service_model=RuleService):
+    """
+    Replace the RuleAddress/RuleService rows of the given rules with rows built from their data.
+    The model arguments let migrations pass their historical models.
+    """
+    rules = list(rules)
+    addresses, services = [], []
+    for rule in rules:
+        address_rows, service_rows = rule_projection(rule.data)
+        addresses.extend(address_model(rule_id=rule.id, **row) for row in address_rows)
+        services.extend(service_model(rule_id=rule.id, **row) for row in service_rows)
+
+    rule_ids = [rule.id for rule in rules]
+    with transaction.atomic():
+        address_model.objects.filter(rule_id__in=rule_ids).delete()
+        service_model.objects.filter(rule_id__in=rule_ids).delete()
+        address_model.objects.bulk_create(addresses, batch_size=1000)
+        service_model.objects.bulk_create(services, batch_size=1000)
+
+
+def containing_rules(side, network):
+    """
+    Return a RuleAddress rule_id queryset of rules whose `side` address equals
+    or contains `network`, a (version, start, end, prefixlen) tuple from parse_network().
+
+    CIDR blocks either nest or are disjoint, so the only block of prefix length p that
+    can contain the search is its start address masked to p bits. That turns the
+    overlap test into one index seek per prefix length actually used by the rules.
+    """
+    candidates, prefixlens = _containing_candidates(side, network)
+    return _containing_blocks(candidates, network, prefixlens)
+
+
+async def acontaining_rules(side, network):
+    """
+    containing_rules() for async views, reading the prefix lengths through the async ORM.
+    """
+    candidates, prefixlens = _containing_candidates(side, network)
+    return _containing_blocks(candidates, network, [p async for p in prefixlens])
+
+
+def _containing_candidates(side, network):
+    version, _, _, prefixlen = network
+    candidates = RuleAddress.objects.filter(side=side, version=version)
+    prefixlens = candidates.filter(prefixlen__lte=prefixlen) \
+        .values_list('prefixlen', flat=True).distinct().order_by()
+    return candidates, prefixlens
+
+
+def _containing_blocks(candidates, network, prefixlens):
+    version, start, _, _ = network
+    width = 32 if version == 4 else 128
+    q = Q()
+    for rule_prefixlen in prefixlens:
+        host_bits = width - rule_prefixlen
+        q |= Q(prefixlen=rule_prefixlen, network_start=encode_address(start >> host_bits << host_bits))
+
+    if not q:
+        return RuleAddress.objects.none().values('rule_id')
+    return candidates.filter(q).values('rule_id')
+
+
+def rules_with_port(port):
+    return RuleService.objects.filter(port=port).values('rule_id')
+
+
+def search_rules(queryset, src='', dst='', port=''):
+    """
+    Narrow a Rule queryset to the rules matching every non-empty criterion; no criteria
+    matches nothing. Raises ValueError for a malformed src or dst.
+    """
+    criteria = []
+    if src != '':
+        criteria.append(containing_rules('source', parse_network(src)))
+    if dst != '':
+        criteria.append(containing_rules('destination', parse_network(dst)))
+    return _filter_rules(queryset, criteria, port)
+
+
+async def asearch_rules(queryset, src='', dst='', port=''):
+    """
+    search_rules() for async views.
+    """
+    criteria = []
+    if src != '':
+        criteria.append(await acontaining_rules('source', parse_network(src)))
+    if dst != '':
+        criteria.append(await acontaining_rules('destination', parse_network(dst)))
+    return _filter_rules(queryset, criteria, port)
+
+
+def _filter_rules(queryset, criteria, port):
+    if port != '':
+        criteria.append(rules_with_port(port))
+    # The rule rows are only read for the returned page
+    if not criteria:
+        return queryset.none()
+    for rule_ids in criteria:
+        queryset = queryset.filter(id__in=rule_ids)
+    return queryset
+
+
+def parse_flows(flows):
+    """
+    Parse {"src", "dst", "port"} flows for match_flows(); each key reads like the rule
+    list's query parameter of the same name, and a missing key like an empty one.
+    Returns ([(src, dst, port)], errors), src and dst being parse_network() tuples or None
+    and errors a list of {"flow": index, "errors": {key: [message]}}.
+    """
+    parsed, errors = [], []
+    for i, flow in enumerate(flows):
+        if not isinstance(flow, dict):
+            errors.append({'flow': i, 'errors': {'non_field_errors': ['Expected a flow object.']}})
+            continue
+        flow_errors, criteria = {}, []
+        for key in ('src', 'dst'):
+            value = flow.get(key, '')
+            try:
+                criteria.append(parse_network(value) if value != '' else None)
+            except (TypeError, ValueError, AttributeError):
+                flow_errors[key] = ['Check the searching ip format.']
+        port = flow.get('port', '')
+        # A JSON number stands for its query string form
+        if isinstance(port, int) and not isinstance(port, bool):
+            port = str(port)
+        if not isinstance(port, str):
+            flow_errors['port'] = ['Check the searching port format.']
+        if flow_errors:
+            errors.append({'flow': i, 'errors': flow_errors})
+        else:
+            parsed.append((*criteria, port or None))
+    return parsed, errors
+
+
+def match_flows(flows, chunk_size=500):
+    """
+    Return the ids of the rules matching each (src, dst, port) flow of parse_flows(),
+    sorted, exactly as search_rules() would find them; no criteria matches nothing.
+
+    The RuleAddress rows the flows can match are read once into sorted NumPy arrays of
+    block starts, one per side, version and prefix length, the keys of containing_rules()'
+    index seeks. All flows are then looked up together with np.searchsorted(), their
+    starts masked to each prefix length, and a flow matches the rules found for each of
+    its addresses that also have its port in the RuleService rows.
+    """
+    # Longest prefix a rule block may have to contain some flow, per (side, version)
+    wanted = {}
+    for src, dst, _ in flows:
+        for side, network in zip(RULE_SIDES, (src, dst)):
+            if network is not None:
+                key = (side, network[0])
+                wanted[key] = max(wanted.get(key, 0), network[3])
+
+    rows = {}
+    if wanted:
+        q = Q()
+        for (side, version), prefixlen in wanted.items():
+            q |= Q(side=side, version=version, prefixlen__lte=prefixlen)
+        address_rows = RuleAddress.objects.filter(q).order_by() \
+            .values_list('side', 'version', 'prefixlen', 'network_start', 'rule_id')
+        for side, version, prefixlen, start, rule_id in address_rows.iterator(chunk_size=5000):
+            starts, rule_ids = rows.setdefault((side, version, prefixlen), ([], []))
+            starts.append(int(start, 16))
+            rule_ids.append(rule_id)
+
+    ports = sorted({port for _, _, port in flows if port is not None})
+    services = []
+    for batch in chunked(ports, chunk_size):
+        services.extend(RuleService.objects.filter(port__in=batch).values_list('port', 'rule_id'))
+
+    # A (flow, rule) pair is one int64 key, flow major, so sorted keys are grouped by flow
+    stride = 1 + max([rule_id for _, rule_id in services] + [max(rule_ids) for _, rule_ids in rows.values()],
+                     default=0)
+
+    # Pairs found per address criterion, and the number of address criteria of each flow
+    found, needed = [], np.zeros(len(flows), dtype=np.int64)
+    for (side, version), longest in wanted.items():
+        index = RULE_SIDES.index(side)
+        flow_index = np.array([i for i, flow in enumerate(flows)
+                               if flow[index] is not None and flow[index][0] == version], dtype=np.int64)
+        # IPv6 addresses overflow int64, so they stay Python ints in object arrays
+        dtype = np.int64 if version == 4 else object
+        flow_starts = np.array([flows[i][index][1] for i in flow_index], dtype=dtype)
+        flow_prefixlens = np.array([flows[i][index][3] for i in flow_index], dtype=np.int64)
+        needed[flow_index] += 1
+
+        keys = []
+        for (rule_side, rule_version, rule_prefixlen), (starts, rule_ids) in rows.items():
+            if (rule_side, rule_version) != (side, version):
+                continue
+            starts = np.array(starts, dtype=dtype)
+            order = np.argsort(starts, kind='stable')
+            host_bits = (32 if version == 4 else 128) - rule_prefixlen
+            within = flow_prefixlens >= rule_prefixlen
+            flow_ids, rule_ids = _lookup(starts[order], np.array(rule_ids, dtype=np.int64)[order],
+                                         flow_starts[within] >> host_bits << host_bits, flow_index[within])
+            keys.append(flow_ids * stride + rule_ids)
+        if keys:
+            # A rule may hold several blocks containing the same flow
+            found.append(np.unique(np.concatenate(keys)))
+
+    keys, counts = np.unique(np.concatenate(found or [np.zeros(0, dtype=np.int64)]), return_counts=True)
+    matched = keys[counts == needed[keys // stride]]
+
+    if ports:
+        codes = {port: code for code, port in enumerate(ports)}
+        flow_ports = np.array([-1 if port is None else codes[port] for _, _, port in flows], dtype=np.int64)
+        service_keys = np.unique(np.array([codes[port] * stride + rule_id for port, rule_id in services],
+                                          dtype=np.int64))
+        # Address matches are kept when the rule also has the flow's port, which is far
+        # cheaper than pairing each port with every flow naming it
+        matched_ports = flow_ports[matched // stride]
+        matched = matched[(matched_ports < 0) | np.isin(matched_ports * stride + matched % stride, service_keys)]
+        # Flows with only a port match every rule that has it
+        port_only = np.flatnonzero((flow_ports >= 0) & (needed == 0))
+        flow_ids, rule_ids = _lookup(service_keys // stride, service_keys % stride,
+                                     flow_ports[port_only], port_only)
+        matched = np.sort(np.concatenate([matched, flow_ids * stride + rule_ids]))
+
+    bounds = np.searchsorted(matched // stride, np.arange(len(flows) + 1))
+    return [(matched[lo:hi] % stride).tolist() for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+def _lookup(keys, values, queries, query_ids):
+    """
+    Return (query ids, values) pairs of every sorted `keys` entry equal to a query.
+    """
+    lo = np.searchsorted(keys, queries, side='left')
+    counts = np.searchsorted(keys, queries, side='right') - lo
+    # Positions lo..lo+count-1 of each query, laid end to end
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(query_ids, counts), values[np.repeat(lo, counts) + offsets]
+
+
+def validate_rule_data(data):
+    """
+    Check the parts of a Rule.data document the search relies on.
+    Returns a dict of error lists, empty when the document is valid.
+    """
+    if not isinstance(data, dict):
+        return {'non_field_errors': ['Expected a rule object.']}
+
+    errors = {}
+    for side in RULE_SIDES:
+        entries = data.get(side)
+        if not isinstance(entries, list):
+            errors[side] = ['Expected a list of addresses.']
+            continue
+        for i, entry in enumerate(entries):
+            ip = entry.get('ip') if isinstance(entry, dict) else None
+            if not isinstance(ip, str):
+                errors.setdefault(side, []).append(f'Entry {i}: expected an object with an "ip".')
+                continue
+            try:
+                parse_network(ip)
+            except ValueError:
+                errors.setdefault(side, []).append(f'Entry {i}: "{ip}" is not an address or network.')
+
+    services = data.get('service')
+    if not isinstance(services, list):
+        errors['service'] = ['Expected a list of services.']
+    else:
+        for i, svc in enumerate(services):
+            if not isinstance(svc, dict) or not all(isinstance(v, dict) for v in svc.values()):
+                errors.setdefault('service', []).append(
+                    f'Entry {i}: expected an object like {{"tcp": {{"port": "443"}}}}.')
+    return errors
+
+
+def import_rules(records, batch_size=1000, max_errors=100):
+    """
+    Insert rules from (position, document) records, e.g. from api.ingest.iter_records().
+
+    Each record is either a Rule.data document or an exported {"id", "data"} object
+    (the id is ignored). Valid rules are inserted together with their RuleAddress/
+    RuleService rows, one transaction per batch. Returns the import statistics.
+    """
+    stats = {'received': 0, 'created': 0, 'failed': 0, 'aborted': False, 'errors': []}
+    started = time.perf_counter()
+
+    def fail(position, error):
+        stats['failed'] += 1
+        if len(stats['errors']) < max_errors:
+            stats['errors'].append({'record': position, 'errors': error})
+
+    def documents():
+        try:
+            yield from records
+        except RecordError as e:
+            # An undecodable JSON array ends the import; earlier records are kept
+            fail(e.record, {'non_field_errors': [e.message]})
+            stats['aborted'] = True
+
+    for batch in chunked(documents(), batch_size):
+        stats['received'] += len(batch)
+        rules = []
+        for position, document in batch:
+            if isinstance(document, RecordError):
+                fail(position, {'non_field_errors': [document.message]})
+                continue
+            if isinstance(document, dict) and 'source' not in document and isinstance(document.get('data'), dict):
+                document = document['data']
+            errors = validate_rule_data(document)
+            if errors:
+                fail(position, errors)
+            else:
+                rules.append(Rule(data=document))
+
+        if rules:
+            with transaction.atomic():
+                # bulk_create skips the post_save signal, so project the rules here
+                rules = Rule.objects.bulk_create(rules)
+                sync_rule_projection(rules)
+            stats['created'] += len(rules)
+
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    stats['rules_per_second'] = round(stats['received'] / stats['seconds'], 1) if stats['seconds'] else None
+    return stats
+
+
+def export_rules(chunk_size=1000):
+    """
+    Yield every rule as an NDJSON line of {"id", "data"}, reading the table with .iterator().
+    """
+    for rule_id, data in Rule.objects.order_by('id').values_list('id', 'data').iterator(chunk_size=chunk_size):
+        yield json.dumps({'id': rule_id, 'data': data}, ensure_ascii=False) + '\n'
@@ -0,0 +1,186 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+# Words of the search string; each one is matched as a prefix
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_tokens(query):
+    return TOKEN_RE.findall(query.lower())
+
+
+class SearchBackend:
+    """
+    Full-text search over Movie title and description.
+
+    Backends own their index structures: install() creates them (called from the
+    rebuild_search_index command), index()/remove() keep them in sync (called from the Movie signals)
+    and search() narrows and ranks a Movie queryset.
+    """
+
+    def install(self, schema_editor):
+        pass
+
+    def uninstall(self, schema_editor):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def index(self, movie_ids):
+        pass
+
+    def remove(self, movie_ids):
+        pass
+
+    def search(self, queryset, query):
+        raise NotImplementedError
+
+
+class ContainsSearchBackend(SearchBackend):
+    """
+    Unindexed substring match on the title, for databases without a full-text engine.
+    """
+
+    def search(self, queryset, query):
+        return queryset.filter(title__contains=query)
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """
+    SQLite FTS5 virtual table keyed by movie id, ranked with bm25 (title weighted over description).
+    """
+    table = 'api_movie_fts'
+    tokenizer = 'unicode61 remove_diacritics 2'
+    title_weight = 10.0
+    description_weight = 1.0
+
+    def install(self, schema_editor):
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} "
+            f"USING fts5(title, description, tokenize='{self.tokenizer}')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {self.table} (rowid, title, description) "
+            f"SELECT id, title, description FROM api_movie"
+        )
+
+    def uninstall(self, schema_editor):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            cursor.execute(f"INSERT INTO {self.table} (rowid, title, description) "
+                           f"SELECT id, title, description FROM api_movie")
+
+    def index(self, movie_ids):
+        placeholders = ', '.join(['%s'] * len(movie_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})", movie_ids)
+            cursor.execute(f"INSERT INTO {self.table} (rowid, title, description) "
+                           f"SELECT id, title, description FROM api_movie WHERE id IN ({placeholders})",
+                           movie_ids)
+
+    def remove(self, movie_ids):
+        placeholders = ', '.join(['%s'] * len(movie_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})", movie_ids)
+
+    def search(self, queryset, query):
+        tokens = search_tokens(query)
+        if not tokens:
+            # Nothing but punctuation or whitespace to match as words
+            return ContainsSearchBackend().search(queryset, query)
+        # Quote every token so FTS5 operators in user input are taken literally
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        model_table = queryset.model._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s", (match,))
+        ).annotate(
+            search_rank=RawSQL(
+                f"SELECT bm25({self.table}, %s, %s) FROM {self.table} "
+                f"WHERE {self.table} MATCH %s AND rowid = {model_table}.id",
+                (self.title_weight, self.description_weight, match))
+        ).order_by('search_rank', '-pub_date', '-id')
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Postgres tsvector side table with a GIN index, ranked with ts_rank (title weighted A, description B).
+    """
+    table = 'api_movie_search'
+    config = 'english'
+
+    def install(self, schema_editor):
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            f"movie_id bigint PRIMARY KEY REFERENCES api_movie(id) ON DELETE CASCADE, "
+            f"document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.table}_document_gin ON {self.table} USING GIN (document)"
+        )
+        schema_editor.execute(self._upsert_sql(''), [self.config, self.config])
+
+    def uninstall(self, schema_editor):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {self.table}")
+            cursor.execute(self._upsert_sql(''), [self.config, self.config])
+
+    def index(self, movie_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(self._upsert_sql('WHERE id = ANY(%s)'),
+                           [self.config, self.config, list(movie_ids)])
+
+    def remove(self, movie_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE movie_id = ANY(%s)", [list(movie_ids)])
+
+    def search(self, queryset, query):
+        tokens = search_tokens(query)
+        if not tokens:
+            # Nothing but punctuation or whitespace to match as words
+            return ContainsSearchBackend().search(queryset, query)
+        tsquery = ' & '.join(f'{token}:*' for token in tokens)
+        model_table = queryset.model._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(f"SELECT movie_id FROM {self.table} "
+                          f"WHERE document @@ to_tsquery(%s, %s)", (self.config, tsquery))
+        ).annotate(
+            search_rank=RawSQL(
+                f"SELECT ts_rank(document, to_tsquery(%s, %s)) FROM {self.table} "
+                f"WHERE movie_id = {model_table}.id", (self.config, tsquery))
+        ).order_by('-search_rank', '-pub_date', '-id')
+
+    def _upsert_sql(self, where):
+        return (
+            f"INSERT INTO {self.table} (movie_id, document) "
+            f"SELECT id, setweight(to_tsvector(%s, coalesce(title, '')), 'A') || "
+            f"setweight(to_tsvector(%s, coalesce(description, '')), 'B') "
+            f"FROM api_movie {where} "
+            f"ON CONFLICT (movie_id) DO UPDATE SET document = EXCLUDED.document"
+        )
+
+
+DEFAULT_BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend(vendor=None):
+    """
+    Return the MOVIE_SEARCH_BACKEND from settings, or the default backend for the database vendor.
+    """
+    backend_path = getattr(settings, 'MOVIE_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    return DEFAULT_BACKENDS.get(vendor or connection.vendor, ContainsSearchBackend)()
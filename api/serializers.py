@@ -1,7 +1,22 @@
+import binascii
+import functools
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
 from django.contrib.auth.models import User
-from rest_framework import serializers
+from django.core.exceptions import ImproperlyConfigured
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.fields import empty
+from rest_framework.exceptions import NotFound
 from rest_framework.authtoken.models import Token
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination, BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 from api.models import Movie, Rating, BoardComment, Rule, Dog
 
 
@@ -9,6 +24,8 @@ class RatingSerializer(serializers.ModelSerializer):
     class Meta:
         model = Rating
         fields = ('id', 'stars', 'user', 'movie')
+        # Ratings are created by rate_movie/bulk; an update only changes the stars
+        read_only_fields = ('user', 'movie')
 
 
 # User serializer setting
@@ -48,14 +65,32 @@ class BoardCommentSerializer(serializers.ModelSerializer):
 
 
 class MovieSerializer(serializers.ModelSerializer):
+    # Only the newest comments are embedded, the full thread is /movies/{id}/comments/
+    recent_comments_limit = 5
+
     # Fixing user
     user = serializers.ReadOnlyField(source='user.username')
-    comments = BoardCommentSerializer(many=True, read_only=True)
+    comments = serializers.SerializerMethodField()
+    no_of_comments = serializers.SerializerMethodField()
 
     class Meta:
         model = Movie
         fields = ('id', 'title', 'pub_date', 'description',
-                  'no_of_ratings', 'avg_ratings', 'user', 'comments')
+                  'no_of_ratings', 'avg_ratings', 'user', 'no_of_comments', 'comments')
+
+    def get_comments(self, obj):
+        # MovieViewSet prefetches these into recent_comments
+        comments = getattr(obj, 'recent_comments', None)
+        if comments is None:
+            comments = obj.comments.select_related('user') \
+                .order_by('-pub_date', '-id')[:self.recent_comments_limit]
+        return BoardCommentSerializer(comments, many=True).data
+
+    def get_no_of_comments(self, obj):
+        count = getattr(obj, 'comment_count', None)
+        if count is None:
+            count = obj.comments.count()
+        return count
 
 
 class MovieListSerializer(serializers.ModelSerializer):
@@ -70,6 +105,162 @@ class PaginationSet (PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
 
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        paginate_queryset() for async views, with the count and the page read through the async ORM.
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Set up front so the paginator never runs the synchronous count()
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        self.page.object_list = [obj async for obj in self.page.object_list]
+        return self.page.object_list
+
+
+class MovieKeysetPagination(BasePagination):
+    """
+    Forward-only keyset pagination ordered by (-pub_date, -id), movies without pub_date last.
+    The cursor carries the last (pub_date, id) seen, so every page is an index seek on
+    api_movie_pubdate_id_idx with no COUNT(*) or OFFSET. Any other ordering of the
+    queryset (such as search rank) is replaced by this one.
+
+    Dated movies and undated ones are read as two segments, each a seek of its own: an OR
+    across them cannot use the index, and leaving NULLs out of the sort keeps it independent
+    of where the database puts them in the index (last on SQLite, first on Postgres).
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = []
+        for segment in self.page_segments(queryset, request):
+            # One extra row tells whether there is a next page
+            page += segment[:self.page_size + 1 - len(page)]
+            if len(page) > self.page_size:
+                break
+        return self.set_page(page)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        page = []
+        for segment in self.page_segments(queryset, request):
+            page += [obj async for obj in segment[:self.page_size + 1 - len(page)]]
+            if len(page) > self.page_size:
+                break
+        return self.set_page(page)
+
+    def page_segments(self, queryset, request):
+        """
+        The dated and undated querysets left after the cursor, in page order.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        dated = queryset.filter(pub_date__isnull=False).order_by('-pub_date', '-id')
+        undated = queryset.filter(pub_date__isnull=True).order_by('-id')
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return [dated, undated]
+        pub_date, pk = self.decode_cursor(encoded)
+        if pub_date is None:
+            return [undated.filter(id__lt=pk)]
+        # The range on pub_date is the seek; the OR only skips ties already seen
+        return [dated.filter(Q(pub_date__lt=pub_date) | Q(id__lt=pk), pub_date__lte=pub_date), undated]
+
+    def set_page(self, page):
+        self.has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        if not page:
+            self.last = None
+        elif isinstance(page[-1], dict):
+            # Rows of a values() queryset
+            self.last = (page[-1]['pub_date'], page[-1]['id'])
+        else:
+            self.last = (page[-1].pub_date, page[-1].id)
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(*self.last))
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param],
+                                 strict=True, cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def encode_cursor(self, pub_date, pk):
+        position = {'p': pub_date.isoformat() if pub_date else None, 'i': pk}
+        return urlsafe_b64encode(json.dumps(position).encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, encoded):
+        try:
+            position = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('ascii'))
+            pub_date = datetime.fromisoformat(position['p']) if position['p'] else None
+            return pub_date, int(position['i'])
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound('Invalid cursor')
+
+
+class MoviePagination(PaginationSet):
+    """
+    Page-number pagination by default. Clients opt in to keyset pagination with
+    ?pagination=cursor and then follow the returned next links.
+    """
+    keyset_pagination_class = MovieKeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_keyset(request):
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        if self.use_keyset(request):
+            return await self.keyset.apaginate_queryset(queryset, request, view)
+        return await super().apaginate_queryset(queryset, request, view)
+
+    def use_keyset(self, request):
+        self.keyset = None
+        if request.query_params.get('pagination') == 'cursor' \
+                or self.keyset_pagination_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_pagination_class()
+        return self.keyset is not None
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class CommentCursorPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-pub_date', '-id')
+
+
+class RatingCursorPagination(CursorPagination):
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = '-id'
+
 
 class DogSerializer(serializers.ModelSerializer):
     class Meta:
@@ -83,6 +274,148 @@ class RuleSerializer(serializers.ModelSerializer):
         fields = ('id', 'data',)
 
 
+class ValuesSerializer:
+    """
+    Read-only stand-in for model_serializer_class on list endpoints.
+
+    Renders rows of values(queryset) through getters compiled once per class from the
+    model serializer's fields, instead of running DRF's field machinery for every field
+    of every row. The output is the same as the model serializer's for the same objects.
+    """
+    model_serializer_class = None
+    # Fields whose database value is already their representation
+    passthrough_fields = (serializers.IntegerField, serializers.CharField, serializers.BooleanField,
+                          serializers.FloatField, serializers.ReadOnlyField, serializers.PrimaryKeyRelatedField)
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @property
+    def data(self):
+        return self.to_representation(self.rows)
+
+    def to_representation(self, rows):
+        represent = self.representer()
+        return [represent(row) for row in rows]
+
+    @classmethod
+    def representer(cls):
+        """
+        Return a function rendering one values() row; reuse it for a batch of rows.
+        """
+        return cls.compile()[1]()
+
+    @classmethod
+    def values(cls, queryset, *extra):
+        """
+        queryset.values() with the lookups the serializer needs, plus any `extra` ones.
+        """
+        return queryset.values(*cls.compile()[0], *extra)
+
+    @classmethod
+    def compile(cls):
+        compiled = cls.__dict__.get('_compiled')
+        if compiled is None:
+            compiled = cls._compiled = cls.build()
+        return compiled
+
+    @classmethod
+    def build(cls):
+        """
+        Return (lookups to select, factory of the function turning one values() row into
+        the output dict). The factory runs once per batch of rows, so per-request state
+        such as the active timezone is looked up once rather than for every row.
+        """
+        lookups, plan = [], []
+        for name, field in cls.model_serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, (serializers.SerializerMethodField, serializers.BaseSerializer,
+                                  serializers.ManyRelatedField)) or field.source == '*' \
+                    or (isinstance(field, serializers.RelatedField)
+                        and not (isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None)):
+                raise ImproperlyConfigured(f'{cls.__name__} cannot render field {name!r} from values()')
+
+            # A foreign key's own name selects the related pk
+            lookup = '__'.join(field.source_attrs)
+            guards = []
+            if not field.required and field.default is empty and not field.allow_null:
+                # DRF skips the field when a relation on its source path is missing
+                guards = ['__'.join(field.source_attrs[:i]) for i in range(1, len(field.source_attrs))]
+            if isinstance(field, cls.passthrough_fields) \
+                    or (isinstance(field, serializers.JSONField) and not field.binary):
+                converter = None
+            elif isinstance(field, serializers.DateTimeField):
+                converter = cls.datetime_converter(field)
+            else:
+                converter = functools.partial(getattr, field, 'to_representation')
+            plan.append((name, lookup, guards, converter))
+            lookups.extend(key for key in [lookup] + guards if key not in lookups)
+
+        if all(not guards and converter is None for _, _, guards, converter in plan):
+            pairs = [(name, lookup) for name, lookup, _, _ in plan]
+
+            def represent(row):
+                return {name: row[lookup] for name, lookup in pairs}
+
+            return lookups, lambda: represent
+
+        def bind():
+            steps = [(name, lookup, guards, converter and converter()) for name, lookup, guards, converter in plan]
+
+            def represent(row):
+                output = {}
+                for name, lookup, guards, convert in steps:
+                    if guards and any(row[guard] is None for guard in guards):
+                        continue
+                    value = row[lookup]
+                    output[name] = value if convert is None or value is None else convert(value)
+                return output
+            return represent
+
+        return lookups, bind
+
+    @staticmethod
+    def datetime_converter(field):
+        """
+        DateTimeField.to_representation() for ISO 8601 output, with the field's timezone
+        resolved once per batch instead of once per value.
+        """
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        if output_format is None or output_format.lower() != ISO_8601:
+            return functools.partial(getattr, field, 'to_representation')
+
+        def bind():
+            field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+
+            def convert(value):
+                if field_timezone is None or isinstance(value, str) or not timezone.is_aware(value):
+                    return field.to_representation(value)
+                try:
+                    value = value.astimezone(field_timezone).isoformat()
+                except OverflowError:
+                    return field.to_representation(value)
+                return value[:-6] + 'Z' if value.endswith('+00:00') else value
+            return convert
+        return bind
+
+
+class RatingValuesSerializer(ValuesSerializer):
+    model_serializer_class = RatingSerializer
+
+
+class BoardCommentValuesSerializer(ValuesSerializer):
+    model_serializer_class = BoardCommentSerializer
+
+
+class MovieListValuesSerializer(ValuesSerializer):
+    model_serializer_class = MovieListSerializer
+
+
+class RuleValuesSerializer(ValuesSerializer):
+    model_serializer_class = RuleSerializer
+
+
 class JwtUserSerializer(serializers.Serializer):
     username = serializers.CharField()
     email = serializers.EmailField()
@@ -0,0 +1,122 @@
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import Count, QuerySet, Sum
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+
+from api.authentication import SNAPSHOT_FIELDS, jwt_user_cache
+from api.cache import invalidate_rating_maps, movie_list_cache
+from api.models import Movie, Rating, Rule
+from api.rules import sync_rule_projection
+from api.metrics import install_query_recorder
+from api.search import get_search_backend
+from movierater.database import apply_connection_pragmas, apply_journal_mode
+
+connection_created.connect(apply_connection_pragmas)
+connection_created.connect(install_query_recorder)
+post_migrate.connect(apply_journal_mode, sender=apps.get_app_config('api'))
+
+
+@receiver(post_save, sender=Rating)
+def rating_saved(sender, instance, created, raw=False, **kwargs):
+    # Fixture loading writes Movie rows with their own aggregates
+    if raw:
+        return
+
+    stars = int(instance.stars)
+    if created:
+        Movie.apply_rating_delta(instance.movie_id, 1, stars, events=1)
+    else:
+        loaded = getattr(instance, '_loaded_values', {})
+        old_movie_id, old_stars = loaded.get('movie_id'), loaded.get('stars')
+        if not isinstance(old_stars, int) or old_movie_id is None:
+            # Instance was not loaded from the database, recount from scratch
+            Movie.rebuild_rating_aggregates(Movie.objects.filter(pk=instance.movie_id))
+        elif old_movie_id != instance.movie_id:
+            Movie.apply_rating_delta(old_movie_id, -1, -old_stars)
+            Movie.apply_rating_delta(instance.movie_id, 1, stars, events=1)
+        elif old_stars != stars:
+            Movie.apply_rating_delta(instance.movie_id, 0, stars - old_stars, events=1)
+
+    # A rating moved to another movie or user leaves the old entry's map
+    loaded = getattr(instance, '_loaded_values', {})
+    old_user_id = loaded.get('user_id', instance.user_id)
+    if old_user_id != instance.user_id:
+        invalidate_rating_maps([old_user_id], removed=True)
+    invalidate_rating_maps([instance.user_id], removed=not created and loaded.get('movie_id') != instance.movie_id)
+
+    instance._loaded_values = {'movie_id': instance.movie_id, 'user_id': instance.user_id, 'stars': stars}
+
+
+@receiver(post_delete, sender=Rating)
+def rating_deleted(sender, instance, origin=None, **kwargs):
+    # A rating can only cascade from its user or movie, and the pre_delete receivers of
+    # those account for all their ratings in bulk (inside the delete's transaction)
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model in (User, Movie):
+        return
+    loaded = getattr(instance, '_loaded_values', {})
+    stars = loaded.get('stars', instance.stars)
+    Movie.apply_rating_delta(loaded.get('movie_id', instance.movie_id), -1, -int(stars))
+    invalidate_rating_maps([loaded.get('user_id', instance.user_id)], removed=True)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    # One grouped delta for the movies the user rated, instead of one UPDATE per rating
+    totals = Rating.objects.filter(user=instance.pk).order_by() \
+        .values_list('movie').annotate(count=Count('id'), total=Sum('stars'))
+    Movie.apply_rating_deltas({movie_id: (-count, -total, 0) for movie_id, count, total in totals})
+    invalidate_rating_maps([instance.pk], removed=True)
+
+
+@receiver(pre_delete, sender=Movie)
+def movie_deleting(sender, instance, **kwargs):
+    # The movie's aggregates go with it; only its raters' maps need to know
+    raters = Rating.objects.filter(movie=instance.pk).order_by().values_list('user', flat=True)
+    invalidate_rating_maps(list(raters), removed=True)
+
+
+@receiver(post_save, sender=Rule)
+def rule_saved(sender, instance, raw=False, **kwargs):
+    # Fixtures carry their own RuleAddress/RuleService rows
+    if not raw:
+        sync_rule_projection([instance])
+
+
+def invalidate_movie_list():
+    # Bump now, and again after commit in case a reader cached the pre-commit rows in between
+    movie_list_cache.bump()
+    transaction.on_commit(movie_list_cache.bump)
+
+
+@receiver(post_save, sender=Movie)
+def movie_saved(sender, instance, **kwargs):
+    get_search_backend().index([instance.id])
+    invalidate_movie_list()
+
+
+@receiver(post_delete, sender=Movie)
+def movie_deleted(sender, instance, **kwargs):
+    get_search_backend().remove([instance.id])
+    invalidate_movie_list()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        return
+    # Saves of other fields only, e.g. update_last_login on every login, change nothing cached
+    if update_fields is None or 'username' in update_fields:
+        # Movie listings show the author's username
+        invalidate_movie_list()
+    if update_fields is None or not update_fields.isdisjoint(SNAPSHOT_FIELDS):
+        # Drop cached JWT user snapshots, e.g. when the user is deactivated
+        jwt_user_cache.invalidate(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    jwt_user_cache.invalidate(instance.pk)
@@ -1,3 +1,1283 @@
-from django.test import TestCase
+import io
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User, update_last_login
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.migrations.loader import MigrationLoader
+from django.db.models import F, Value
+from django.db.utils import ConnectionHandler
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.authentication import jwt_user_cache
+from api.cache import movie_list_cache
+from api.ingest import RecordError, iter_records
+from api.jsonkeys import filter_json_keys
+from api.leaderboards import trending_add, trending_add_value
+from api.metrics import request_histogram
+from api.models import Movie, BoardComment, Rating, Rule, RuleAddress, RuleService, SimilarMovie, Dog
+from api.recommendations import RatingMatrix, rebuild_similar_movies
+from api.rules import search_rules
+from api.search import SQLiteFTSBackend
+from api.throttling import PasswordHashRateThrottle
+from movierater.database import apply_journal_mode, sqlite_settings
+from api.serializers import MovieSerializer, MovieListSerializer, BoardCommentSerializer, RatingSerializer, \
+    RuleSerializer, MovieListValuesSerializer, BoardCommentValuesSerializer, RatingValuesSerializer, \
+    RuleValuesSerializer
+
+
+class MovieViewSetQueryTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_movies(self, count, comments_per_movie):
+        for i in range(count):
+            author = User.objects.create_user(f'author{Movie.objects.count()}', password='secret')
+            movie = Movie.objects.create(title=f'movie {i}', description='desc',
+                                         pub_date=timezone.now(), user=author)
+            for j in range(comments_per_movie):
+                BoardComment.objects.create(movie=movie, comment=f'comment {j}',
+                                            pub_date=timezone.now(), user=author)
+            Rating.objects.create(movie=movie, user=author, stars=4)
+
+    def test_list_query_count_is_constant(self):
+        self.create_movies(2, 1)
+        # count, movies joined with their authors, comments joined with their authors
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/movies/')
+        self.assertEqual(response.status_code, 200)
+
+        self.create_movies(8, 5)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/movies/')
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual(len(response.data['results'][0]['comments']), MovieSerializer.recent_comments_limit)
+        self.assertEqual(response.data['results'][0]['no_of_ratings'], 1)
+        self.assertEqual(response.data['results'][0]['avg_ratings'], 4)
+        self.assertEqual(response.data['results'][0]['no_of_comments'], 5)
+
+    def test_embedded_comments_are_bounded(self):
+        self.create_movies(1, 8)
+        movie = Movie.objects.get()
+        limit = MovieSerializer.recent_comments_limit
+
+        response = self.client.get(f'/api/movies/{movie.id}/')
+        self.assertEqual(response.data['no_of_comments'], 8)
+        self.assertEqual([c['comment'] for c in response.data['comments']],
+                         [f'comment {j}' for j in range(7, 7 - limit, -1)])
+
+    def test_comments_action_pages_the_full_thread(self):
+        self.create_movies(1, 8)
+        movie = Movie.objects.get()
+
+        response = self.client.get(f'/api/movies/{movie.id}/comments/', {'page_size': 5})
+        comments = [c['comment'] for c in response.data['results']]
+        response = self.client.get(response.data['next'])
+        comments += [c['comment'] for c in response.data['results']]
+
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(comments, [f'comment {j}' for j in range(7, -1, -1)])
+
+    def test_comments_posted_through_the_api_are_paged(self):
+        self.create_movies(1, 0)
+        movie = Movie.objects.get()
+        posted = timezone.now() - timedelta(days=1)
+        for j in range(12):
+            BoardComment.objects.create(movie=movie, comment=f'dated {j}', pub_date=posted - timedelta(hours=j // 3))
+        for j in range(12):
+            response = self.client.post('/api/comments/', {'movie': movie.id, 'comment': f'posted {j}'})
+            self.assertEqual(response.status_code, 201)
+            self.assertIsNotNone(response.data['pub_date'])
+
+        comments, url, params = [], f'/api/movies/{movie.id}/comments/', {'page_size': 5}
+        while url:
+            response = self.client.get(url, params)
+            comments += [c['id'] for c in response.data['results']]
+            url, params = response.data['next'], {}
+
+        self.assertEqual(len(comments), 24)
+        self.assertEqual(comments, list(BoardComment.objects.order_by('-pub_date', '-id').values_list('id', flat=True)))
+
+
+class MovieKeysetPaginationTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        now = timezone.now()
+        # Shared pub_dates and missing pub_dates exercise the (pub_date, id) tie-break
+        for i in range(7):
+            Movie.objects.create(title=f'movie {i}', description='desc',
+                                 pub_date=now - timezone.timedelta(days=i // 2) if i < 5 else None)
+
+    def test_cursor_pages_cover_every_movie_once(self):
+        expected = list(Movie.objects.order_by(F('pub_date').desc(nulls_last=True), '-id')
+                        .values_list('id', flat=True))
+
+        response = self.client.get('/api/movielist/', {'pagination': 'cursor', 'page_size': 3})
+        seen = [movie['id'] for movie in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            seen += [movie['id'] for movie in response.data['results']]
+
+        self.assertEqual(seen, expected)
+
+    def test_pages_are_index_seeks_at_depth(self):
+        now = timezone.now()
+        Movie.objects.bulk_create([Movie(title=f'deep {i}', description='desc',
+                                         pub_date=now - timezone.timedelta(hours=i) if i % 10 else None)
+                                   for i in range(500)])
+        expected = list(Movie.objects.order_by(F('pub_date').desc(nulls_last=True), '-id')
+                        .values_list('id', flat=True))
+
+        seen, plans = [], []
+        response = self.client.get('/api/movielist/', {'pagination': 'cursor', 'page_size': 20})
+        while True:
+            seen += [movie['id'] for movie in response.data['results']]
+            if not response.data['next']:
+                break
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(response.data['next'])
+            # Two reads only on the page where the dated movies run out
+            self.assertLessEqual(len(queries), 2)
+            if connection.vendor == 'sqlite':
+                with connection.cursor() as cursor:
+                    for query in queries:
+                        cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                        plans.append(' '.join(row[-1] for row in cursor.fetchall()))
+
+        self.assertEqual(seen, expected)
+        # A SEARCH starts at the cursor; a SCAN would walk every row before it
+        for plan in plans:
+            self.assertRegex(plan, r'^SEARCH api_movie USING INDEX api_movie_pubdate_id_idx')
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_page_number_mode_is_the_default(self):
+        response = self.client.get('/api/movielist/')
+        self.assertEqual(response.data['count'], 7)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/movielist/', {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+class MovieListCacheTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.movie = Movie.objects.create(title='cached', description='desc', pub_date=timezone.now())
+
+    def test_repeated_requests_are_served_from_cache(self):
+        self.client.get('/api/movielist/', {'page_size': 5})
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/movielist/', {'page_size': 5})
+        self.assertEqual(response.data['results'][0]['title'], 'cached')
+
+    def test_movie_changes_invalidate(self):
+        self.client.get('/api/movielist/')
+        self.movie.title = 'renamed'
+        self.movie.save()
+        response = self.client.get('/api/movielist/')
+        self.assertEqual(response.data['results'][0]['title'], 'renamed')
+
+    def test_conditional_requests(self):
+        response = self.client.get('/api/movielist/')
+        response = self.client.get('/api/movielist/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        Movie.objects.create(title='new', description='desc', pub_date=timezone.now())
+        response = self.client.get('/api/movielist/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+
+class RatingBulkIngestTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('importer', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.movies = [Movie.objects.create(title=f'movie {i}', description='desc') for i in range(2)]
+
+    def test_ndjson_upserts_and_updates_aggregates(self):
+        Rating.objects.create(user=self.user, movie=self.movies[0], stars=1)
+        body = '\n'.join([
+            '{"movie": %d, "stars": 5}' % self.movies[0].id,
+            '{"movie": %d, "stars": 3}' % self.movies[1].id,
+            '{"movie": 999, "stars": 3}',
+            '{"movie": %d, "stars": 7}' % self.movies[1].id,
+            'not json',
+        ])
+        response = self.client.generic('POST', '/api/ratings/bulk/', body, content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['failed']), (1, 1, 3))
+        self.assertEqual(sorted(e['record'] for e in response.data['errors']), [3, 4, 5])
+        for movie in Movie.objects.all():
+            self.assertEqual(movie.rating_count, Rating.objects.filter(movie=movie).count())
+            self.assertEqual(movie.rating_sum, sum(Rating.objects.filter(movie=movie).values_list('stars', flat=True)))
+
+
+class RatingOwnershipTest(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+        self.other = User.objects.create_user('other')
+        self.movie = Movie.objects.create(title='Alien', description='desc')
+        self.second = Movie.objects.create(title='Aliens', description='desc')
+        self.rating, _ = Rating.objects.rate(self.owner, self.movie.id, 3)
+        self.client = APIClient()
+
+    def test_other_users_cannot_read_or_change_a_rating(self):
+        self.client.force_authenticate(self.other)
+        url = f'/api/ratings/{self.rating.id}/'
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.put(url, {'stars': 1}, format='json').status_code, 404)
+        self.assertEqual(self.client.patch(url, {'stars': 1}, format='json').status_code, 404)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+        self.assertEqual(Rating.objects.get(pk=self.rating.id).stars, 3)
+
+    def test_owner_update_only_changes_the_stars(self):
+        self.client.force_authenticate(self.owner)
+        response = self.client.put(f'/api/ratings/{self.rating.id}/',
+                                   {'stars': 5, 'user': self.other.id, 'movie': self.second.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        rating = Rating.objects.get(pk=self.rating.id)
+        self.assertEqual((rating.user_id, rating.movie_id, rating.stars), (self.owner.id, self.movie.id, 5))
+        self.movie.refresh_from_db()
+        self.assertEqual((self.movie.rating_count, self.movie.rating_sum), (1, 5))
+
+        self.assertEqual(self.client.delete(f'/api/ratings/{self.rating.id}/').status_code, 204)
+        self.assertFalse(Rating.objects.filter(pk=self.rating.id).exists())
+
+
+class RatingCascadeTest(TestCase):
+
+    def setUp(self):
+        self.movies = [Movie.objects.create(title=f'movie {i}', description='desc') for i in range(40)]
+        self.keeper = User.objects.create_user('keeper')
+        for movie in self.movies[:3]:
+            Rating.objects.rate(self.keeper, movie.id, 4)
+
+    def rater(self, name, count):
+        user = User.objects.create_user(name)
+        Rating.objects.bulk_rate([(user.id, movie.id, i % 5 + 1) for i, movie in enumerate(self.movies[:count])])
+        return user
+
+    def test_deleting_a_user_shifts_aggregates_in_bulk(self):
+        few, many = self.rater('few', 4), self.rater('many', 40)
+        with CaptureQueriesContext(connection) as few_queries:
+            few.delete()
+        with CaptureQueriesContext(connection) as many_queries:
+            many.delete()
+        self.assertLessEqual(len(many_queries), len(few_queries) + 1)
+
+        expected = {movie.id: (1, 4) if i < 3 else (0, 0) for i, movie in enumerate(self.movies)}
+        self.assertEqual({movie.id: (movie.rating_count, movie.rating_sum) for movie in Movie.objects.all()},
+                         expected)
+        Movie.rebuild_rating_aggregates()
+        self.assertEqual({movie.id: (movie.rating_count, movie.rating_sum) for movie in Movie.objects.all()},
+                         expected)
+
+    def test_deleting_a_movie_keeps_other_aggregates(self):
+        self.rater('fan', 40)
+        self.movies[0].delete()
+        self.assertEqual(Rating.objects.filter(user=self.keeper).count(), 2)
+        movie = Movie.objects.get(pk=self.movies[1].id)
+        self.assertEqual((movie.rating_count, movie.rating_sum), (2, 6))
+
+        # A rating deleted on its own still shifts its movie
+        Rating.objects.get(user=self.keeper, movie=movie).delete()
+        movie.refresh_from_db()
+        self.assertEqual((movie.rating_count, movie.rating_sum), (1, 2))
+
+    def test_failed_delete_leaves_later_deletes_accounted(self):
+        fan = self.rater('fan', 3)
+        with patch('django.db.models.sql.subqueries.DeleteQuery.delete_batch', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError), transaction.atomic():
+                fan.delete()
+            with self.assertRaises(DatabaseError), transaction.atomic():
+                self.movies[0].delete()
+        movie = Movie.objects.get(pk=self.movies[0].id)
+        self.assertEqual((movie.rating_count, movie.rating_sum), (2, 5))
+
+        # The rolled back deletes leave no trace on deletes of the same user and movie
+        Rating.objects.get(user=fan, movie=movie).delete()
+        Rating.objects.filter(user=self.keeper, movie=movie).delete()
+        movie.refresh_from_db()
+        self.assertEqual((movie.rating_count, movie.rating_sum), (0, 0))
+
+
+class RateMovieTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('rater', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.movie = Movie.objects.create(title='rated', description='desc')
+        Rating.objects.rate(User.objects.create_user('other'), self.movie.id, 2)
+
+    def rate(self, data, movie_id=None):
+        return self.client.post(f'/api/movies/{movie_id or self.movie.id}/rate_movie/', data, format='json')
+
+    def test_create_then_update(self):
+        response = self.rate({'stars': 5})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['message'], 'Rating created')
+        response = self.rate({'stars': '3'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['message'], 'Rating updated')
+        self.assertEqual(response.data['result']['stars'], 3)
+
+        self.movie.refresh_from_db()
+        self.assertEqual((self.movie.rating_count, self.movie.rating_sum), (2, 5))
+        response = self.client.get(f'/api/movies/{self.movie.id}/')
+        self.assertEqual((response.data['no_of_ratings'], response.data['avg_ratings']), (2, 2.5))
+
+    def test_invalid_stars(self):
+        for stars in (0, 6, 'five', 3.7, '3.7', True, None, [4]):
+            response = self.rate({'stars': stars})
+            self.assertEqual(response.status_code, 400, stars)
+            self.assertEqual(response.data['message'], 'Invalid stars')
+        response = self.rate({})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'You need to provide stars')
+        self.assertFalse(Rating.objects.filter(user=self.user).exists())
+
+    def test_integral_float_is_accepted(self):
+        self.assertEqual(self.rate({'stars': 4.0}).status_code, 201)
+        self.assertEqual(Rating.objects.get(user=self.user).stars, 4)
+
+    def test_unknown_movie(self):
+        self.assertEqual(self.rate({'stars': 3}, movie_id=self.movie.id + 100).status_code, 404)
+
+
+class RatingMapTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('rater', password='secret')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.movies = [Movie.objects.create(title=f'movie {i}', description='desc') for i in range(3)]
+        for movie in self.movies[:2]:
+            Rating.objects.rate(self.user, movie.id, 3)
+        Rating.objects.rate(User.objects.create_user('other'), self.movies[2].id, 1)
+
+    def rate(self, movie, stars):
+        return self.client.post(f'/api/movies/{movie.id}/rate_movie/', {'stars': stars}, format='json')
+
+    def test_list_is_paginated(self):
+        response = self.client.get('/api/ratings/', {'page_size': 1})
+        self.assertEqual([r['movie'] for r in response.data['results']], [self.movies[1].id])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([r['movie'] for r in response.data['results']], [self.movies[0].id])
+        self.assertIsNone(response.data['next'])
+
+    def test_map_is_cached_until_the_user_rates(self):
+        response = self.client.get('/api/ratings/map/')
+        self.assertTrue(response.data['full'])
+        self.assertEqual(response.data['ratings'], {self.movies[0].id: 3, self.movies[1].id: 3})
+        with self.assertNumQueries(0):
+            self.client.get('/api/ratings/map/')
+
+        self.rate(self.movies[2], 5)
+        response = self.client.get('/api/ratings/map/')
+        self.assertEqual(response.data['ratings'][self.movies[2].id], 5)
+
+    def test_since_returns_changes_only(self):
+        as_of = self.client.get('/api/ratings/map/').json()['as_of']
+        Rating.objects.filter(user=self.user).update(updated=timezone.now() - timedelta(hours=1))
+        self.rate(self.movies[1], 5)
+
+        response = self.client.get('/api/ratings/map/', {'since': as_of})
+        self.assertFalse(response.data['full'])
+        self.assertEqual(response.data['ratings'], {self.movies[1].id: 5})
+
+    def test_since_before_a_removal_returns_the_full_map(self):
+        as_of = self.client.get('/api/ratings/map/').json()['as_of']
+        Rating.objects.get(user=self.user, movie=self.movies[0]).delete()
+
+        response = self.client.get('/api/ratings/map/', {'since': as_of})
+        self.assertTrue(response.data['full'])
+        self.assertEqual(response.data['ratings'], {self.movies[1].id: 3})
+
+    def test_conditional_requests(self):
+        response = self.client.get('/api/ratings/map/')
+        response = self.client.get('/api/ratings/map/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_invalid_since(self):
+        response = self.client.get('/api/ratings/map/', {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    @skipUnless(connection.vendor == 'sqlite', 'checks the SQLite query plan')
+    def test_map_reads_the_covering_index(self):
+        queryset = Rating.objects.filter(user=self.user).order_by('movie').values_list('movie', 'stars')
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('COVERING INDEX api_rating_user_map_idx', plan)
+
+
+class LeaderboardTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.users = [User.objects.create_user(f'rater{i}') for i in range(20)]
+        self.few, self.many, self.unrated = [
+            Movie.objects.create(title=title, description='desc') for title in ('few', 'many', 'unrated')]
+        for user in self.users[:2]:
+            Rating.objects.rate(user, self.few.id, 5)
+        Rating.objects.bulk_rate([(user.id, self.many.id, 4) for user in self.users])
+
+    def scores(self):
+        return {movie.id: (movie.bayesian_score, movie.trending_score) for movie in Movie.objects.all()}
+
+    def test_top_rated_weighs_in_the_number_of_ratings(self):
+        response = self.client.get('/api/movielist/top_rated/')
+        self.assertEqual([m['title'] for m in response.data['results']], ['many', 'few'])
+        self.assertAlmostEqual(response.data['results'][1]['score'], (10 * 3.0 + 10) / (10 + 2))
+
+    def test_trending_prefers_recent_ratings(self):
+        Rating.objects.filter(movie=self.many).update(updated=timezone.now() - timedelta(days=7))
+        Movie.rebuild_leaderboard_scores()
+
+        response = self.client.get('/api/movielist/trending/')
+        self.assertEqual([m['title'] for m in response.data['results']], ['few', 'many'])
+        self.assertAlmostEqual(response.data['results'][0]['score'], 2, places=3)
+        self.assertAlmostEqual(response.data['results'][1]['score'], 20 / 2 ** 7, places=3)
+
+    def test_incremental_scores_match_a_rebuild(self):
+        Rating.objects.rate(self.users[5], self.few.id, 2)
+        Rating.objects.create(user=self.users[6], movie=self.few, stars=3)
+        incremental = self.scores()
+        Movie.rebuild_leaderboard_scores()
+        for movie_id, (bayesian, trending) in self.scores().items():
+            self.assertAlmostEqual(incremental[movie_id][0], bayesian)
+            self.assertAlmostEqual(incremental[movie_id][1], trending, places=5)
+
+        # Changes and removals shift the average at once; the rebuild drops superseded trending events
+        Rating.objects.rate(self.users[0], self.many.id, 1)
+        Rating.objects.get(user=self.users[1], movie=self.few).delete()
+        rating = Rating.objects.get(user=self.users[2], movie=self.many)
+        rating.stars = 2
+        rating.save()
+        incremental = self.scores()
+        Movie.rebuild_leaderboard_scores()
+        for movie_id, (bayesian, _) in self.scores().items():
+            self.assertAlmostEqual(incremental[movie_id][0], bayesian)
+
+    def test_migration_backfill_matches_the_rebuild(self):
+        Rating.objects.filter(movie=self.many).update(updated=timezone.now() - timedelta(days=3))
+        Movie.rebuild_leaderboard_scores()
+        expected = self.scores()
+        Movie.objects.update(bayesian_score=0.0, trending_score=0.0)
+
+        migration = import_module('api.migrations.0008_movie_leaderboard_scores')
+        state = MigrationLoader(connection).project_state(('api', '0008_movie_leaderboard_scores'))
+        migration.backfill_leaderboard_scores(state.apps, None)
+        for movie_id, (bayesian, trending) in self.scores().items():
+            self.assertAlmostEqual(bayesian, expected[movie_id][0])
+            self.assertAlmostEqual(trending, expected[movie_id][1], places=5)
+
+    @skipUnless(connection.vendor == 'sqlite', 'replaces the SQLite EXP() function')
+    def test_trending_add_does_not_underflow(self):
+        # Postgres fails exp() when the result underflows to 0, where SQLite returns 0
+        def exp(x):
+            if math.exp(x) == 0.0:
+                raise ValueError('value out of range: underflow')
+            return math.exp(x)
+        connection.ensure_connection()
+        connection.connection.create_function('EXP', 1, exp)
+        self.addCleanup(connection.connection.create_function, 'EXP', 1, math.exp)
+
+        movie = Movie.objects.filter(pk=self.unrated.pk)
+        score = movie.get().trending_score
+        for term, expected in ((960.0, 960.0), (0.0, 960.0), (960.0, 960.0 + math.log(2))):
+            movie.update(trending_score=trending_add(F('trending_score'), Value(term)))
+            self.assertAlmostEqual(trending_add_value(score, term), expected)
+            score = movie.get().trending_score
+            self.assertAlmostEqual(score, expected)
+
+    def test_reads_are_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/movielist/top_rated/', {'limit': 1})
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_invalid_limit(self):
+        response = self.client.get('/api/movielist/trending/', {'limit': 'all'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SimilarMoviesTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('viewer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.users = [User.objects.create_user(f'fan{i}') for i in range(4)]
+        self.alien, self.aliens, self.musical, self.other = [
+            Movie.objects.create(title=title, description='desc')
+            for title in ('Alien', 'Aliens', 'Musical', 'Other')]
+        # Fans of Alien like Aliens and dislike Musical; Other only has one rater in common
+        for user in self.users:
+            Rating.objects.rate(user, self.alien.id, 5)
+            Rating.objects.rate(user, self.aliens.id, 5)
+            Rating.objects.rate(user, self.musical.id, 1)
+        Rating.objects.rate(self.users[0], self.other.id, 5)
+
+    def test_similar_reads_the_rebuilt_lists(self):
+        self.assertEqual(rebuild_similar_movies(), 4)
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/movies/{self.alien.id}/similar/')
+        self.assertEqual([m['title'] for m in response.data['results']], ['Aliens'])
+        self.assertAlmostEqual(response.data['results'][0]['score'], 1.0)
+
+    def test_only_stale_movies_are_rebuilt(self):
+        rebuild_similar_movies()
+        self.assertFalse(Movie.objects.filter(similar_stale=True).exists())
+
+        Rating.objects.rate(self.users[1], self.other.id, 4)
+        self.assertEqual(list(Movie.objects.filter(similar_stale=True)), [self.other])
+        self.assertEqual(rebuild_similar_movies(), 1)
+        self.assertEqual(list(SimilarMovie.objects.filter(movie=self.other).values_list('similar', flat=True)),
+                         [self.alien.id, self.aliens.id])
+
+    def test_batches_ties_and_recent_ratings(self):
+        movie_ids = [self.alien.id, self.aliens.id, self.musical.id, self.other.id, 10 ** 9]
+        matrix = RatingMatrix.load('cosine')
+        # Alien and Aliens tie for Musical; the tie goes to the lower id
+        self.assertEqual([other for other, _ in matrix.neighbours(self.musical.id)], [self.alien.id, self.aliens.id])
+        with patch('api.recommendations.DENSE_CELLS', 1):
+            batched = matrix.neighbours_of(movie_ids)
+        self.assertEqual(batched, {movie_id: matrix.neighbours(movie_id) for movie_id in movie_ids})
+        self.assertEqual(batched[10 ** 9], [])
+        self.assertEqual(matrix.neighbours(self.other.id), [])
+        self.assertEqual(len(matrix.neighbours(self.other.id, min_support=1)), 3)
+
+        # With one rating per user only the newest counts, and no two movies share a rater
+        Rating.objects.filter(movie=self.other).update(updated=timezone.now() + timedelta(minutes=1))
+        matrix = RatingMatrix.load('cosine', max_user_ratings=1)
+        self.assertEqual(matrix.ratings.nnz, len(self.users))
+        self.assertIn(self.other.id, matrix.movie_ids)
+        self.assertEqual(matrix.neighbours(self.other.id, min_support=1), [])
+
+    def test_neighbours_match_adjusted_cosine(self):
+        rng = random.Random(0)
+        for user in self.users:
+            for movie in (self.alien, self.aliens, self.musical, self.other):
+                Rating.objects.rate(user, movie.id, rng.randint(1, 5))
+        ratings = list(Rating.objects.values_list('user', 'movie', 'stars'))
+        means = {user: sum(s for u, _, s in ratings if u == user) / sum(1 for u, _, _ in ratings if u == user)
+                 for user, _, _ in ratings}
+        vectors = {}
+        for user, movie, stars in ratings:
+            vectors.setdefault(movie, {})[user] = stars - means[user]
+
+        def cosine(a, b):
+            dot = sum(a[u] * b[u] for u in a if u in b)
+            return dot / (math.hypot(*a.values()) * math.hypot(*b.values()))
+
+        matrix = RatingMatrix.load()
+        for movie in vectors:
+            expected = {other: cosine(vectors[movie], vectors[other]) for other in vectors if other != movie}
+            found = dict(matrix.neighbours(movie, min_support=1))
+            self.assertLessEqual({other for other, score in expected.items() if score > 1e-9}, set(found))
+            for other, score in found.items():
+                self.assertAlmostEqual(score, expected[other])
+
+    def test_partial_load_matches_the_full_one(self):
+        rng = random.Random(1)
+        users = self.users + [User.objects.create_user(f'critic{i}') for i in range(8)]
+        movies = [Movie.objects.create(title=f'movie {i}', description='desc') for i in range(12)]
+        for user in users:
+            for movie in rng.sample(movies, rng.randint(1, 8)):
+                Rating.objects.rate(user, movie.id, rng.randint(0, 5))
+        # Distinct timestamps keep every user's newest ratings well defined
+        now = timezone.now()
+        for i, rating in enumerate(Rating.objects.order_by('?')):
+            Rating.objects.filter(pk=rating.pk).update(updated=now - timedelta(minutes=i))
+
+        stale = [movies[0].id]
+        for method in ('adjusted-cosine', 'cosine'):
+            for max_user_ratings in (1000, 4):
+                full = RatingMatrix.load(method, max_user_ratings)
+                partial = RatingMatrix.load(method, max_user_ratings, movie_ids=stale)
+                self.assertLess(len(partial.ratings.data), len(full.ratings.data))
+                self.assertEqual(partial.neighbours_of(stale, min_support=1), full.neighbours_of(stale, min_support=1))
+
+
+class DogJSONFilterTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.rex, self.fido, self.lassie, self.nameless = [Dog.objects.create(name=name, data=data) for name, data in (
+            ('rex', {'age': 3, 'good': True, 'owner': {'name': 'kim'}, 'tags': ['puppy', 'small']}),
+            ('fido', {'age': 12, 'good': False, 'owner': {'name': 'lee'}, 'tags': ['old']}),
+            ('lassie', {'age': '7', 'owner': {'name': 'kim'}}),
+            ('nameless', None),
+        )]
+
+    def names(self, **params):
+        response = self.client.get('/api/dog/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [dog['name'] for dog in response.data['results']]
+
+    def test_equality_compares_json_types(self):
+        self.assertEqual(self.names(**{'data.age': '3'}), ['rex'])
+        self.assertEqual(self.names(**{'data.age': '"7"'}), ['lassie'])
+        self.assertEqual(self.names(**{'data.good': 'false'}), ['fido'])
+        self.assertEqual(self.names(**{'data.owner.name': 'kim'}), ['rex', 'lassie'])
+        self.assertEqual(self.names(**{'data.age__in': '3,12,"7"'}), ['rex', 'fido', 'lassie'])
+
+    def test_ranges_stay_within_a_type(self):
+        self.assertEqual(self.names(**{'data.age__gte': '3'}), ['rex', 'fido'])
+        self.assertEqual(self.names(**{'data.age__lt': '10'}), ['rex'])
+        self.assertEqual(self.names(**{'data.age__gt': '"0"'}), ['lassie'])
+        self.assertEqual(self.names(**{'data.age__gt': '1', 'data.owner.name': 'kim'}), ['rex'])
+
+    def test_containment_and_isnull(self):
+        self.assertEqual(self.names(**{'data.tags__contains': 'puppy'}), ['rex'])
+        self.assertEqual(self.names(**{'data.owner__contains': 'kim'}), [])
+        self.assertEqual(self.names(**{'data.tags__isnull': 'true'}), ['lassie', 'nameless'])
+        self.assertEqual(self.names(**{'data.good__isnull': 'false'}), ['rex', 'fido'])
+
+    def test_invalid_filters(self):
+        for param, value in (('data.a b', '1'), ('data.age__like', '1'), ('data.age__gt', 'true'),
+                             ('data.age', '[1]'), ('data.age__isnull', 'maybe')):
+            response = self.client.get('/api/dog/', {param: value})
+            self.assertEqual(response.status_code, 400, param)
+            self.assertIn(param, response.data)
+
+    @skipUnless(connection.vendor == 'sqlite', 'checks the SQLite query plan')
+    def test_registered_key_is_index_backed(self):
+        for params in ({'data.age': '3'}, {'data.age__gte': '3'}, {'data.age__lt': '"9"'}):
+            queryset = filter_json_keys(Dog.objects.all(), params, ('data',))
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+            self.assertIn('USING INDEX api_dog_data_age_idx', plan)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite FTS5 backend')
+class MovieSearchTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.alien = Movie.objects.create(title='Alien', description='In space no one can hear you scream',
+                                          pub_date=now)
+        self.aliens = Movie.objects.create(title='Aliens', description='This time it is war', pub_date=now)
+        self.heat = Movie.objects.create(title='Heat', description='An alien detective in Los Angeles',
+                                         pub_date=now - timedelta(days=1))
+
+    def search(self, query):
+        return list(SQLiteFTSBackend().search(Movie.objects.all(), query).values_list('id', flat=True))
+
+    def test_words_match_as_prefixes(self):
+        self.assertEqual(set(self.search('ali')), {self.alien.id, self.aliens.id, self.heat.id})
+        self.assertEqual(self.search('ali spa'), [self.alien.id])
+        self.assertEqual(self.search('ÁLIENS'), [self.aliens.id])
+        self.assertEqual(self.search('pace'), [])
+
+    def test_title_matches_rank_first(self):
+        ranked = self.search('alien')
+        self.assertEqual(ranked[-1], self.heat.id)
+        self.assertEqual(set(ranked[:2]), {self.alien.id, self.aliens.id})
+
+    def test_index_follows_save_and_delete(self):
+        self.heat.title = 'Ronin'
+        self.heat.save()
+        self.assertEqual(self.search('heat'), [])
+        self.assertEqual(self.search('ronin'), [self.heat.id])
+        self.aliens.delete()
+        self.assertEqual(set(self.search('alien')), {self.alien.id, self.heat.id})
+
+    def test_operators_are_taken_literally(self):
+        self.assertEqual(self.search('alien OR heat'), [])
+        self.assertEqual(self.search('"alien" NEAR(war)'), [])
+
+    def test_punctuation_does_not_match_everything(self):
+        self.assertEqual(self.search('?!'), [])
+        Movie.objects.create(title='Why?!', description='', pub_date=timezone.now())
+        response = APIClient().get('/api/movielist/', {'search': '?!'})
+        self.assertEqual([movie['title'] for movie in response.data['results']], ['Why?!'])
+
+    @override_settings(MOVIE_SEARCH_BACKEND='api.search.ContainsSearchBackend')
+    def test_migration_ignores_the_configured_backend(self):
+        migration = import_module('api.migrations.0005_movie_search_index')
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE api_movie_fts')
+            migration.install_search_index(None, SimpleNamespace(connection=connection, execute=cursor.execute))
+        self.assertEqual(self.search('scream'), [self.alien.id])
+
+
+# The guard is under test, not the hashing
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LoginGuardTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        User.objects.create_user('kim', password='secret')
+
+    def login(self, password, path='/api/token/', username='kim'):
+        return self.client.post(path, {'username': username, 'password': password}, format='json')
+
+    def test_token_route_is_rate_limited(self):
+        with patch.object(PasswordHashRateThrottle, 'THROTTLE_RATES', {'login': '3/min'}):
+            for _ in range(3):
+                self.assertEqual(self.login('secret').status_code, 200)
+            response = self.login('secret')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_failures_lock_the_username(self):
+        for path in ('/api/token/', '/api/auth/'):
+            cache.clear()
+            for _ in range(settings.LOGIN_FAILURE_LIMIT):
+                self.assertIn(self.login('wrong', path).status_code, (400, 401))
+            # Even the right password is refused until the window ends
+            self.assertEqual(self.login('secret', path).status_code, 429)
+            self.assertEqual(self.login('secret', path, username='KIM ').status_code, 429)
+
+    def test_success_resets_the_count(self):
+        for _ in range(settings.LOGIN_FAILURE_LIMIT - 1):
+            self.login('wrong')
+        self.assertEqual(self.login('secret').status_code, 200)
+        for _ in range(settings.LOGIN_FAILURE_LIMIT - 1):
+            self.login('wrong')
+        response = self.login('secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.data)
+
+    def test_body_that_is_not_an_object(self):
+        for path in ('/api/token/', '/api/auth/'):
+            response = self.client.post(path, ['kim', 'secret'], format='json')
+            self.assertEqual(response.status_code, 400)
+
+
+class RuleListTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('auditor'))
+        self.rules = [Rule.objects.create(data={
+            'source': [{'ip': f'10.{i % 3}.0.0/16'}], 'destination': [{'ip': '0.0.0.0/0'}],
+            'service': [{'tcp': {'port': str(80 + i % 2)}}],
+        }) for i in range(25)]
+
+    def pages(self, **params):
+        results, url = [], '/api/rule/'
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            results.extend(response.data['results'])
+            url, params = response.data['next'], {}
+        return results
+
+    def stream(self, **params):
+        response = self.client.get('/api/rule/', dict(params, stream=1))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_page_boundaries(self):
+        first = self.client.get('/api/rule/')
+        self.assertEqual(first.data['count'], 25)
+        self.assertEqual([rule['id'] for rule in first.data['results']], [rule.id for rule in self.rules[:10]])
+        last = self.client.get('/api/rule/', {'page': 3})
+        self.assertEqual([rule['id'] for rule in last.data['results']], [rule.id for rule in self.rules[20:]])
+        self.assertIsNone(last.data['next'])
+        self.assertEqual(self.client.get('/api/rule/', {'page': 4}).status_code, 404)
+        self.assertEqual([rule['id'] for rule in self.pages(page_size=7)], [rule.id for rule in self.rules])
+
+    def test_stream_matches_the_pages(self):
+        self.assertEqual(self.stream(), self.pages())
+
+    def test_stream_applies_the_search(self):
+        streamed = self.stream(src='10.1.2.3', port='81')
+        self.assertEqual([rule['id'] for rule in streamed],
+                         [rule.id for i, rule in enumerate(self.rules) if i % 3 == 1 and i % 2 == 1])
+        self.assertEqual(streamed, self.pages(src='10.1.2.3', port='81'))
+        self.assertEqual(self.client.get('/api/rule/', {'src': 'bad', 'stream': 1}).status_code, 400)
+
+
+class RuleImportTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+
+    def rule(self, ip, port='443'):
+        return {'source': [{'ip': ip}], 'destination': [{'ip': '0.0.0.0/0'}], 'service': [{'tcp': {'port': port}}]}
+
+    def post(self, body, client=None):
+        return (client or self.client).generic('POST', '/api/rule/import/', body,
+                                               content_type='application/x-ndjson')
+
+    def test_ndjson_reports_each_bad_record(self):
+        body = '\n'.join([
+            json.dumps(self.rule('10.0.0.0/8')),
+            json.dumps(self.rule('10.0.0.300')),
+            'not json',
+            '',
+            json.dumps({'source': 'x', 'destination': [], 'service': []}),
+            json.dumps({'id': 7, 'data': self.rule('2001:db8::/32')}),
+        ])
+        response = self.post(body)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['received'], response.data['created'], response.data['failed']), (5, 2, 3))
+        self.assertFalse(response.data['aborted'])
+        errors = {error['record']: error['errors'] for error in response.data['errors']}
+        self.assertEqual(sorted(errors), [2, 3, 4])
+        self.assertIn('source', errors[2])
+        self.assertIn('non_field_errors', errors[3])
+        self.assertEqual(errors[4], {'source': ['Expected a list of addresses.']})
+        # Imported rules are projected for the search
+        self.assertEqual(search_rules(Rule.objects.all(), src='2001:db8::1').count(), 1)
+
+    def test_malformed_array_aborts(self):
+        body = '[' + json.dumps(self.rule('10.0.0.0/8')) + ', {"source": [' + ' '.join(['1'] * 1000)
+        response = self.post(body)
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.data['aborted'])
+        self.assertEqual((response.data['created'], response.data['errors'][0]['record']), (1, 2))
+
+    def test_staff_only(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('analyst'))
+        self.assertEqual(self.post(json.dumps(self.rule('10.0.0.0/8')), client).status_code, 403)
+        self.assertFalse(Rule.objects.exists())
+
+    def test_export_round_trips(self):
+        originals = [Rule.objects.create(data=self.rule(ip, port))
+                     for ip, port in (('10.0.0.0/8', '22'), ('2001:db8::/32', '443'), ('192.0.2.1', '80'))]
+        response = self.client.get('/api/rule/', {'stream': 1})
+        export = b''.join(response.streaming_content)
+        Rule.objects.all().delete()
+
+        response = self.client.generic('POST', '/api/rule/import/', export, content_type='application/x-ndjson')
+        self.assertEqual((response.data['created'], response.data['failed']), (3, 0))
+        self.assertEqual(list(Rule.objects.order_by('id').values_list('data', flat=True)),
+                         [rule.data for rule in originals])
+        self.assertEqual(RuleAddress.objects.count(), 6)
+        self.assertEqual(set(RuleService.objects.values_list('port', flat=True)), {'22', '443', '80'})
+
+
+class IngestTest(SimpleTestCase):
+
+    def records(self, body, **kwargs):
+        return list(iter_records(io.BytesIO(body.encode()), read_size=8, **kwargs))
+
+    def test_records_span_chunks(self):
+        self.assertEqual(self.records('[{"a": 12345}, "ü", 1.5e3]'), [(1, {'a': 12345}), (2, 'ü'), (3, 1500.0)])
+        self.assertEqual(self.records('{"a": 1}\n\n{"b": [2]}'), [(1, {'a': 1}), (2, {'b': [2]})])
+
+    def test_long_ndjson_line_is_skipped(self):
+        records = self.records('{"a": 1}\n"' + 'x' * 100 + '"\n{"b": 2}', max_record_size=40)
+        self.assertEqual([records[0], records[2]], [(1, {'a': 1}), (3, {'b': 2})])
+        self.assertIsInstance(records[1][1], RecordError)
+
+    def test_malformed_array_fails_before_the_end_of_the_stream(self):
+        class Stream(io.BytesIO):
+            reads = 0
+
+            def read(self, size=-1):
+                self.reads += 1
+                return super().read(size)
+
+        stream = Stream(('[{"a": 1}, {"b": 1 2' + ' ' * 10000 + ']').encode())
+        with self.assertRaisesMessage(RecordError, 'record 2: record longer than 40 characters'):
+            list(iter_records(stream, read_size=8, max_record_size=40))
+        self.assertLess(stream.reads, 10)
+
+
+class RuleContainmentTest(TestCase):
+
+    def setUp(self):
+        self.v4 = Rule.objects.create(data={'source': [{'ip': '10.0.0.0/8'}]})
+        self.v6 = Rule.objects.create(data={'source': [{'ip': '2001:db8::/32'}]})
+        self.any6 = Rule.objects.create(data={'source': [{'ip': '::/0'}]})
+
+    def search(self, src):
+        return set(search_rules(Rule.objects.all(), src=src).values_list('id', flat=True))
+
+    def test_ipv6_containment(self):
+        self.assertEqual(self.search('2001:db8:1::5'), {self.v6.id, self.any6.id})
+        self.assertEqual(self.search('2001:db8::/48'), {self.v6.id, self.any6.id})
+        self.assertEqual(self.search('2001:db8::/16'), {self.any6.id})
+        self.assertEqual(self.search('2001:db9::1'), {self.any6.id})
+
+    def test_families_do_not_mix(self):
+        self.assertEqual(self.search('10.1.2.3'), {self.v4.id})
+        # 10.0.0.1 as an IPv4-mapped and as an IPv4-compatible IPv6 address
+        self.assertEqual(self.search('::ffff:a00:1'), {self.any6.id})
+        self.assertEqual(self.search('::a00:1'), {self.any6.id})
+        self.assertEqual(self.search('0.0.0.0/0'), set())
+
+
+class RuleProjectionTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('auditor'))
+
+    def projection(self, rule):
+        return (sorted(rule.addresses.values_list('side', 'version', 'network_start', 'network_end', 'prefixlen')),
+                sorted(rule.services.values_list('protocol', 'port')))
+
+    def search(self, **params):
+        response = self.client.get('/api/rule/', dict(params, page_size=100))
+        self.assertEqual(response.status_code, 200)
+        return [rule['id'] for rule in response.data['results']]
+
+    def test_projection_follows_rule_changes(self):
+        rule = Rule.objects.create(data={'source': [{'ip': '10.0.0.0/8'}, {'ip': '10.0.0.1/8'}, {'ip': 'bad'}],
+                                         'destination': [{'ip': '2001:db8::/32'}],
+                                         'service': [{'tcp': {'port': '443', 'description': 'https'}}]})
+        self.assertEqual(self.projection(rule), (
+            [('destination', 6, f'{0x20010db8 << 96:032x}', f'{(0x20010db9 << 96) - 1:032x}', 32),
+             ('source', 4, f'{0x0a000000:032x}', f'{0x0affffff:032x}', 8)],
+            [('tcp', '443')]))
+
+        rule.data = {'source': [{'ip': '192.168.1.1'}], 'destination': [], 'service': [{'udp': {'port': '53'}}]}
+        rule.save()
+        self.assertEqual(self.projection(rule), (
+            [('source', 4, f'{0xc0a80101:032x}', f'{0xc0a80101:032x}', 32)], [('udp', '53')]))
+
+        rule_id = rule.id
+        rule.delete()
+        self.assertFalse(RuleAddress.objects.filter(rule_id=rule_id).exists())
+        self.assertFalse(RuleService.objects.filter(rule_id=rule_id).exists())
+
+    def test_backfill_migration_matches_the_live_projection(self):
+        rules = [Rule.objects.create(data=data) for data in (
+            {'source': [{'ip': '10.0.0.0/8'}, {'ip': '::/0'}], 'destination': [{'ip': '10.1.2.3'}],
+             'service': [{'tcp': {'port': '22'}}, {'icmp': {'type': '8'}}]},
+            {'source': [{'ip': 'not an address'}, 'x'], 'service': [{'tcp': {'port': 22}}]},
+            None,
+        )]
+        expected = [self.projection(rule) for rule in rules]
+        RuleAddress.objects.all().delete()
+        RuleService.objects.all().delete()
+
+        migration = import_module('api.migrations.0003_rule_projection')
+        state = MigrationLoader(connection).project_state(('api', '0003_rule_projection'))
+        migration.backfill_rule_projection(state.apps, None)
+        self.assertEqual([self.projection(rule) for rule in rules], expected)
+
+    def test_address_families_do_not_mix(self):
+        v4 = Rule.objects.create(data={'source': [{'ip': '0.0.0.0/0'}], 'destination': [], 'service': []})
+        v6 = Rule.objects.create(data={'source': [{'ip': '2001:db8::/32'}], 'destination': [], 'service': []})
+        mapped = Rule.objects.create(data={'source': [{'ip': '::ffff:0:0/96'}], 'destination': [], 'service': []})
+
+        self.assertEqual(self.search(src='10.1.2.3'), [v4.id])
+        self.assertEqual(self.search(src='2001:db8:1::/48'), [v6.id])
+        self.assertEqual(self.search(src='2001:db8::1'), [v6.id])
+        self.assertEqual(self.search(src='2001:db9::1'), [])
+        self.assertEqual(self.search(src='::ffff:10.1.2.3'), [mapped.id])
+        # A wider network is not inside a narrower rule
+        self.assertEqual(self.search(src='2001:db8::/31'), [])
+
+
+class RuleMatchTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('auditor'))
+        rng = random.Random(0)
+        networks = ['0.0.0.0/0', '10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24', '10.1.2.3', '192.168.0.0/16',
+                    '2001:db8::/32', '2001:db8::1', 'not an address']
+        for i in range(60):
+            Rule.objects.create(data={
+                'source': [{'ip': ip} for ip in rng.sample(networks, 2)],
+                'destination': [{'ip': rng.choice(networks)}],
+                'service': [{'tcp': {'port': rng.choice(['22', '80', '443'])}}],
+            })
+        self.flows = [
+            {'src': src, 'dst': dst, 'port': port}
+            for src in ('', '10.1.2.3', '10.1.2.0/24', '10.9.9.9', '192.168.1.1', '2001:db8::1', '8.8.8.8')
+            for dst in ('', '10.1.2.3', '2001:db8::5', '0.0.0.0/0')
+            for port in ('', '80', '8080')
+        ]
+
+    def test_matches_the_single_search(self):
+        response = self.client.post('/api/rule/match/', {'flows': self.flows}, format='json')
+        self.assertEqual(response.status_code, 200)
+        for flow, rule_ids in zip(self.flows, response.data['results']):
+            expected = self.client.get('/api/rule/', dict(flow, page_size=1000)).data['results']
+            self.assertEqual(rule_ids, [rule['id'] for rule in expected], flow)
+
+    def test_numeric_ports_and_missing_keys(self):
+        response = self.client.post('/api/rule/match/', {'flows': [{'port': 80}, {'port': '80'}, {}]},
+                                    format='json')
+        self.assertEqual(response.data['results'][0], response.data['results'][1])
+        self.assertEqual(response.data['results'][2], [])
+
+    def test_invalid_flows(self):
+        response = self.client.post('/api/rule/match/', {'flows': [{'src': '10.0.0.1'}, {'src': 'bad', 'port': []}]},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'], [
+            {'flow': 1, 'errors': {'src': ['Check the searching ip format.'],
+                                   'port': ['Check the searching port format.']}}])
+        response = self.client.post('/api/rule/match/', {'flows': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class CachedJWTAuthenticationTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='secret')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_second_request_skips_user_query(self):
+        self.client.get('/api/token/user/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/token/user/')
+        self.assertEqual(response.data, {'user': 'alice'})
+
+    def test_deactivation_invalidates_snapshot(self):
+        self.client.get('/api/token/user/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/token/user/').status_code, 401)
+
+    def test_snapshots_expire_within_the_max_ttl(self):
+        with patch.object(jwt_user_cache.cache, 'set', wraps=jwt_user_cache.cache.set) as cache_set:
+            with override_settings(JWT_USER_CACHE_MAX_TTL=5):
+                self.client.get('/api/token/user/')
+        timeouts = [call.kwargs['timeout'] for call in cache_set.call_args_list
+                    if call.args[0].startswith('api:jwt:')]
+        self.assertEqual(timeouts, [5])
+
+    def test_login_keeps_cached_snapshots_and_listings(self):
+        self.client.get('/api/token/user/')
+        generation = movie_list_cache.generation()
+        update_last_login(None, self.user)
+        with self.assertNumQueries(0):
+            self.client.get('/api/token/user/')
+        self.assertEqual(movie_list_cache.generation(), generation)
+
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        self.assertEqual(self.client.get('/api/token/user/').status_code, 401)
+
+
+class AsyncReadViewTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='secret')
+        self.movie = Movie.objects.create(title='Alien', description='Space', user=self.user)
+        BoardComment.objects.create(movie=self.movie, user=self.user, comment='Scary')
+        Rule.objects.create(data={'source': [{'ip': '10.0.0.0/8'}], 'destination': [{'ip': '0.0.0.0/0'}],
+                                  'service': [{'tcp': {'port': '80'}}]})
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    async def assertSameResponse(self, sync_path, async_path, headers=None):
+        sync = await self.async_client.get(sync_path, headers=headers)
+        response = await self.async_client.get(async_path, headers=headers)
+        self.assertEqual(response.status_code, sync.status_code)
+        self.assertEqual(response.content, sync.content)
+        return response
+
+    async def test_movie_detail_matches_sync_view(self):
+        response = await self.assertSameResponse(f'/api/movies/{self.movie.id}/',
+                                                 f'/api/async/movies/{self.movie.id}/', self.headers)
+        self.assertEqual(response.json()['comments'][0]['comment'], 'Scary')
+        await self.assertSameResponse('/api/movies/999/', '/api/async/movies/999/', self.headers)
+        await self.assertSameResponse(f'/api/movies/{self.movie.id}/', f'/api/async/movies/{self.movie.id}/')
+
+    async def test_rule_search_matches_sync_view(self):
+        response = await self.assertSameResponse('/api/rule/?src=10.1.2.3&port=80',
+                                                 '/api/async/rule/?src=10.1.2.3&port=80', self.headers)
+        self.assertEqual(response.json()['count'], 1)
+        await self.assertSameResponse('/api/rule/?src=bad', '/api/async/rule/?src=bad', self.headers)
+
+    async def test_movie_list_pages(self):
+        response = await self.async_client.get('/api/async/movielist/?search=alien')
+        self.assertEqual([m['title'] for m in response.json()['results']], ['Alien'])
+        response = await self.async_client.get('/api/async/movielist/?pagination=cursor')
+        self.assertEqual(response.json()['next'], None)
+
+
+class SQLitePragmaTest(SimpleTestCase):
+
+    def test_journal_mode_is_set_once_after_migrate(self):
+        with tempfile.TemporaryDirectory() as directory:
+            handler = ConnectionHandler({'default': sqlite_settings(Path(directory))})
+            self.assertNotIn('journal_mode', handler['default'].settings_dict['PRAGMAS'])
+            with handler['default'].cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.assertEqual(cursor.fetchone()[0], 'delete')
+                cursor.execute('PRAGMA synchronous')
+                self.assertEqual(cursor.fetchone()[0], 1)
+
+            with patch('django.db.connections', handler):
+                apply_journal_mode(sender=None, using='default')
+            handler.close_all()
+            # The mode is kept by the file, for every later connection
+            with handler['default'].cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.assertEqual(cursor.fetchone()[0], 'wal')
+            handler.close_all()
+
+
+@skipUnless(os.environ.get('RUN_LOAD_TESTS') == '1', 'local load test, set RUN_LOAD_TESTS=1 to run')
+class SQLiteWriteThroughputTest(SimpleTestCase):
+    """
+    Runs loadtest_ratings against scratch SQLite files, with SQLite's defaults
+    (SQLITE_TUNING=0) and with the tuned profile from movierater/database.py.
+    """
+    requests = 500
+
+    def loadtest(self, path, **environ):
+        environ = {**os.environ, 'SQLITE_PATH': path, **environ}
+        manage = [sys.executable, str(settings.BASE_DIR / 'manage.py')]
+        subprocess.run(manage + ['migrate', '-v0'], env=environ, check=True)
+        result = subprocess.run(manage + ['loadtest_ratings', '--requests', str(self.requests)],
+                                env=environ, check=True, capture_output=True, text=True)
+        match = re.search(r'throughput: ([\d.]+) ratings/s, errors: (\d+)', result.stdout)
+        self.assertIn('aggregates match', result.stdout)
+        return float(match[1]), int(match[2])
+
+    def test_tuned_profile_write_throughput(self):
+        with tempfile.TemporaryDirectory() as directory:
+            before = self.loadtest(os.path.join(directory, 'default.sqlite3'), SQLITE_TUNING='0')
+            after = self.loadtest(os.path.join(directory, 'tuned.sqlite3'))
+        sys.stderr.write(f'\nSQLite defaults: {before[0]:.1f} ratings/s, {before[1]} errors; '
+                         f'tuned: {after[0]:.1f} ratings/s, {after[1]} errors\n')
+        self.assertEqual(after[1], 0)
+        self.assertGreater(after[0], before[0])
+
+
+class RequestMetricsTest(TestCase):
+
+    def setUp(self):
+        request_histogram.reset()
+        self.user = User.objects.create_user('alice', password='secret', is_staff=True)
+        Movie.objects.create(title='Alien', description='Space', user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_server_timing_counts_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/movies/')
+        self.assertRegex(response['Server-Timing'],
+                         rf'^db;dur=[\d.]+;desc="{len(queries)} queries", serialize;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_metrics_endpoint_reports_histogram(self):
+        counts = []
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get('/api/movies/')
+            counts.append(len(queries))
+        stats = self.client.get('/api/metrics/').data['views']['MovieViewSet.list']
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['queries'], sum(counts))
+        self.assertEqual(stats['buckets']['+Inf'], 2)
+
+    def test_metrics_endpoint_is_staff_only(self):
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+
+class BenchmarkCommandTest(TestCase):
+    options = {'requests': 60, 'users': 3, 'movies': 20, 'ratings': 30, 'comments': 20, 'rules': 20}
+
+    def test_replay_reports_and_rolls_back(self):
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = os.path.join(directory, 'baseline.json')
+            out = StringIO()
+            call_command('benchmark', mix='mixed', save_baseline=baseline, stdout=out, **self.options)
+            self.assertIn('GET /api/movies/{movie}/', out.getvalue())
+            self.assertFalse(Movie.objects.exists())
+
+            # Pretend the baseline needed fewer queries for every endpoint
+            with open(baseline) as f:
+                results = json.load(f)
+            for stats in results['endpoints'].values():
+                stats['queries'] = 0
+            with open(baseline, 'w') as f:
+                json.dump(results, f)
+            with self.assertRaisesMessage(CommandError, 'regression'):
+                call_command('benchmark', mix='mixed', baseline=baseline, tolerance=100, stdout=StringIO(),
+                             **self.options)
+
+
+class ValuesSerializerEquivalenceTest(TestCase):
+
+    def setUp(self):
+        alice = User.objects.create_user('alice')
+        bob = User.objects.create_user('bøb')
+        published = timezone.now().replace(microsecond=123456)
+        movies = [
+            Movie.objects.create(title='Alien', description='Space', user=alice, pub_date=published),
+            Movie.objects.create(title='Ünïcode "quoted"', description='', user=None, pub_date=None),
+            Movie.objects.create(title='Heat', description='LA', user=bob, pub_date=published.replace(microsecond=0)),
+        ]
+        for movie in movies:
+            BoardComment.objects.create(movie=movie, user=alice, comment='First', pub_date=movie.pub_date or published)
+        BoardComment.objects.create(movie=movies[0], user=None, comment='Anonymous', pub_date=published)
+        BoardComment.objects.create(movie=None, user=bob, comment='Orphan', pub_date=published.replace(microsecond=0))
+        Rating.objects.create(movie=movies[0], user=alice, stars=5)
+        Rating.objects.create(movie=movies[2], user=bob, stars=1)
+        Rule.objects.create(data={'source': [{'ip': '10.0.0.0/8'}], 'service': [{'tcp': {'port': '443'}}]})
+        Rule.objects.create(data={'name': 'ünïcode', 'nested': {'list': [1, 2.5, None, True]}})
+
+    def assertSameJSON(self, serializer_class, values_serializer_class, queryset):
+        expected = JSONRenderer().render(serializer_class(queryset, many=True).data)
+        actual = JSONRenderer().render(values_serializer_class(values_serializer_class.values(queryset)).data)
+        self.assertEqual(actual, expected)
+
+    def test_movie_list(self):
+        self.assertSameJSON(MovieListSerializer, MovieListValuesSerializer, Movie.objects.order_by('id'))
+
+    def test_board_comments(self):
+        self.assertSameJSON(BoardCommentSerializer, BoardCommentValuesSerializer, BoardComment.objects.order_by('id'))
+
+    def test_movie_list_in_active_timezone(self):
+        with timezone.override('Asia/Seoul'):
+            self.assertSameJSON(MovieListSerializer, MovieListValuesSerializer, Movie.objects.order_by('id'))
+
+    def test_ratings(self):
+        self.assertSameJSON(RatingSerializer, RatingValuesSerializer, Rating.objects.order_by('id'))
+
+    def test_rules(self):
+        self.assertSameJSON(RuleSerializer, RuleValuesSerializer, Rule.objects.order_by('id'))
+
+    def test_comment_list_reads_authors_in_the_same_query(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(User.objects.get(username="alice"))}')
+        client.get('/api/comments/')
+        with self.assertNumQueries(1):
+            response = client.get('/api/comments/')
+        self.assertEqual(len(response.data), 5)
@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import ScopedRateThrottle
+
+
+class PasswordHashRateThrottle(ScopedRateThrottle):
+    """
+    Per-client rate limit for endpoints that hash a password (login, sign up).
+    Rates come from DEFAULT_THROTTLE_RATES under the view's throttle_scope.
+    """
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'LOGIN_GUARD_CACHE_ALIAS', 'default')]
+
+
+class LoginFailureGuard:
+    """
+    Counts failed logins per username. Once LOGIN_FAILURE_LIMIT failures pile up
+    within LOGIN_FAILURE_WINDOW seconds, further attempts for that username are
+    refused before the password is hashed, so credential-stuffing bursts stop
+    costing a PBKDF2 run each.
+    """
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'LOGIN_GUARD_CACHE_ALIAS', 'default')]
+
+    @property
+    def limit(self):
+        return getattr(settings, 'LOGIN_FAILURE_LIMIT', 5)
+
+    @property
+    def window(self):
+        return getattr(settings, 'LOGIN_FAILURE_WINDOW', 15 * 60)
+
+    @staticmethod
+    def key(username):
+        return f'api:login-failures:{str(username).strip().lower()}'
+
+    def is_locked(self, username):
+        return bool(username) and self.cache.get(self.key(username), 0) >= self.limit
+
+    def record_failure(self, username):
+        if not username:
+            return
+        key = self.key(username)
+        # The window starts at the first failure and is not extended by later ones
+        self.cache.add(key, 0, timeout=self.window)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, 1, timeout=self.window)
+
+    def reset(self, username):
+        self.cache.delete(self.key(username))
+
+
+login_guard = LoginFailureGuard()
@@ -1,11 +1,13 @@
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView, TokenVerifyView, TokenViewBase
+from rest_framework_simplejwt.views import TokenRefreshView, TokenVerifyView, TokenViewBase
 
 from api.views import MovieViewSet, RatingViewSet, UserViewSet, \
     BoardCommentSet, MovieListViewSet, \
-    DogViewSet, RuleViewSet, CustomObtainAuthToken, example_view, SecretView, UserCheckView
+    DogViewSet, RuleViewSet, CustomObtainAuthToken, GuardedTokenObtainPairView, example_view, SecretView, \
+    UserCheckView, MetricsView
+from api.async_views import AsyncMovieListView, AsyncMovieDetailView, AsyncRuleListView
 
 router = routers.DefaultRouter()
 router.register('movies', MovieViewSet)
@@ -24,9 +26,16 @@ urlpatterns = [
     path('example/', example_view, name='example-view'),
     path('secret/', SecretView.as_view(), name='secret-view'),
 
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('token/', GuardedTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('token/verify/', TokenVerifyView.as_view(), name='token_verify'),
     path('token/user/', UserCheckView.as_view(), name='token_obtain_pair'),
 
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+
+    # Async read paths, for ASGI deployments
+    path('async/movielist/', AsyncMovieListView.as_view(), name='async-movielist'),
+    path('async/movies/<str:pk>/', AsyncMovieDetailView.as_view(), name='async-movie-detail'),
+    path('async/rule/', AsyncRuleListView.as_view(), name='async-rule-list'),
+
 ]
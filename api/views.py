@@ -1,49 +1,85 @@
+import io
+from datetime import timedelta
+
 from django.contrib.auth import get_user_model
 from rest_framework import mixins
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Prefetch
+from django.core.exceptions import ValidationError
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework import viewsets, status
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import action
-from rest_framework.permissions import  AllowAny, IsAdminUser
+from rest_framework.exceptions import AuthenticationFailed, Throttled
+from rest_framework.pagination import _positive_int
+from rest_framework.permissions import  AllowAny, IsAdminUser, SAFE_METHODS
 from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
 
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework_simplejwt.exceptions import AuthenticationFailed
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 
+from api.authentication import AsyncTokenAuthentication, CachedJWTAuthentication, StatelessJWTAuthentication
+from api.cache import RatingMapCache, movie_list_cache
+from api.ingest import RecordError, chunked, iter_records
+from api.jsonkeys import JSONKeyFilterError, filter_json_keys
+from api.leaderboards import trending_now
+from api.metrics import SerializerTimingMixin, request_histogram, LATENCY_BUCKETS
 from api.models import Movie, Rating, BoardComment, Rule, Dog
-from api.permissions import IsOwnerOrReadOnly
+from api.permissions import IsOwner, IsOwnerOrReadOnly
+from api.rules import search_rules, import_rules, match_flows, network_cache_stats, parse_flows
+from api.search import get_search_backend
+from api.throttling import PasswordHashRateThrottle, login_guard
 from api.serializers import MovieSerializer, RatingSerializer, UserSerializer, PaginationSet, BoardCommentSerializer, \
-    MovieListSerializer, DogSerializer, RuleSerializer
+    MovieListSerializer, DogSerializer, RuleSerializer, CommentCursorPagination, RatingCursorPagination, \
+    ValuesSerializer, RatingValuesSerializer, BoardCommentValuesSerializer, MovieListValuesSerializer, \
+    RuleValuesSerializer, \
+    MoviePagination
 
-import ipaddress
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 
 
 
 
 # Jwt view setting
 @api_view(['GET'])
+@authentication_classes([StatelessJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def example_view(request):
     return Response({"message": "You are authenticated!"})
 
 
 class SecretView(APIView):
+    # Read-only and only needs an authenticated caller, so no user lookup at all
+    authentication_classes = (StatelessJWTAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     def get(self, request):
         return Response({"message": "You have accessed the secret view!"})
 
 
+class MetricsView(APIView):
+    """
+    Per-view request latency histograms (cumulative counts per bucket upper bound in ms),
+    query and DB time totals since the process started, and the rule network cache stats.
+    """
+    permission_classes = (IsAuthenticated, IsAdminUser)
+
+    def get(self, request):
+        return Response({'buckets_ms': LATENCY_BUCKETS, 'views': request_histogram.snapshot(),
+                         'network_cache': network_cache_stats()})
+
+
 class UserCheckView(APIView):
-    authentication_classes = (JWTAuthentication, )
+    authentication_classes = (CachedJWTAuthentication, )
     permission_classes = (IsAuthenticated, )
 
     def get(self, request):
@@ -60,210 +96,522 @@ class UserViewSet(mixins.CreateModelMixin, GenericViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = (AllowAny,)
+    # Sign up hashes the password too
+    throttle_classes = (PasswordHashRateThrottle,)
+    throttle_scope = 'register'
+
+
+class ValuesListMixin:
+    """
+    list() rendering rows of values() through values_serializer_class instead of
+    building model instances for serializer_class; the response body is the same.
+    """
+    values_serializer_class = None
+
+    def get_values_serializer_class(self):
+        return self.values_serializer_class
+
+    def list(self, request, *args, **kwargs):
+        values_serializer = self.get_values_serializer_class()
+        queryset = values_serializer.values(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(values_serializer(page).data)
+        return Response(values_serializer(queryset).data)
 
 
-class BoardCommentSet(viewsets.ModelViewSet):
+class BoardCommentSet(SerializerTimingMixin, ValuesListMixin, viewsets.ModelViewSet):
     queryset = BoardComment.objects.all()
     serializer_class = BoardCommentSerializer
-    authentication_classes = (JWTAuthentication,)
+    values_serializer_class = BoardCommentValuesSerializer
+    authentication_classes = (CachedJWTAuthentication,)
     permission_classes = (IsAuthenticated, IsOwnerOrReadOnly | IsAdminUser)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
 
-class MovieViewSet(viewsets.ModelViewSet):
+def clean_stars(value):
+    """
+    Validate the stars of a request against the Rating field's 1-5 validators, without
+    touching the database. Raises ValidationError; unlike the field's own int() coercion,
+    a boolean or a fractional number such as 3.7 is rejected rather than truncated.
+    """
+    field = Rating._meta.get_field('stars')
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValidationError(field.error_messages['invalid'], code='invalid', params={'value': value})
+    return field.clean(value, None)
+
+
+class MovieViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = Movie.objects.order_by("-pub_date").all()
     serializer_class = MovieSerializer
-    pagination_class = PaginationSet
+    pagination_class = MoviePagination
 
     # Token auth settings
-    authentication_classes = (JWTAuthentication,)
+    authentication_classes = (CachedJWTAuthentication,)
     permission_classes = (IsAuthenticated, IsOwnerOrReadOnly | IsAdminUser )
 
+    def get_queryset(self):
+        # Load authors and the newest comments up front so a page costs a fixed number of queries.
+        # Rating aggregates are stored on Movie, so no Rating join is needed.
+        recent_comments = BoardComment.objects.select_related('user') \
+            .order_by('-pub_date', '-id')[:MovieSerializer.recent_comments_limit]
+        return super().get_queryset().select_related('user') \
+            .annotate(comment_count=Count('comments')) \
+            .prefetch_related(Prefetch('comments', queryset=recent_comments, to_attr='recent_comments'))
+
+    @action(detail=True, methods=['GET'])
+    def comments(self, request, pk=None):
+        movie = get_object_or_404(Movie.objects.only('id', 'user'), pk=pk)
+        self.check_object_permissions(request, movie)
+
+        values_serializer = self.get_values_serializer_class(BoardCommentValuesSerializer)
+        queryset = values_serializer.values(BoardComment.objects.filter(movie=movie))
+        paginator = CommentCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(values_serializer(page).data)
+
+    @action(detail=True, methods=['GET'])
+    def similar(self, request, pk=None):
+        """
+        Movies rated most like this one, read from the lists rebuild_similar_movies keeps.
+        """
+        movie = get_object_or_404(Movie.objects.only('id', 'user'), pk=pk)
+        self.check_object_permissions(request, movie)
+
+        values_serializer = self.get_values_serializer_class(MovieListValuesSerializer)
+        queryset = Movie.objects.filter(similar_to__movie=movie).order_by('-similar_to__score', 'id')
+        rows = list(values_serializer.values(queryset, 'similar_to__score'))
+        results = values_serializer(rows).data
+        for result, row in zip(results, rows):
+            result['score'] = row['similar_to__score']
+        return Response({'results': results}, status.HTTP_200_OK)
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
     @action(detail=True, methods=['POST'])
     def rate_movie(self, request, pk=None):
         if 'stars' in request.data:
-            movie = Movie.objects.get(id=pk)
-            stars = request.data['stars']
-            user = request.user
+            try:
+                stars = clean_stars(request.data['stars'])
+            except ValidationError as e:
+                response = {'message': 'Invalid stars', 'errors': e.messages}
+                return Response(response, status=status.HTTP_400_BAD_REQUEST)
 
             try:
-                rating = Rating.objects.get(user=user.id, movie=movie.id)
-                # Code should be changed (the star number should be 0-5)
-                rating.stars = stars
-                rating.save()
-
-                serializer = RatingSerializer(rating, many=False)
-                response = {'message': 'Rating updated', 'result': serializer.data}
-                return Response(response, status=status.HTTP_200_OK)
-            except:
-                rating = Rating.objects.create(user=user, movie=movie, stars=stars)
-                serializer = RatingSerializer(rating, many=False)
-                response = {'message': 'Rating created', 'result': serializer.data}
-                return Response(response, status=status.HTTP_200_OK)
+                rating, created = Rating.objects.rate(request.user, int(pk), stars)
+            except (ValueError, Movie.DoesNotExist):
+                raise Http404
+
+            serializer = RatingSerializer(rating, many=False)
+            message = 'Rating created' if created else 'Rating updated'
+            response = {'message': message, 'result': serializer.data}
+            return Response(response, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
         else:
             response = {'message': 'You need to provide stars'}
             return Response(response, status=status.HTTP_400_BAD_REQUEST)
 
 
-class RatingViewSet(viewsets.ModelViewSet):
+class RatingViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = Rating.objects.all()
     serializer_class = RatingSerializer
-    authentication_classes = (JWTAuthentication,)
+    values_serializer_class = RatingValuesSerializer
+    authentication_classes = (CachedJWTAuthentication,)
+    permission_classes = (IsAuthenticated, IsOwner)
+    pagination_class = RatingCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # Other users' ratings cannot even be looked up for writing
+        if self.request.method not in SAFE_METHODS:
+            queryset = queryset.filter(user=self.request.user.id)
+        return queryset
 
     # Owner data filtering
     def list(self, request, *args, **kwargs):
-        queryset = Rating.objects.filter(user=request.user.id)
-        serializer = RatingSerializer(queryset, many=True)
-        return Response(serializer.data, status.HTTP_200_OK)
+        values_serializer = self.get_values_serializer_class()
+        queryset = values_serializer.values(Rating.objects.filter(user=request.user.id))
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(values_serializer(page).data)
+
+    # How far before ?since= a delta starts, so ratings committed by transactions still
+    # open when the client's copy was read are sent again rather than missed
+    map_delta_overlap = timedelta(seconds=30)
+
+    @action(detail=False, methods=['GET'], url_path='map')
+    def rating_map(self, request):
+        """
+        The caller's ratings as {movie_id: stars}, with the as_of time to send back as ?since=.
+        With ?since= only ratings added or changed after it are returned, unless one was
+        removed since then; "full" tells which of the two the response is.
+        """
+        since = request.query_params.get('since')
+        if since is not None:
+            try:
+                since = parse_datetime(since)
+            except ValueError:
+                since = None
+            if since is None:
+                return Response({'since': ['Expected an ISO 8601 datetime.']}, status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+
+        cache = RatingMapCache(request.user.id)
+
+        def build():
+            # Read before as_of, so a full map also starts the removal record its deltas rely on
+            removed_at = cache.removed_at()
+            as_of = timezone.now()
+            full = since is None or since.timestamp() < removed_at
+            queryset = Rating.objects.filter(user=request.user.id)
+            if not full:
+                queryset = queryset.filter(updated__gte=since - self.map_delta_overlap)
+            ratings = dict(queryset.order_by('movie').values_list('movie', 'stars'))
+            return {'as_of': as_of, 'full': full, 'ratings': ratings}
+
+        cached = cache.get_or_build(request, build)
+        not_modified = cache.not_modified(request, cached)
+        if not_modified is not None:
+            return not_modified
+        return Response(cached.data, status=status.HTTP_200_OK, headers=cached.headers)
 
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            self.perform_update(serializer)
+        return Response(serializer.data, status.HTTP_200_OK)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
 
     def create(self, request, *args, **kwargs):
         response = {'message': 'You can create'}
         return Response(response, status=status.HTTP_400_BAD_REQUEST)
 
-
-class MovieListViewSet(mixins.ListModelMixin, mixins.CreateModelMixin, GenericViewSet):
-    pagination_class = PaginationSet
+    bulk_batch_size = 1000
+    bulk_max_errors = 100
+
+    @action(detail=False, methods=['POST'])
+    def bulk(self, request):
+        """
+        Ingest a JSON array or NDJSON body of {"movie": id, "stars": 1-5} objects.
+        Staff may add "user" to import ratings on behalf of other users.
+        The body is read incrementally and upserted in batches of bulk_batch_size.
+        """
+        received = created = updated = failed = 0
+        errors = []
+        stream_error = None
+
+        def fail(position, error):
+            nonlocal failed
+            failed += 1
+            if len(errors) < self.bulk_max_errors:
+                errors.append({'record': position, 'errors': error})
+
+        def records():
+            # Stop at an undecodable JSON array, but keep the records read before it
+            nonlocal stream_error
+            try:
+                yield from iter_records(request.stream or io.BytesIO())
+            except RecordError as e:
+                stream_error = e
+
+        for batch in chunked(records(), self.bulk_batch_size):
+            received += len(batch)
+            valid = []
+            for position, record in batch:
+                rating, error = self.clean_bulk_rating(request, record)
+                if error:
+                    fail(position, error)
+                else:
+                    valid.append((position, rating))
+
+            # One query each to drop rows that point at missing movies or users
+            movie_ids = set(Movie.objects.filter(id__in={r[1] for _, r in valid})
+                            .values_list('id', flat=True))
+            user_ids = set(User.objects.filter(id__in={r[0] for _, r in valid})
+                           .values_list('id', flat=True))
+            ratings = []
+            for position, rating in valid:
+                if rating[1] not in movie_ids:
+                    fail(position, {'movie': ['Movie does not exist.']})
+                elif rating[0] not in user_ids:
+                    fail(position, {'user': ['User does not exist.']})
+                else:
+                    ratings.append(rating)
+
+            if ratings:
+                batch_created, batch_updated = Rating.objects.bulk_rate(ratings)
+                created += batch_created
+                updated += batch_updated
+
+        if stream_error is not None:
+            fail(stream_error.record, {'non_field_errors': [stream_error.message]})
+
+        response = {'received': received, 'created': created, 'updated': updated,
+                    'failed': failed, 'errors': errors}
+        return Response(response, status.HTTP_400_BAD_REQUEST if stream_error else status.HTTP_200_OK)
+
+    @staticmethod
+    def clean_bulk_rating(request, record):
+        """
+        Return ((user_id, movie_id, stars), None) for a valid record, else (None, errors).
+        """
+        if isinstance(record, RecordError):
+            return None, {'non_field_errors': [record.message]}
+        if not isinstance(record, dict):
+            return None, {'non_field_errors': ['Expected an object.']}
+
+        errors = {}
+        fields = {}
+        for name in ('user', 'movie', 'stars'):
+            value = record.get(name)
+            if name == 'user' and value is None:
+                fields['user'] = request.user.id
+                continue
+            field = Rating._meta.get_field(name)
+            try:
+                if value is None:
+                    raise ValidationError(field.error_messages['null'])
+                # Existence of movies and users is checked per batch, not per row
+                if field.is_relation:
+                    fields[name] = field.target_field.to_python(value)
+                else:
+                    fields[name] = clean_stars(value)
+            except ValidationError as e:
+                errors[name] = e.messages
+        if 'user' in fields and fields['user'] != request.user.id and not request.user.is_staff:
+            errors['user'] = ['Only staff can import ratings for other users.']
+
+        if errors:
+            return None, errors
+        return (fields['user'], fields['movie'], fields['stars']), None
+
+
+class MovieListViewSet(SerializerTimingMixin, mixins.ListModelMixin, mixins.CreateModelMixin, GenericViewSet):
+    pagination_class = MoviePagination
     queryset = Movie.objects.order_by('-pub_date').all()
     serializer_class = MovieListSerializer
-    authentication_classes = (TokenAuthentication,)
+    values_serializer_class = MovieListValuesSerializer
+    authentication_classes = (AsyncTokenAuthentication,)
     permission_classes = (AllowAny,)
 
     def list(self, request, *args, **kwargs):
+        # The listing is the same for every caller, so serve it from the shared response cache
+        cached = movie_list_cache.get_or_build(request, lambda: self.list_data(request))
+        not_modified = movie_list_cache.not_modified(request, cached)
+        if not_modified is not None:
+            return not_modified
+        return Response(cached.data, status=status.HTTP_200_OK, headers=cached.headers)
+
+    def list_data(self, request):
         # print(request.user)
         if 'search' in request.query_params:
 
             search = request.query_params['search']
-            queryset = Movie.objects.order_by("-pub_date").filter(title__contains=search)
-
-            page = self.paginate_queryset(queryset)
-            serializer = self.get_serializer(page, many=True)
-
-            result = self.get_paginated_response(serializer.data)
-            return Response(result.data, status=status.HTTP_200_OK)
+            queryset = get_search_backend().search(self.get_queryset(), search)
         else:
             queryset = self.get_queryset()
 
-            page = self.paginate_queryset(queryset)
-            serializer = self.get_serializer(page, many=True)
-
-            result = self.get_paginated_response(serializer.data)
-            return Response(result.data, status=status.HTTP_200_OK)
+        values_serializer = self.get_values_serializer_class()
+        page = self.paginate_queryset(values_serializer.values(queryset))
+        serializer = values_serializer(page)
+
+        result = self.get_paginated_response(serializer.data)
+        return result.data
+
+    leaderboard_size = 10
+    leaderboard_max_size = 100
+
+    @action(detail=False, methods=['GET'])
+    def top_rated(self, request):
+        """
+        Movies by the Bayesian average of their ratings; ?limit= sets how many.
+        """
+        return self.leaderboard(request, 'bayesian_score', lambda score, now: score)
+
+    @action(detail=False, methods=['GET'])
+    def trending(self, request):
+        """
+        Movies by their recent ratings, each weighted down by half every LEADERBOARD_TRENDING_HALF_LIFE.
+        """
+        return self.leaderboard(request, 'trending_score', trending_now)
+
+    def leaderboard(self, request, score_field, score):
+        try:
+            limit = _positive_int(request.query_params.get('limit', self.leaderboard_size),
+                                  strict=True, cutoff=self.leaderboard_max_size)
+        except ValueError:
+            return Response({'limit': ['Expected a positive integer.']}, status.HTTP_400_BAD_REQUEST)
+
+        # A walk down the score index that stops after `limit` movies; unscored movies sort last
+        queryset = Movie.objects.filter(**{f'{score_field}__gt': 0}).order_by(f'-{score_field}', '-id')
+        values_serializer = self.get_values_serializer_class()
+        rows = list(values_serializer.values(queryset, score_field)[:limit])
+
+        now = timezone.now()
+        results = values_serializer(rows).data
+        for result, row in zip(results, rows):
+            result['score'] = score(row[score_field], now)
+        return Response({'results': results}, status.HTTP_200_OK)
 
 
 class DogViewSet(viewsets.ModelViewSet):
-    queryset = Dog.objects.all()
+    queryset = Dog.objects.order_by('id').all()
     serializer_class = DogSerializer
     permission_classes = (AllowAny,)
     pagination_class = PaginationSet
+    # JSON fields the list filters by key, e.g. ?data.age__gte=3 (see filter_json_keys)
+    json_filter_fields = ('data',)
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = filter_json_keys(queryset, self.request.query_params, self.json_filter_fields)
+        return queryset
 
-def compare_ip_networks(network_str1, network_str2):
-    if network_str1.find('/') == -1:
-        network_str1 = network_str1 + '/32'
-    if network_str2.find('/') == -1:
-        network_str2 = network_str2 + '/32'
-
-    try:
-        network1 = ipaddress.ip_network(network_str1, strict=False)
-        network2 = ipaddress.ip_network(network_str2, strict=False)
-
-        # Compare the networks
-        if network1 == network2:
-            return True
-        elif network1.num_addresses > network2.num_addresses:
-            return False
-        elif network1.overlaps(network2):
-            return True
-        else:
-            return False
-
-    except ipaddress.AddressValueError as e:
-        # print(f"Invalid network address: {e}")
-        return Response({'result': {'error': 'Check the searching ip or port format.'}},
-                        status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-
-class RuleViewSet(mixins.ListModelMixin, GenericViewSet):
-    queryset = Rule.objects.all()
+    def list(self, request, *args, **kwargs):
+        try:
+            return super().list(request, *args, **kwargs)
+        except JSONKeyFilterError as e:
+            return Response({e.param: [str(e)]}, status.HTTP_400_BAD_REQUEST)
+
+
+def stream_ndjson(queryset, serializer_class, chunk_size=1000):
+    """
+    Stream a queryset as newline-delimited JSON, one serialized object per line.
+    Rows are read with .iterator() so memory stays flat however large the table is.
+    A ValuesSerializer subclass renders values() rows instead of model instances.
+    """
+    encoder = JSONEncoder(ensure_ascii=False)
+    if issubclass(serializer_class, ValuesSerializer):
+        queryset, represent = serializer_class.values(queryset), serializer_class.representer()
+    else:
+        def represent(obj):
+            return serializer_class(obj).data
+
+    def lines():
+        for obj in queryset.iterator(chunk_size=chunk_size):
+            yield encoder.encode(represent(obj)) + '\n'
+
+    return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+
+class RuleViewSet(SerializerTimingMixin, mixins.ListModelMixin, GenericViewSet):
+    queryset = Rule.objects.order_by('id').all()
     serializer_class = RuleSerializer
-    authentication_classes = (JWTAuthentication,)
+    values_serializer_class = RuleValuesSerializer
+    authentication_classes = (CachedJWTAuthentication,)
     permission_classes = (IsAuthenticated, )
     pagination_class = PaginationSet
+    stream_chunk_size = 1000
+    match_max_flows = 10000
 
     def list(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+
         if ('src' in request.query_params) or ('dst' in request.query_params) \
                 or ('port' in request.query_params):
 
-            searchSrc = request.query_params['src']
-            searchDst = request.query_params['dst']
-            searchPort = request.query_params['port']
-            queryset = self.get_queryset()
+            searchSrc = request.query_params.get('src', '')
+            searchDst = request.query_params.get('dst', '')
+            searchPort = request.query_params.get('port', '')
 
-            p_result = []
-            d_result = []
-            s_result = []
-
-            for i in queryset:
-                if searchPort != '':
-                    for svc in i.data['service']:
-                        for k, v in svc.items():
-                            for k, v in v.items():
-                                if k != 'description':
-                                    if searchPort == v:
-                                        p_result.append(i.id)
-
-                source = i.data['source']
-                destination = i.data['destination']
-                for src in source:
-                    if searchSrc != '':
-                        if compare_ip_networks(searchSrc, src['ip']):
-                            s_result.append(i.id)
-                for dst in destination:
-                    if searchDst != '':
-                        if compare_ip_networks(searchDst, dst['ip']):
-                            d_result.append(i.id)
-
-            if searchSrc != '' and searchDst != '' and searchPort != '':
-                result = list(set(p_result) & set(d_result) & set(s_result))
-            elif searchSrc != '' and searchDst != '':
-                result = list(set(d_result) & set(s_result))
-            elif searchSrc != '' and searchPort != '':
-                result = list(set(p_result) & set(s_result))
-            elif searchDst != '' and searchPort != '':
-                result = list(set(p_result) & set(d_result))
-            else:
-                result = list(set(p_result) | set(d_result) | set(s_result))
-
-            queryset = Rule.objects.filter(id__in=result)
-            serializer = RuleSerializer(queryset, many=True)
-            return Response({'result': serializer.data}, status.HTTP_200_OK)
+            try:
+                queryset = search_rules(queryset, searchSrc, searchDst, searchPort)
+            except ValueError:
+                return Response({'result': {'error': 'Check the searching ip or port format.'}},
+                                status.HTTP_400_BAD_REQUEST)
+
+        # ?stream=1 exports every matching rule as NDJSON instead of a page
+        if request.query_params.get('stream') in ('1', 'true'):
+            return stream_ndjson(queryset, RuleValuesSerializer, self.stream_chunk_size)
+
+        values_serializer = self.get_values_serializer_class()
+        page = self.paginate_queryset(values_serializer.values(queryset))
+        return self.get_paginated_response(values_serializer(page).data)
+
+    @action(detail=False, methods=['POST'])
+    def match(self, request):
+        """
+        Search for many flows at once: {"flows": [{"src": ..., "dst": ..., "port": ...}, ...]},
+        each read like this list's ?src=&dst=&port=. Returns {"results": [[rule id, ...], ...]}
+        in flow order.
+        """
+        flows = request.data.get('flows') if isinstance(request.data, dict) else None
+        if not isinstance(flows, list) or len(flows) > self.match_max_flows:
+            return Response({'flows': [f'Expected a list of at most {self.match_max_flows} flows.']},
+                            status.HTTP_400_BAD_REQUEST)
+        flows, errors = parse_flows(flows)
+        if errors:
+            return Response({'errors': errors}, status.HTTP_400_BAD_REQUEST)
+        return Response({'results': match_flows(flows)})
+
+    @action(detail=False, methods=['POST'], url_path='import', permission_classes=(IsAuthenticated, IsAdminUser))
+    def import_rules(self, request):
+        """
+        Import a JSON array or NDJSON body of Rule.data documents (or exported {"id", "data"} objects).
+        The export counterpart is GET ?stream=1.
+        """
+        stats = import_rules(iter_records(request.stream or io.BytesIO()))
+        return Response(stats, status.HTTP_400_BAD_REQUEST if stats['aborted'] else status.HTTP_200_OK)
+
+
+class LoginGuardMixin:
+    """
+    Login views: rate limited per client, and refused per username once login_guard
+    has counted too many failures (api/throttling.py).
+    """
+    throttle_classes = (PasswordHashRateThrottle,)
+    throttle_scope = 'login'
+
+    @staticmethod
+    def login_username(request):
+        # The body may be any JSON value, not just an object
+        username = request.data.get('username') if isinstance(request.data, dict) else None
+        return username if isinstance(username, str) else None
+
+    @staticmethod
+    def check_login_guard(username):
+        # Refuse before authenticating, so a locked account costs no password hashing
+        if login_guard.is_locked(username):
+            raise Throttled(wait=login_guard.window, detail='Too many failed login attempts.')
+
+
+class CustomObtainAuthToken(LoginGuardMixin, ObtainAuthToken):
 
-        else:
-            queryset = self.get_queryset()
-            serializer = RuleSerializer(queryset, many=True)
-            return Response({'result': serializer.data}, status.HTTP_200_OK)
+    def post(self, request, *args, **kwargs):
+        username = self.login_username(request)
+        self.check_login_guard(username)
 
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            login_guard.record_failure(username)
+            return Response(serializer.errors, status.HTTP_400_BAD_REQUEST)
 
-class CustomObtainAuthToken(ObtainAuthToken):
-    def post(self, request, *args, **kwargs):
-        # Call the parent's post method to authenticate the user and get the token
-        response = super(CustomObtainAuthToken, self).post(request, *args, **kwargs)
-        token = response.data.get('token')
+        login_guard.reset(username)
+        user = serializer.validated_data['user']
+        token, created = Token.objects.get_or_create(user=user)
+        # The username comes from the user authenticate() already loaded
+        return Response({'token': token.key, 'username': user.username})
 
-        # Retrieve the user associated with the token
-        user = Token.objects.get(key=token).user
-        # Add the username to the response data
-        response.data['username'] = user.username
 
+class GuardedTokenObtainPairView(LoginGuardMixin, TokenObtainPairView):
+
+    def post(self, request, *args, **kwargs):
+        username = self.login_username(request)
+        self.check_login_guard(username)
+        try:
+            response = super().post(request, *args, **kwargs)
+        except AuthenticationFailed:
+            login_guard.record_failure(username)
+            raise
+        login_guard.reset(username)
         return response
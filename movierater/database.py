@@ -0,0 +1,112 @@
+"""
+DATABASES['default'] built from the environment.
+
+DATABASE_ENGINE picks the backend: 'sqlite' (the default) or 'postgres'.
+
+SQLite:
+    SQLITE_PATH              database file, default BASE_DIR / 'db.sqlite3'
+    SQLITE_TUNING            '0' keeps SQLite's own defaults (rollback journal, deferred BEGIN)
+    SQLITE_JOURNAL_MODE      default 'wal': readers no longer block the writer; stored in the
+                             database file, so it is set by migrate rather than per connection
+    SQLITE_SYNCHRONOUS       default 'normal': WAL stays consistent, fsync only at checkpoints
+    SQLITE_BUSY_TIMEOUT      milliseconds a writer waits for the lock, default 5000
+    SQLITE_MMAP_SIZE         bytes of the file read through mmap, default 256 MiB
+    SQLITE_TRANSACTION_MODE  default 'IMMEDIATE', see movierater.sqlite3
+
+Postgres:
+    POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT
+    DB_CONN_MAX_AGE          seconds a connection is reused across requests, default 60,
+                             'none' to keep connections open for good
+    DB_CONN_HEALTH_CHECKS    '1' (default) pings a reused connection before a request
+    DB_POOLER                'pgbouncer' when connecting through PgBouncer in transaction
+                             pooling mode; server-side cursors (used by .iterator()) do not
+                             survive across pooled transactions, so they are disabled
+"""
+import os
+
+SQLITE_DEFAULTS = {
+    'SQLITE_JOURNAL_MODE': 'wal',
+    'SQLITE_SYNCHRONOUS': 'normal',
+    'SQLITE_BUSY_TIMEOUT': '5000',
+    'SQLITE_MMAP_SIZE': str(256 * 1024 * 1024),
+    'SQLITE_TRANSACTION_MODE': 'IMMEDIATE',
+}
+
+
+def database_settings(base_dir, environ=os.environ):
+    engine = environ.get('DATABASE_ENGINE', 'sqlite').lower()
+    if engine in ('postgres', 'postgresql'):
+        return postgres_settings(environ)
+    if engine == 'sqlite':
+        return sqlite_settings(base_dir, environ)
+    raise ValueError(f'Unknown DATABASE_ENGINE {engine!r}, expected sqlite or postgres')
+
+
+def sqlite_settings(base_dir, environ=os.environ):
+    settings = {
+        'ENGINE': 'movierater.sqlite3',
+        'NAME': environ.get('SQLITE_PATH', base_dir / 'db.sqlite3'),
+        'OPTIONS': {},
+    }
+    if environ.get('SQLITE_TUNING', '1') == '0':
+        return settings
+
+    def get(name):
+        return environ.get(name, SQLITE_DEFAULTS[name])
+
+    # Applied once after migrate by apply_journal_mode()
+    settings['JOURNAL_MODE'] = get('SQLITE_JOURNAL_MODE')
+    # Applied to every new connection by apply_connection_pragmas()
+    settings['PRAGMAS'] = {
+        'synchronous': get('SQLITE_SYNCHRONOUS'),
+        'mmap_size': int(get('SQLITE_MMAP_SIZE')),
+    }
+    # sqlite3.connect() sets the busy timeout itself, taking it in seconds
+    settings['OPTIONS']['timeout'] = int(get('SQLITE_BUSY_TIMEOUT')) / 1000
+    if get('SQLITE_TRANSACTION_MODE'):
+        settings['OPTIONS']['transaction_mode'] = get('SQLITE_TRANSACTION_MODE').upper()
+    return settings
+
+
+def postgres_settings(environ=os.environ):
+    conn_max_age = environ.get('DB_CONN_MAX_AGE', '60')
+    settings = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': environ.get('POSTGRES_DB', 'movierater'),
+        'USER': environ.get('POSTGRES_USER', ''),
+        'PASSWORD': environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': environ.get('POSTGRES_HOST', ''),
+        'PORT': environ.get('POSTGRES_PORT', ''),
+        'CONN_MAX_AGE': None if conn_max_age.lower() == 'none' else int(conn_max_age),
+        'CONN_HEALTH_CHECKS': environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1',
+        'DISABLE_SERVER_SIDE_CURSORS': False,
+    }
+    if environ.get('DB_POOLER', '').lower() == 'pgbouncer':
+        settings['DISABLE_SERVER_SIDE_CURSORS'] = True
+    return settings
+
+
+def apply_connection_pragmas(sender, connection, **kwargs):
+    """
+    connection_created receiver running the PRAGMAS of the connection's DATABASES entry.
+    """
+    pragmas = connection.settings_dict.get('PRAGMAS')
+    if connection.vendor != 'sqlite' or not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def apply_journal_mode(sender, using, **kwargs):
+    """
+    post_migrate receiver setting the JOURNAL_MODE of the migrated DATABASES entry.
+    """
+    from django.db import connections
+
+    connection = connections[using]
+    journal_mode = connection.settings_dict.get('JOURNAL_MODE')
+    if connection.vendor != 'sqlite' or not journal_mode:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA journal_mode = {journal_mode}')
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from datetime import timedelta
 from pathlib import Path
 
+from movierater.database import database_settings
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -46,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the other middleware too
+    'api.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     # Cors middleware
@@ -83,13 +87,45 @@ WSGI_APPLICATION = 'movierater.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# SQLite (WAL, busy timeout) unless DATABASE_ENGINE=postgres; see movierater/database.py
 DATABASES = {
+    'default': database_settings(BASE_DIR),
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Point 'default' and 'auth' at a shared backend (Redis, Memcached) when running several
+# workers: user changes only invalidate the caches of the worker that made them
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Verified JWT -> user snapshots (api/authentication.py), LRU-bounded
+    'auth': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'jwt-users',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
 }
 
+# Response cache used by MovieListViewSet (api/cache.py)
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = 300
+
+# Cache alias for CachedJWTAuthentication, and how long (seconds) a user snapshot may be
+# served. With a per-process 'auth' cache this bounds how long other workers still accept
+# a deactivated user's token
+JWT_USER_CACHE_ALIAS = 'auth'
+JWT_USER_CACHE_MAX_TTL = 60
+
+# Movie leaderboards (api/leaderboards.py). Changes apply to new ratings; run
+# rebuild_leaderboards to rescore the existing ones
+LEADERBOARD_PRIOR_WEIGHT = 10
+LEADERBOARD_PRIOR_MEAN = 3.0
+LEADERBOARD_TRENDING_HALF_LIFE = 24 * 60 * 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -132,21 +168,32 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # REST Framework settings
 REST_FRAMEWORK = {
-    'DEFAULT_PERMISSION_CLASSES': {
+    'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    },
+    ],
     #  'DEFAULT_AUTHENTICATION_CLASSES': (
     #     'rest_framework.authentication.TokenAuthentication',
     # )
 
     # Jwt settings
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     ],
 
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
+
+    # Per-client limits on the endpoints that hash passwords (api/throttling.py)
+    'DEFAULT_THROTTLE_RATES': {
+        'login': '20/min',
+        'register': '10/min',
+    },
 }
 
+# Failed logins per username before further attempts are refused unhashed
+LOGIN_FAILURE_LIMIT = 5
+LOGIN_FAILURE_WINDOW = 15 * 60
+LOGIN_GUARD_CACHE_ALIAS = 'default'
+
 # CORS_ORIGIN_ALLOW_ALL = True
 
 CORS_ORIGIN_WHITELIST = [
@@ -165,4 +212,7 @@ SIMPLE_JWT = {
     'SIGNING_KEY': SECRET_KEY,
     'AUTH_HEADER_TYPES': ('Bearer',),
     'AUTH_HEADER_NAME': 'HTTP_AUTHORIZATION',
-}
\ No newline at end of file
+}
+# Movie full-text search (api/search.py), defaults to the backend matching the database:
+# SQLite FTS5 or Postgres tsvector/GIN. Run rebuild_search_index after changing it
+# MOVIE_SEARCH_BACKEND = 'api.search.SQLiteFTSBackend'
@@ -0,0 +1,24 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite backend with Django 5.1's "transaction_mode" option backported.
+
+    With the default deferred BEGIN, a transaction that reads before it writes must
+    upgrade its lock, and SQLite fails that upgrade at once with "database is locked"
+    instead of waiting out the busy timeout. OPTIONS = {"transaction_mode": "IMMEDIATE"}
+    takes the write lock at BEGIN, so concurrent writers queue on the busy timeout.
+    """
+    transaction_mode = None
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.transaction_mode = params.pop('transaction_mode', None)
+        return params
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode is None:
+            super()._start_transaction_under_autocommit()
+        else:
+            self.cursor().execute(f'BEGIN {self.transaction_mode}')